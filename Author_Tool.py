@@ -2,7 +2,7 @@ import streamlit as st
 from models.llm import getLLM
 from pages.views.book_list import book_list
 from utils import getLogger
-from models.book_maker import Book, Chapter
+from models.book_maker import Book, Chapter, AudiobookExport
 
 logger = getLogger('Author Tool')
 
@@ -42,25 +42,16 @@ def chapterLayout(chapter: Chapter):
 
             print(f"Changing chapter {key} number to {cur_number}")
 
-            # Walk through chapters in reverse, incrementing chapter number until
-            # we reach the current chapter
-            for chIndex in range(len(book.chapters) - 1, cur_number - 1, -1):
-                ch: Chapter = book.chapters[chIndex]
-                if ch.number >= cur_number:
-                    ch.number += 1
-            book.chapters[cur_number - 1].number = cur_number
-            
-            for chIndex in range(cur_number, len(book.chapters)):
-                ch: Chapter = book.chapters[chIndex]
-                if ch.number != chIndex + 1:
-                    ch.number = chIndex + 1
+            # Reordering only rewrites the chapter manifest
+            book.moveChapter(chapter, cur_number)
         st.number_input("Chapter", 0, 999, chapter.number, key=chapter_key, on_change=lambda: on_change_chapter_number(chapter_key))
     with colName:
-        def on_change_chapter(index: int):
-            print(f"Updating chapter name at index {i}")
-            chapter.name = st.session_state[f"chapter_name_{i}"]
+        name_key = f"chapter_name_{i}"
+        def on_change_chapter(key: str):
+            print(f"Updating chapter name for {key}")
+            chapter.name = st.session_state[key]
 
-        st.text_input("Name", value=chapter.name, key=f"chapter_name_{i}", on_change=lambda: on_change_name(i))
+        st.text_input("Name", value=chapter.name, key=name_key, on_change=lambda: on_change_chapter(name_key))
     
     with colDel:
         st.write("")
@@ -70,4 +61,29 @@ def chapterLayout(chapter: Chapter):
     
 for i in range(0, len(book.chapters)):
     chapter = book.chapters[i]
-    chapterLayout(chapter)
\ No newline at end of file
+    chapterLayout(chapter)
+
+st.divider()
+st.write("## Analysis")
+if st.button("Refresh Stale Chapters", help="Makes summaries, characters and evaluations again for the chapters edited since they were made"):
+    # Only the edited chapters are sent to the LLM again
+    refresh_progress = st.progress(0.0, text="Refreshing chapters")
+    def on_refresh_progress(done: int, total: int, chapter: Chapter):
+        text = f"Refreshing {chapter}" if chapter is not None else "Chapters refreshed"
+        refresh_progress.progress(done / total if total > 0 else 1.0, text=text)
+
+    refreshed = book.refreshStale(on_refresh_progress)
+    st.success(f"Refreshed {len(refreshed)} chapters")
+
+st.divider()
+st.write("## Audiobook")
+single_file = st.radio("Export as", ["One file per chapter", "One file for the book"], key="audiobook_layout", horizontal=True) == "One file for the book"
+if st.button("Export Audiobook"):
+    # Chapters finished by an earlier export are skipped, so an interrupted export continues where it stopped
+    export_progress = st.progress(0.0, text="Exporting audiobook")
+    def on_progress(done: int, total: int, chapter: Chapter):
+        text = f"Exporting {chapter}" if chapter is not None else "Audiobook exported"
+        export_progress.progress(done / total if total > 0 else 1.0, text=text)
+
+    exported = AudiobookExport(book, single_file).export(on_progress)
+    st.success(f"Exported {len(exported)} files to {book.storage.audiobookRoot}")
@@ -2,3 +2,4 @@ from .character import Character
 from .chapter import Chapter
 from .book import Book
 from .library import BookLibrary
+from .audiobook import AudiobookExport
@@ -0,0 +1,221 @@
+import os
+import re
+import wave
+import shutil
+import hashlib
+import threading
+from utils import getLogger, id3, mp3
+from utils.wav import WavWriter
+from .chapter import Chapter
+
+logger = getLogger('Audiobook')
+
+def _fileName(text: str) -> str:
+    """Removes the characters that are not safe in a file name"""
+    return re.sub(r'[^\w\- ]', '', text).strip()
+
+class AudiobookExport:
+    """Exports a book as audio, one file per chapter and optionally a single file for the whole book
+
+    Chapters are written from the paragraph speech cache, so only paragraphs
+    that have never been spoken are synthesized. Every finished chapter is
+    recorded in a progress manifest along with a fingerprint of its text and
+    voice, so an interrupted export picks up at the first unfinished chapter
+    and chapters that have not changed are never written again.
+    """
+    def __init__(self, book: any, single_file: bool = False):
+        self.book = book
+        self.storage = book.storage
+        self.llm = book.llm
+        self.single_file = single_file
+        self.format = self.llm.speech_format
+
+    def export(self, progress: any = None) -> [str]:
+        """Exports the book
+
+        Args:
+            progress (any): Called with the number of chapters done, the number of chapters and the chapter being exported
+
+        Returns:
+            [str]: The paths of the exported files
+
+        Chapters with paragraphs that could not be spoken are left out of the
+        manifest, so the next export tries them again, and the book file is
+        only joined once every chapter is complete.
+        """
+        manifest = self._loadManifest()
+        chapters = self.book.chapters
+        exported = []
+        complete = True
+
+        for i, chapter in enumerate(chapters):
+            if progress is not None:
+                progress(i, len(chapters), chapter)
+
+            entry = self._exportChapter(chapter, manifest['chapters'].get(chapter.id, None))
+            if entry is None:
+                complete = False
+                manifest['chapters'].pop(chapter.id, None)
+                continue
+
+            manifest['chapters'][chapter.id] = entry
+            self.storage.saveAudiobookProgress(manifest)
+            if entry['file'] is not None:
+                exported.append(f"{self.storage.audiobookRoot}/{entry['file']}")
+
+        # Drop the files of chapters that are no longer in the book
+        ids = [chapter.id for chapter in chapters]
+        for id in list(manifest['chapters'].keys()):
+            if id not in ids:
+                self._removeFile(manifest['chapters'].pop(id)['file'])
+        self.storage.saveAudiobookProgress(manifest)
+
+        if self.single_file and complete:
+            manifest['book'] = self._exportBook(chapters, manifest)
+            self.storage.saveAudiobookProgress(manifest)
+            exported = [f"{self.storage.audiobookRoot}/{manifest['book']['file']}"]
+
+        if progress is not None:
+            progress(len(chapters), len(chapters), None)
+        return exported
+
+    def _loadManifest(self) -> dict:
+        manifest = self.storage.loadAudiobookProgress()
+
+        # Files exported in another format cannot be reused
+        if manifest is None or manifest.get('format', None) != self.format:
+            manifest = { 'version': 1, 'format': self.format, 'chapters': {}, 'book': None }
+        return manifest
+
+    def _fingerprint(self, chapter: Chapter) -> str:
+        """Identifies the speech of a chapter, changing whenever its text, title or voice does"""
+        sha = hashlib.sha256(str(chapter).encode('utf-8'))
+        for paragraph in chapter.paragraphs:
+            sha.update((self.llm.speechKey(paragraph.text) or '').encode('utf-8'))
+        return sha.hexdigest()
+
+    def _chapterFile(self, chapter: Chapter) -> str:
+        name = _fileName(chapter.name or '')
+        if name == '':
+            return f"{chapter.number:03d}.{self.format}"
+        return f"{chapter.number:03d} {name}.{self.format}"
+
+    def _exportChapter(self, chapter: Chapter, entry: dict) -> dict:
+        fingerprint = self._fingerprint(chapter)
+        file = self._chapterFile(chapter)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            if entry['file'] is None:
+                return entry
+            if entry['file'] == file and os.path.exists(f"{self.storage.audiobookRoot}/{file}"):
+                logger.info(f"{chapter} is already exported")
+                return entry
+
+        if entry is not None:
+            self._removeFile(entry['file'])
+
+        logger.info(f"Exporting {chapter}")
+        if not os.path.exists(self.storage.audiobookRoot):
+            os.makedirs(self.storage.audiobookRoot)
+
+        path = f"{self.storage.audiobookRoot}/{file}"
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                if self.format == 'mp3':
+                    f.write(id3.tag([
+                        id3.textFrame('TIT2', str(chapter)),
+                        id3.textFrame('TALB', self.book.title),
+                        id3.textFrame('TRCK', str(chapter.number))
+                    ]))
+                written = chapter.writeAudio([paragraph.id for paragraph in chapter.paragraphs], f)
+                f.close()
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        spoken = len([paragraph for paragraph in chapter.paragraphs if paragraph.text.strip() != ''])
+        if written < spoken:
+            # The paragraphs that were spoken stay cached for the next attempt
+            logger.error(f"Only {written} of {spoken} paragraphs of {chapter} could be spoken")
+            os.remove(temp_path)
+            return None
+
+        if written == 0:
+            os.remove(temp_path)
+            return { 'fingerprint': fingerprint, 'file': None, 'title': str(chapter), 'duration': 0.0 }
+
+        os.replace(temp_path, path)
+        return { 'fingerprint': fingerprint, 'file': file, 'title': str(chapter), 'duration': self._duration(path) }
+
+    def _exportBook(self, chapters: [Chapter], manifest: dict) -> dict:
+        entries = [manifest['chapters'][chapter.id] for chapter in chapters]
+        entries = [entry for entry in entries if entry['file'] is not None]
+
+        fingerprint = hashlib.sha256("".join([entry['fingerprint'] for entry in entries]).encode('utf-8')).hexdigest()
+        file = f"{_fileName(self.book.title) or 'book'}.{self.format}"
+        book = manifest.get('book', None)
+        if book is not None and book['fingerprint'] == fingerprint and book['file'] == file and os.path.exists(f"{self.storage.audiobookRoot}/{file}"):
+            return book
+
+        if book is not None:
+            self._removeFile(book['file'])
+
+        logger.info(f"Joining {len(entries)} chapters into {file}")
+        path = f"{self.storage.audiobookRoot}/{file}"
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            if self.format == 'mp3':
+                self._joinMp3(entries, f)
+            else:
+                self._joinWav(entries, f)
+            f.close()
+
+        os.replace(temp_path, path)
+        return { 'fingerprint': fingerprint, 'file': file }
+
+    def _joinMp3(self, entries: [dict], sink: any):
+        # Chapter markers let players list and skip between chapters
+        frames = [id3.textFrame('TIT2', self.book.title), id3.textFrame('TALB', self.book.title)]
+        element_ids = []
+        start = 0.0
+        for i, entry in enumerate(entries):
+            element_id = f"chp{i}"
+            element_ids.append(element_id)
+            end = start + entry['duration']
+            frames.append(id3.chapterFrame(element_id, round(start * 1000), round(end * 1000), entry['title']))
+            start = end
+
+        if len(element_ids) > 255:
+            logger.warning("Only the first 255 chapters are listed in the table of contents")
+        frames.insert(0, id3.tableOfContents(element_ids[:255]))
+        sink.write(id3.tag(frames))
+
+        # Copy each chapter's audio without its own tag
+        for entry in entries:
+            with open(f"{self.storage.audiobookRoot}/{entry['file']}", "rb") as f:
+                f.seek(id3.tagLength(f.read(10)))
+                shutil.copyfileobj(f, sink)
+                f.close()
+
+    def _joinWav(self, entries: [dict], sink: any):
+        writer = WavWriter(sink)
+        for entry in entries:
+            with open(f"{self.storage.audiobookRoot}/{entry['file']}", "rb") as f:
+                writer.append(f.read())
+                f.close()
+        writer.close()
+
+    def _duration(self, path: str) -> float:
+        if self.format == 'mp3':
+            return mp3.fileDuration(path)
+
+        with wave.open(path, 'rb') as f:
+            return f.getnframes() / f.getframerate()
+
+    def _removeFile(self, file: str):
+        if file is None:
+            return
+
+        path = f"{self.storage.audiobookRoot}/{file}"
+        if os.path.exists(path):
+            os.remove(path)
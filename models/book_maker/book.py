@@ -1,6 +1,6 @@
 from models.book_maker.chapter import Chapter
 from models.book_maker.character import Character
-from utils import Storage
+from utils import openStorage
 import mammoth
 from io import StringIO
 from models.llm import getLLM
@@ -8,7 +8,7 @@ from models.llm import getLLM
 class Book:
     def __init__(self, title: str):
         self.title = title
-        self.storage = Storage(title)
+        self.storage = openStorage(title)
         self._chapters: list[Chapter] = None
         self._characters = None
         self._writing_style = None
@@ -41,13 +41,21 @@ class Book:
         if self._chapters is not None:
             return self._chapters
         
+        self._chapters = []
         if self.storage.exists():
-            chapterNames = self.storage.listChapters()
-            self._chapters = []
-            for chapterName in chapterNames:
-                self._chapters.append(Chapter(self, int(chapterName), self.storage))
+            # Chapters only know their id, number and name until their content is used
+            entries = self.storage.loadChapterOrder()
+            missingNames = False
+            for i, entry in enumerate(entries):
+                if 'name' not in entry:
+                    entry['name'] = self.storage.loadChapterName(entry['id'])
+                    missingNames = True
+                self._chapters.append(Chapter(self, entry['id'], i + 1, self.storage, entry['name']))
+
+            # Record the names in the manifest so the next open is a single read
+            if missingNames:
+                self.saveChapterOrder()
 
-        self._chapters.sort(key=lambda x: x.number)
         return self._chapters
 
     def getChapter(self, title: str):
@@ -56,29 +64,26 @@ class Book:
                 if str(chapter) == title:
                     return chapter
 
+    def saveChapterOrder(self):
+        """ Persists the chapter order and names, and renumbers the chapters to match it """
+        self.storage.saveChapterOrder([{ 'id': chapter.id, 'name': chapter.name } for chapter in self._chapters])
+        for i, chapter in enumerate(self._chapters):
+            chapter._number = i + 1
+
     def addChapter(self, afterChapter: int = None):
         """ Adds a new chapter to the book 
         
         Args:
             afterChapter (int): The chapter to insert after
         """
+        chapters = self.chapters
+        if afterChapter is None or afterChapter > len(chapters):
+            afterChapter = len(chapters)
 
-        if afterChapter is None:
-            chapter = Chapter(self, len(self._chapters) + 1, self.storage)
-            chapter.content = ""
-            self._chapters.append(chapter)
-            self._chapters.sort(key=lambda x: x.number)
-            return chapter
-
-        # In reverse order increase the number of all chapters after the afterChapter
-        for i in range(len(self._chapters) - 1, afterChapter - 1, -1):
-            self.storage.moveChapterNumber(self._chapters[i].number, self._chapters[i].number + 1)
-            self._chapters[i].number += 1
-
-        chapter = Chapter(self, afterChapter + 1, self.storage)
+        chapter = Chapter(self, self.storage.createChapterId(), afterChapter + 1, self.storage)
+        chapters.insert(afterChapter, chapter)
+        self.saveChapterOrder()
         chapter.content = ""
-        self._chapters.append(chapter)
-        self._chapters.sort(key=lambda x: x.number)
         return chapter
 
     def removeChapter(self, chapter: Chapter):
@@ -87,21 +92,64 @@ class Book:
         Args:
             chapter (Chapter): The chapter to remove
         """
-        self.storage.deleteChapter(chapter.number)
-        self._chapters.remove(chapter)
-        for i in range(chapter.number - 1, len(self._chapters)):
-            self._chapters[i].number -= 1
+        self.chapters.remove(chapter)
+        self.saveChapterOrder()
+        self.storage.deleteChapter(chapter.id, chapter.speechKeys())
+
+    def moveChapter(self, chapter: Chapter, number: int):
+        """Moves a chapter to a new position in the book
+
+        Args:
+            chapter (Chapter): The chapter to move
+            number (int): The new chapter number
+        """
+        chapters = self.chapters
+        number = max(1, min(number, len(chapters)))
+        chapters.remove(chapter)
+        chapters.insert(number - 1, chapter)
+        self.saveChapterOrder()
+
+    @property
+    def stale_chapters(self) -> [Chapter]:
+        """ The chapters with summaries, characters or evaluations made from content that has since been edited """
+        return [chapter for chapter in self.chapters if chapter.is_stale]
+
+    def refreshStale(self, progress: any = None) -> [Chapter]:
+        """ Derives again only what no longer matches the content of the edited chapters
+
+        Args:
+            progress (any): Called with the number of chapters done, the number of chapters and the chapter being refreshed
+
+        Returns:
+            [Chapter]: The chapters that were refreshed
+        """
+        stale = self.stale_chapters
+        for i, chapter in enumerate(stale):
+            if progress is not None:
+                progress(i, len(stale), chapter)
+            chapter.refreshStale()
+
+        if progress is not None:
+            progress(len(stale), len(stale), None)
+        return stale
 
     def loadFromContent(self, storyFile: any):
         story = mammoth.convert_to_markdown(storyFile).value
         chapterContent = story.split('#')
+        previous = list(self.chapters)
 
         # Add # back to the beginning of each chapter
-        self.chapters = []
+        self._chapters = []
         for i in range(0, len(chapterContent)):
-            chapter = Chapter(self, i + 1, self.storage)
+            chapter = Chapter(self, self.storage.createChapterId(), i + 1, self.storage)
             chapter.loadFromContent(chapterContent[i])
-            self.chapters.append(chapter)
+            self._chapters.append(chapter)
+
+        self.saveChapterOrder()
+
+        # The imported chapters replace the existing ones, which are only deleted once the new order is saved
+        for chapter in previous:
+            self.storage.deleteChapter(chapter.id, chapter.speechKeys())
 
     def getLatestCharacter(self, name: str) -> Character:
         """Gets the latest character based on the character's name
@@ -1,25 +1,89 @@
 import streamlit as st
 import json
 import pygame
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from utils import Storage, getLogger
 from .character import Character
+from .paragraph import Paragraph, ParagraphIndex, SEPARATOR, contentHash
 from models.llm import getLLM
+from models.llm.llm import BATCH_SEPARATOR
+from models.llm.tokens import TokenBudget
+from utils.wav import WavWriter
 
 logger = getLogger('Chapter')
 
+# Tokens kept free for the response when packing a prompt
+SUMMARY_RESPONSE_TOKENS = 400
+EVAL_RESPONSE_TOKENS = 1000
+
+# Segments of a long chapter summarized at once unless the content role is configured with 'max_concurrency'
+DEFAULT_SUMMARY_CONCURRENCY = 4
+
+# About one paragraph in this many ends a segment, so segment boundaries follow the text rather than its length
+SEGMENT_BREAK_INTERVAL = 4
+
+# Bumped whenever the prompt that derives an artifact changes, so what the old prompt made is seen as stale
+PROMPT_VERSIONS = {
+    'summary': 1,
+    'characters': 1,
+    'technical_eval': 1,
+    'entertainment_eval': 1,
+    'character_description': 1,
+    'character_summary': 1
+}
+
+SEGMENT_SUMMARY_PROMPT = "The following is a segment of a chapter. Summarize, in 200 words, the following to be used later to create a full summary and only return the summary: "
+
+def _withoutThinking(chunks):
+    """Drops the <think></think> reasoning some models stream before their answer"""
+    buffered = ""
+    thinking = None
+    for chunk in chunks:
+        if thinking is False:
+            yield chunk
+            continue
+
+        buffered += chunk
+        if thinking is None:
+            start = buffered.lstrip()
+            if len(start) < len("<think>") and "<think>".startswith(start):
+                continue
+            thinking = start.startswith("<think>")
+            if not thinking:
+                yield buffered
+                buffered = ""
+                continue
+
+        end = buffered.find("</think>")
+        if end != -1:
+            thinking = False
+            if buffered[end + 8:] != "":
+                yield buffered[end + 8:]
+            buffered = ""
+
+    # Reasoning that never ends is all there is to show
+    if buffered != "":
+        yield buffered
+
+def _evalJson(response: str) -> dict:
+    """Parses the JSON of an evaluation, which models return inside a ```json block"""
+    return json.loads(response[8:-3])
+
 class ChapterEval:
     def __init__(self, data: dict):
         self.score = int(data.get('score', 0))
         self.comments = data.get('comments', [])
 
 class Chapter:
-    def __init__(self, book: any, number: int, storage: Storage):
-        # Get first line as chapter name
-        self.name = None
+    def __init__(self, book: any, id: str, number: int, storage: Storage, name: str = None):
+        # Only the name and number are known up front, everything else loads on first use
+        self._name = name
         self.llm = getLLM()
         self.storage = storage
         self.book = book
+        self.id = id
         self._number = number
         self._characters = None
         self._content = None
@@ -27,45 +91,58 @@ class Chapter:
         self._edit_text = ''
         self._technical_eval = None
         self._entertainment_eval = None
+        self._summary = None
+        self._paragraphs = None
+        self._derived = None
+        self._content_hash = None
+        self._loaded = False
+
+    def _load(self):
+        """Loads the stored summary, characters and content of the chapter on first access"""
+        if self._loaded:
+            return
+        self._loaded = True
 
-        if storage.chapterExists(number):
-            self.name = storage.loadChapterName(number)
-            self.summary = storage.loadChapterSummary(number)
-            
-            characters = storage.loadChapterCharacters(number)
-            
-            if characters is not None:
-                self._characters = []
-                for character in characters:
-                    self._characters.append(Character(book, self, character, storage))
+        stored = self.storage.loadChapter(self.id)
+        if self._summary is None:
+            self._summary = stored['summary']
 
-            self._content = storage.loadChapterContent(number)
+        characters = stored['characters']
+        if self._characters is None and characters is not None:
+            self._characters = []
+            for character in characters:
+                self._characters.append(Character(self.book, self, character, self.storage))
+
+        if self._content is None:
+            self._content = stored['content']
+
+        # Sources are read with the stored content, so artifacts saved before they were recorded match what is on disk
+        self._derivedSources()
 
     def loadFromContent(self, content):
-        self.name = content.split("\n")[0].strip()
+        name = content.split("\n")[0].strip()
         # Check for : and remove chapter information to the left
-        if ":" in self.name:
-            self.name = self.name.split(":")[1].strip()
+        if ":" in name:
+            name = name.split(":")[1].strip()
 
         number = self.number
-        if self.name == f"Chapter {number}":
-            self.name = f""
+        if name == f"Chapter {number}":
+            name = f""
 
-        if self.name == "Chapter":
-            self.name = ""
+        if name == "Chapter":
+            name = ""
 
+        self.name = name
         self.title = f"Chapter {number}"
         if self.name != "":
             self.title += f": {self.name}"
 
-        self.number = number
-        
         # Remove first line from content
         self.content = content[(len(self.name) + 1):]
 
         self.summary = None
 
-        self.storage.saveChapterContent(self.number, self.content)
+        self.storage.saveChapterContent(self.id, self.content)
 
     def __str__(self):
         if self.name is None:
@@ -77,6 +154,20 @@ class Chapter:
     def __repr__(self):
         return f"# {self}\n{self.content}\n"
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name: str):
+        self._name = name
+        if name is not None:
+            self.storage.saveChapterName(self.id, name)
+
+        # Keep the name in the book's manifest current once the chapter is part of it
+        if self.book._chapters is not None and self in self.book._chapters:
+            self.book.saveChapterOrder()
+
     @property
     def number(self):
         return self._number
@@ -88,20 +179,64 @@ class Chapter:
             return
         
         logger.info(f"Changing chapter from {self._number} to {number}")
-        self.storage.moveChapterNumber(self._number, number)
-        self._number = number
+        self.book.moveChapter(self, number)
 
     @property
     def content(self):
+        self._load()
         return self._content
 
     @content.setter
     def content(self, content: str):
+        previous = self.content
         self._content = content
-        self.storage.saveChapterContent(self.number, content)
+        self.storage.queueChapterContent(self.id, content)
+        if previous is not None:
+            self._releaseSpeech(previous.split(SEPARATOR), (content or '').split(SEPARATOR))
+
+        if self._paragraphs is not None:
+            self._paragraphs.update(content)
+            self.storage.queueParagraphIndex(self.id, self._paragraphs.entries())
+
+    @property
+    def paragraphs(self) -> ParagraphIndex:
+        """The paragraphs of the chapter, with ids that stay stable as the content is edited"""
+        if self._paragraphs is not None:
+            return self._paragraphs
+
+        content = self.content if self.content is not None else ''
+        stored = self.storage.loadParagraphIndex(self.id)
+        self._paragraphs = ParagraphIndex(content, stored)
+        self.storage.queueParagraphIndex(self.id, self._paragraphs.entries())
+        return self._paragraphs
+
+    def replaceParagraphs(self, paragraphs: [str], text: str) -> [str]:
+        """Replaces a run of consecutive paragraphs with new text
+
+        Args:
+            paragraphs ([str]): The ids of the paragraphs to replace, from the first to the last
+            text (str): The text that replaces them
+
+        Returns:
+            [str]: The ids of the paragraphs that now hold the text, or None if the paragraphs were not found or not consecutive
+        """
+        replaced = [self.paragraphs.get(id).text for id in paragraphs if self.paragraphs.get(id) is not None]
+        span = self.paragraphs.splice(paragraphs, text)
+        if span is None:
+            return None
+
+        start, end = span
+        self._content = self._content[:start] + text + self._content[end:]
+        self._releaseSpeech(replaced, [paragraph.text for paragraph in self._paragraphs])
+        self.storage.queueChapterContent(self.id, self._content)
+        self.storage.queueParagraphIndex(self.id, self._paragraphs.entries())
+
+        first = min([self._paragraphs.position(id) for id in paragraphs if self._paragraphs.position(id) is not None])
+        return [self._paragraphs[position].id for position in range(first, first + len(text.split(SEPARATOR)))]
 
     @property
     def characters(self):
+        self._load()
         if self._characters is not None:
             return self._characters
 
@@ -110,7 +245,7 @@ class Chapter:
 
         prev_characters = self.book.characters
         prev_characters_str = ", ".join(prev_characters)
-        characterResult = self.llm.prompt(f"List the main characters in the following chapter. Only include the characters in the response in a json string array without annotation. The current known characters are: {prev_characters_str}. If an existing character's first or last name is found, use the existing name from the list. Look in the chapter: " + self.content)
+        characterResult = self.llm.prompt(f"List the main characters in the following chapter. Only include the characters in the response in a json string array without annotation. The current known characters are: {prev_characters_str}. If an existing character's first or last name is found, use the existing name from the list. Look in the chapter: " + self.content, validate=json.loads)
 
         if characterResult is None:
             return "No characters found"
@@ -123,55 +258,303 @@ class Chapter:
             names.append(name)
             self._characters.append(Character(self.book, self, name, self.storage))
 
-        self.storage.saveChapterCharacters(self.number, names)
+        self.storage.saveChapterCharacters(self.id, names)
+        self.recordDerived('characters', 'characters')
         return self._characters
 
+    @property
+    def content_hash(self) -> str:
+        """The hash of the chapter's content, recorded with everything derived from it"""
+        content = self.content or ''
+        # Hashed again only once the content has been replaced
+        if self._content_hash is None or self._content_hash[0] is not content:
+            self._content_hash = (content, contentHash(content))
+        return self._content_hash[1]
+
+    def _derivedSources(self) -> dict:
+        if self._derived is None:
+            self._derived = self.storage.loadDerivedSources(self.id)
+
+            # Artifacts saved before sources were recorded are taken to match the content the chapter was stored with
+            legacy = [(artifact, kind) for artifact, kind in self._storedArtifacts() if artifact not in self._derived]
+            for artifact, kind in legacy:
+                self._derived[artifact] = {
+                    'source': self.content_hash,
+                    'version': PROMPT_VERSIONS[kind],
+                    'model': None
+                }
+            if len(legacy) > 0:
+                self.storage.saveDerivedSources(self.id, self._derived)
+        return self._derived
+
+    def _storedArtifacts(self) -> [tuple]:
+        """The artifact and kind of everything stored that was derived from the chapter and its characters"""
+        self._load()
+        stored = []
+        if self._summary is not None:
+            stored.append(('summary', 'summary'))
+        if self.storage.loadChapterTechnicalEval(self.id) is not None:
+            stored.append(('technical_eval', 'technical_eval'))
+        if self.storage.loadChapterEntertainmentEval(self.id) is not None:
+            stored.append(('entertainment_eval', 'entertainment_eval'))
+
+        # Characters that have not been listed yet have nothing derived
+        if self._characters is not None:
+            stored.append(('characters', 'characters'))
+            for character in self._characters:
+                stored += character.storedArtifacts()
+        return stored
+
+    def recordDerived(self, artifact: str, kind: str, role: str = 'content'):
+        """Records that an artifact was just derived from the current content
+
+        Args:
+            artifact (str): The name of the artifact, such as 'summary' or 'characters/{name}/description'
+            kind (str): The kind of artifact, which picks its prompt version from PROMPT_VERSIONS
+            role (str): The LLM role that made it
+        """
+        self._derivedSources()[artifact] = {
+            'source': self.content_hash,
+            'version': PROMPT_VERSIONS[kind],
+            'model': self.llm.modelSignature(role)
+        }
+        self.storage.saveDerivedSources(self.id, self._derived)
+
+    def isDerivedStale(self, artifact: str, kind: str) -> bool:
+        """True if an artifact was made from other content or an older prompt"""
+        source = self._derivedSources().get(artifact, None)
+        if source is None:
+            # Not stored yet, so there is nothing to refresh
+            return False
+        return source['source'] != self.content_hash or source.get('version', None) != PROMPT_VERSIONS[kind]
+
+    def staleArtifacts(self) -> [str]:
+        """Lists the stored artifacts derived from the chapter, and from its characters, that no longer match its content"""
+        return [artifact for artifact, kind in self._storedArtifacts() if self.isDerivedStale(artifact, kind)]
+
+    @property
+    def is_stale(self) -> bool:
+        """True if anything derived from the chapter was made from content that has since been edited"""
+        return len(self.staleArtifacts()) > 0
+
+    def refreshStale(self) -> [str]:
+        """Derives again only the artifacts that no longer match the chapter's content
+
+        Returns:
+            [str]: The artifacts that were refreshed
+        """
+        stale = self.staleArtifacts()
+        if len(stale) == 0:
+            return stale
+
+        logger.info(f"Refreshing {', '.join(stale)} of {self}")
+        if 'characters' in stale:
+            self._characters = None
+            self.characters
+
+        # Characters listed again start out with nothing derived
+        for character in self._characters or []:
+            character.refreshStale()
+
+        if 'summary' in stale:
+            # Small edits update the summary from the changed passages
+            "".join(self.streamSummary(refresh=True))
+        if 'technical_eval' in stale:
+            self.evalTechnical(refresh=True)
+        if 'entertainment_eval' in stale:
+            self.evalEntertainment(refresh=True)
+        return stale
+
+    @property
+    def has_summary(self) -> bool:
+        """True if the summary has already been made, so showing it does not call the LLM"""
+        self._load()
+        return self._summary is not None
+
     @property
     def summary(self):
+        self._load()
         if self._summary is not None:
             return self._summary
 
+        return "".join(self.streamSummary())
+
+    def streamSummary(self, refresh: bool = False):
+        """Yields the summary of the chapter as the LLM writes it, saving it once it is complete
+
+        Args:
+            refresh (bool): True to summarize the chapter again even though a summary is stored.
+                When only a small part of the chapter changed, the stored summary is updated from the changed passages.
+        """
+        self._load()
+        if self._summary is not None and not refresh:
+            yield self._summary
+            return
+
         if self.content is None or self.content.strip() == '':
-            return "No summary available"
-
-        tokens = self.content.split(" ");
-
-        if len(tokens) > self.llm.max_tokens:
-            summaries = []
-            max_tokens = self.llm.max_tokens - 200
-            top_range = int(len(tokens) / max_tokens)
-            for i in range(0, top_range + 1):
-                start = (i * max_tokens) - 50
-                if start < 0:
-                    start = 0
-                storyPart = " ".join(tokens[start:i* max_tokens])
-                summary = self.llm.prompt("The following is a segment of a chapter. Summarize, in 200 words, the following to be used later to create a full summary and only return the summary: " + storyPart)
-
-                if summary is not None:
-                    # Remove "<think></think>" from the summary
-                    indexOfEndThink = summary.find("</think>")
-                    if indexOfEndThink != -1:
-                        summary = summary[indexOfEndThink + 8:]
-
-                    # Add summary to summaries
-                    summaries.append(summary)
-            
-            summariesStr = " ".join(summaries)
-            self._summary = self.llm.prompt("Summarize the following: " + " ".join(summariesStr))
-        else:
-            summary = self.llm.prompt("Summarize the following chapter. Only include the summary in the response: " + self.content)
-            indexOfEndThink = summary.find("</think>")
-            if indexOfEndThink != -1:
-                summary = summary[indexOfEndThink + 8:]
+            yield "No summary available"
+            return
 
-            self._summary = summary
+        budget = self.llm.budget('content', SUMMARY_RESPONSE_TOKENS)
+        prompt = None
+        if self._summary is not None:
+            prompt = self._summaryUpdatePrompt(self._summary, budget)
 
-        if self._summary is None:
-            return "No summary available"
+        if prompt is None:
+            prompt = self._summaryPrompt(budget)
 
-        self.storage.saveChapterSummary(self.number, self._summary)
-        return self._summary
+        parts = []
+        for delta in _withoutThinking(self.llm.streamPrompt(prompt)):
+            parts.append(delta)
+            yield delta
+
+        summary = "".join(parts)
+        indexOfEndThink = summary.find("</think>")
+        if indexOfEndThink != -1:
+            summary = summary[indexOfEndThink + 8:]
+
+        if summary.strip() == '':
+            yield "No summary available"
+            return
+
+        self._summary = summary
+        self.storage.saveChapterSummary(self.id, self._summary)
+        self.storage.saveSummarySource(self.id, self.content)
+        self.recordDerived('summary', 'summary')
     
+    def _summaryPrompt(self, budget: TokenBudget) -> str:
+        """Builds the prompt that summarizes the whole chapter, first summarizing its segments when it does not fit the context"""
+        prompt = "Summarize the following chapter. Only include the summary in the response: " + self.content
+        if budget.fits(prompt):
+            return prompt
+
+        # Summarize segments that fit the context, then summarize the summaries
+        stored = self.storage.loadSegmentSummaries(self.id)
+        used = {}
+        segment_size = budget.available(SEGMENT_SUMMARY_PROMPT)
+        paragraphs = list(self.paragraphs)
+        breaks = [int(paragraph.hash[:8], 16) % SEGMENT_BREAK_INTERVAL == 0 for paragraph in paragraphs]
+        segments = budget.chunk([paragraph.text for paragraph in paragraphs], segment_size, breaks)
+        summaries = self._summarizeSegments(segments, stored, used)
+        while not budget.fits("Summarize the following: " + SEPARATOR.join(summaries)):
+            reduced = self._summarizeSegments(budget.chunk(summaries, segment_size), stored, used)
+            if len(reduced) >= len(summaries):
+                logger.warning(f"Could not reduce the segment summaries of {self} to fit the context")
+                summaries = budget.head(summaries, budget.available("Summarize the following: "))
+                break
+            summaries = reduced
+
+        # Only the segments of the current text are kept
+        self.storage.saveSegmentSummaries(self.id, used)
+        return "Summarize the following: " + SEPARATOR.join(summaries)
+
+    def _summaryUpdatePrompt(self, summary: str, budget: TokenBudget) -> str:
+        """Builds a prompt that updates a summary from only the passages edited since it was made
+
+        Args:
+            summary (str): The stored summary
+            budget (TokenBudget): The budget the prompt has to fit
+
+        Returns:
+            str: The prompt, or None if the chapter should be summarized in full
+        """
+        source = self.storage.loadSummarySource(self.id)
+        if source is None:
+            return None
+
+        before = [paragraph.text for paragraph in ParagraphIndex(source)]
+        after = [paragraph.text for paragraph in self.paragraphs]
+        changes = []
+        changed = 0
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, before, after, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                continue
+
+            removed = SEPARATOR.join(before[i1:i2])
+            added = SEPARATOR.join(after[j1:j2])
+            changed += len(removed) + len(added)
+            if tag == 'replace':
+                changes.append(f"This passage:\n{removed}\nwas rewritten as:\n{added}")
+            elif tag == 'delete':
+                changes.append(f"This passage was removed:\n{removed}")
+            else:
+                changes.append(f"This passage was added:\n{added}")
+
+        # Nothing to describe, such as when only the prompt version changed
+        if len(changes) == 0:
+            return None
+
+        ratio = changed / max(len(self.content), 1)
+        if ratio > self.llm.summary_change_ratio:
+            logger.info(f"{ratio:.0%} of {self} changed, summarizing it in full")
+            return None
+
+        prompt = f"The following is the summary of a chapter:\n{summary}\n\nThe chapter has since been edited. The edits are:\n\n" + "\n\n".join(changes)
+        prompt += "\n\nUpdate the summary to reflect the edits, keeping everything the edits do not affect. Only include the summary in the response."
+        if not budget.fits(prompt):
+            return None
+
+        logger.info(f"Updating the summary of {self} from {len(changes)} edited passages")
+        return prompt
+
+    def _summarizeSegments(self, segments: [[str]], stored: dict, used: dict) -> [str]:
+        """Summarizes segments of paragraphs concurrently, reusing the stored summaries of segments whose text has not changed
+
+        Args:
+            segments ([[str]]): The paragraphs of each segment
+            stored (dict): The summaries from the last time, keyed by the hash of each segment's text
+            used (dict): Receives the summary of every segment, keyed the same way
+
+        Returns:
+            [str]: The summary of each segment in order, leaving out segments the LLM could not summarize
+        """
+        keys = [contentHash(SEPARATOR.join(segment)) for segment in segments]
+        missing = {}
+        for key, segment in zip(keys, segments):
+            if key not in stored and key not in used:
+                missing[key] = segment
+
+        if len(missing) > 0:
+            logger.info(f"Summarizing {len(missing)} of {len(segments)} segments of {self}")
+            workers = self.llm.limiter('content').max_in_flight or DEFAULT_SUMMARY_CONCURRENCY
+            with ThreadPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+                futures = { key: executor.submit(self._summarizeSegment, segment) for key, segment in missing.items() }
+                for key, future in futures.items():
+                    try:
+                        summary = future.result()
+                    except Exception as e:
+                        logger.error(f"Summarizing a segment of {self} failed: {e}")
+                        continue
+                    if summary is not None:
+                        used[key] = summary
+
+        summaries = []
+        for key in keys:
+            summary = used.get(key, None) or stored.get(key, None)
+            if summary is not None:
+                used[key] = summary
+                summaries.append(summary)
+        return summaries
+
+    def _summarizeSegment(self, segment: [str]) -> str:
+        summary = self.llm.prompt(SEGMENT_SUMMARY_PROMPT + SEPARATOR.join(segment))
+        if summary is None:
+            return None
+
+        # Remove "<think></think>" from the summary
+        indexOfEndThink = summary.find("</think>")
+        if indexOfEndThink != -1:
+            summary = summary[indexOfEndThink + 8:]
+        return summary.strip()
+
+    def _fitContent(self, budget: TokenBudget, used: int) -> str:
+        """Returns as much of the chapter, from its start, as fits in the budget beside the tokens already used"""
+        paragraphs = [paragraph.text for paragraph in self.paragraphs]
+        fitted = budget.head(paragraphs, budget.limit - used)
+        if len(fitted) < len(paragraphs):
+            logger.warning(f"Only the first {len(fitted)} of {len(paragraphs)} paragraphs of {self} fit in the context")
+        return SEPARATOR.join(fitted)
+
     @summary.setter
     def summary(self, value):
         self._summary = value
@@ -195,52 +578,245 @@ class Chapter:
         else:
             self._edit_text = value
 
-    def clearAudio(self, paragraph: int):
-        self.storage.saveParagraphAudio(self.number, paragraph, None)
+    def speechKeys(self) -> [str]:
+        """The keys of the speech of the chapter's paragraphs in the configured voice"""
+        if self.content is None:
+            return []
+        keys = [self.llm.speechKey(paragraph.text) for paragraph in self.paragraphs]
+        return [key for key in keys if key is not None]
+
+    def _releaseSpeech(self, removed: [str], kept: [str]):
+        # Speech is shared by identical text, so only text the chapter no longer has is released
+        kept = set(kept)
+        for text in set(removed):
+            if text in kept:
+                continue
+            key = self.llm.speechKey(text)
+            if key is not None:
+                self.storage.saveSpeechAudio(key, None)
+
+    def clearAudio(self, paragraph: str):
+        paragraph = self.paragraphs.get(paragraph)
+        if paragraph is None:
+            return
+
+        key = self.llm.speechKey(paragraph.text)
+        if key is not None:
+            self.storage.saveSpeechAudio(key, None)
 
-    def playParagraphs(self, paragraphs: [int]):
+    def playParagraphs(self, paragraphs: [str]):
         st.session_state['play'] = True
-        for i in paragraphs:
-            self.playParagraph(i)
+        # Later paragraphs are synthesized while the earlier ones play
+        for audio in self.streamAudio(paragraphs):
+            self._playAudio(audio)
             
             # Check to see if the user wants to stop
             if not st.session_state['play']:
                 break
 
-    def getParagraphAudio(self, paragraphs: [str], paragraph: int):
+    def getParagraphAudio(self, paragraph: Paragraph):
         if self.content is None or self.content.strip() == '':
             return None
 
-        # Get audio from storage
-        existing_audio = self.storage.getParagraphAudio(self.number, paragraph)
-        if existing_audio is not None:
-            return existing_audio
-            
-        # Construct audio from paragraphs
-        paragraph_content = paragraphs[paragraph]
-        new_audio = self.llm.getSpeech(paragraph_content)
-
-        self.storage.saveParagraphAudio(self.number, paragraph, new_audio)
+        # Audio is cached by its text and voice, so it follows the paragraph wherever it moves
+        key = self.llm.speechKey(paragraph.text)
+        if key is not None:
+            existing_audio = self.storage.loadSpeechAudio(key)
+            if existing_audio is not None:
+                return existing_audio
+
+        # Construct audio from the paragraph
+        new_audio = self._synthesizeAudio(paragraph.text, key)
+        if key is not None:
+            return self.storage.loadSpeechAudio(key)
         return new_audio
 
-    def getAudio(self, paragraphs: [int]) -> bytes:
-        if self.content is None or self.content.strip() == '':
+    def _synthesizeAudio(self, text: str, key: str) -> bytes:
+        """Synthesizes speech, streaming it straight into the cache when the voice has a key
+
+        Returns:
+            bytes: The audio when it could not be cached, otherwise None
+        """
+        if key is None:
+            return self.llm.getSpeech(text)
+
+        self.storage.saveSpeechStream(key, self.llm.streamSpeech(text))
+        return None
+
+    def _synthesizeBatch(self, batch: [tuple]):
+        """Synthesizes several short paragraphs in one request and caches each of them
+
+        Falls back to one request per paragraph when the batched audio cannot be split.
+
+        Args:
+            batch ([tuple]): The text and speech key of each paragraph
+        """
+        parts = None
+        try:
+            parts = self.llm.getBatchSpeech([text for (text, _) in batch])
+        except Exception as e:
+            logger.warning(f"Batched speech failed, synthesizing paragraphs one at a time: {e}")
+
+        if parts is None:
+            for text, key in batch:
+                try:
+                    self._synthesizeAudio(text, key)
+                except Exception as e:
+                    logger.error(f"Failed to synthesize audio: {e}")
             return None
 
-        paragraph_content = self.content.split("\n\n")
-        audio = b''
-        for paragraph in paragraphs:
-            par_audio = self.getParagraphAudio(paragraph_content, paragraph)
-            if par_audio is not None:
-                audio += par_audio
+        for (_, key), part in zip(batch, parts):
+            self.storage.saveSpeechAudio(key, part)
+        return None
 
-        return audio
+    def _startAudio(self, executor: ThreadPoolExecutor, paragraphs: [Paragraph]) -> [tuple]:
+        """Starts synthesizing the paragraphs missing from the cache
 
-    def playParagraph(self, paragraph: int):
-        audio = self.getAudio(paragraph)
-        if audio is None:
+        Runs of short paragraphs are packed into batched requests up to the
+        voice's character limit, everything else is synthesized on its own.
+
+        Returns:
+            [tuple]: Each paragraph with its speech key and the future synthesizing it, or None if it is cached
+        """
+        batch_limit = self.llm.speech_batch_characters
+        started = []
+        futures = {}
+        batch = []
+        batch_length = 0
+
+        def submitBatch():
+            nonlocal batch_length
+            batch_length = 0
+            if len(batch) == 1:
+                text, key = batch[0]
+                futures[key] = executor.submit(self._synthesizeAudio, text, key)
+            elif len(batch) > 1:
+                future = executor.submit(self._synthesizeBatch, list(batch))
+                for _, key in batch:
+                    futures[key] = future
+            batch.clear()
+
+        for paragraph in paragraphs:
+            key = self.llm.speechKey(paragraph.text)
+            if key is not None and self.storage.audioCache.path(key) is not None:
+                started.append((paragraph, key, None))
+                continue
+
+            # Paragraphs with the same text are only synthesized once
+            group = key if key is not None else paragraph.id
+            if group in futures or any(key == queued for (_, queued) in batch):
+                started.append((paragraph, key, group))
+                continue
+
+            short = key is not None and len(paragraph.text) < self.llm.batch_paragraph_characters
+            if batch_limit > 0 and short:
+                length = batch_length + len(paragraph.text) + (len(BATCH_SEPARATOR) if len(batch) > 0 else 0)
+                if length > batch_limit:
+                    submitBatch()
+                    length = len(paragraph.text)
+                batch.append((paragraph.text, key))
+                batch_length = length
+            else:
+                submitBatch()
+                futures[group] = executor.submit(self._synthesizeAudio, paragraph.text, key)
+            started.append((paragraph, key, group))
+
+        submitBatch()
+        return [(paragraph, key, futures[group] if group is not None else None) for (paragraph, key, group) in started]
+
+    def _readyAudio(self, paragraphs: [str]):
+        """Yields each paragraph's speech key and uncached audio, in order, once its speech is ready"""
+        if self.content is None or self.content.strip() == '':
             return
 
+        selected = [self.paragraphs.get(paragraph_id) for paragraph_id in paragraphs]
+        selected = [paragraph for paragraph in selected if paragraph is not None]
+
+        executor = ThreadPoolExecutor(max_workers=self.llm.speech_concurrency)
+        try:
+            for paragraph, key, future in self._startAudio(executor, selected):
+                audio = None
+                if future is not None:
+                    try:
+                        audio = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to synthesize audio: {e}")
+                        continue
+
+                yield (key, audio)
+        finally:
+            # Synthesis already running still completes and is cached
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def streamAudio(self, paragraphs: [str]):
+        """Yields the audio of paragraphs in order, each as soon as it is ready
+
+        Every paragraph missing from the cache starts synthesizing right away,
+        so later paragraphs are prepared while the earlier ones are consumed.
+        Each paragraph is cached as soon as its speech is ready, so a stream
+        that is stopped early keeps the audio it has already produced.
+
+        Args:
+            paragraphs ([str]): The ids of the paragraphs
+
+        Yields:
+            bytes: The audio of each paragraph that has speech
+        """
+        for key, audio in self._readyAudio(paragraphs):
+            if audio is None and key is not None:
+                audio = self.storage.loadSpeechAudio(key)
+
+            if audio is not None:
+                yield audio
+
+    def writeAudio(self, paragraphs: [str], sink: any) -> int:
+        """Writes the audio of paragraphs in order into a file-like sink
+
+        Cached paragraphs are copied from their files a block at a time, so
+        the audio of a whole chapter is never held in memory at once.
+
+        Args:
+            paragraphs ([str]): The ids of the paragraphs
+            sink (any): The writable binary file to write into
+
+        Returns:
+            int: The number of paragraphs written
+        """
+        if self.llm.speech_format == 'wav':
+            return self._writeWavAudio(paragraphs, sink)
+
+        written = 0
+        for key, audio in self._readyAudio(paragraphs):
+            if audio is not None:
+                sink.write(audio)
+                written += 1
+            elif key is not None and self.storage.writeSpeechAudio(key, sink):
+                written += 1
+
+        return written
+
+    def _writeWavAudio(self, paragraphs: [str], sink: any) -> int:
+        # WAV parts share one header, so their samples are joined rather than their files
+        writer = WavWriter(sink)
+        written = 0
+        for key, audio in self._readyAudio(paragraphs):
+            if audio is None and key is not None:
+                audio = self.storage.loadSpeechAudio(key)
+            if audio is not None and writer.append(audio):
+                written += 1
+
+        writer.close()
+        return written
+
+    def getAudio(self, paragraphs: [str]) -> bytes:
+        if self.content is None or self.content.strip() == '':
+            return None
+
+        output = BytesIO()
+        self.writeAudio(paragraphs, output)
+        return output.getvalue()
+
+    def _playAudio(self, audio: bytes):
         try:
             pygame.mixer.init()
             mp3_file = BytesIO(audio)
@@ -253,6 +829,13 @@ class Chapter:
         finally:
             pygame.mixer.quit()
 
+    def playParagraph(self, paragraph: str):
+        audio = self.getAudio([paragraph])
+        if audio is None or len(audio) == 0:
+            return
+
+        self._playAudio(audio)
+
     def getCharacter(self, name: str) -> Character:
         """Gets a character based on the character's name
 
@@ -263,6 +846,7 @@ class Chapter:
             Character: The character object
         """
 
+        self._load()
         if self._characters is None:
             return None
         for character in self.characters:
@@ -277,6 +861,7 @@ class Chapter:
         Args:
             name (str): The name of the character
         """
+        self._load()
         if self._characters is None:
             self._characters = []
 
@@ -286,43 +871,59 @@ class Chapter:
         for character in self._characters:
             names.append(character.name)
 
-        self.storage.saveChapterCharacters(self.number, names)
+        self.storage.saveChapterCharacters(self.id, names)
         return character
 
-    def evalTechnical(self):
+    def evalTechnical(self, refresh: bool = False):
         """Evaluates the technical details of the chapter
+
+        Args:
+            refresh (bool): True to ask the LLM again rather than reuse a cached evaluation of the same content
         """
         if self.content is None or self.content.strip() == '':
             return "No technical evaluation available"
 
-        conversation = []
-        for character in self.characters:
-            conversation.append({ "role": "user", "content": f"The character {character.name} has expertise in the following:\n{character.expertise}"})
-            conversation.append({ "role": "ai", "content": "I will take this into account"})
-
-        conversation.append({"role": "user", "content": f"The following is the current chapter: {self.content}"})
-        conversation.append({"role": "ai", "content": "I will take this into account"})
-
-        conversation.append({ "role": "user", "content": f"""
+        instructions = { "role": "user", "content": f"""
         You are an expert in the fields that the characters are experts in. 
         Evaluate the technical details of the following chapter and identify all incongruence and misstatements when it comes to the technical expertise of the characters in the chapter. Take into account
         Who is communicating and who they are communicating to, to ensure things like simplification of concepts are taken into account.
         If a character states something that mitigates the concern, do not include the feedback.
         In the response, if something is generally aligned, then don't include it in the feedback. Only include the specific bullet pointed issues with the chapter while considering of the situation the characters find themselves in
         the current chapter. Return only negative feedback, and exclude positive feedback. The format of the result is JSON with the following structure: {{ "score": int, "comments": [str] }}
-        """})
+        """}
+        acknowledgement = { "role": "ai", "content": "I will take this into account"}
+
+        # The chapter and instructions come first, then as many character expertises as still fit
+        budget = self.llm.budget('tech_eval', EVAL_RESPONSE_TOKENS)
+        prefix = "The following is the current chapter: "
+        content = self._fitContent(budget, budget.countMessages([{ "role": "user", "content": prefix }, acknowledgement, instructions]))
+        chapter = [{"role": "user", "content": prefix + content}, acknowledgement, instructions]
+
+        conversation = []
+        remaining = budget.limit - budget.countMessages(chapter)
+        for character in self.characters:
+            expertise = [{ "role": "user", "content": f"The character {character.name} has expertise in the following:\n{character.expertise}"}, acknowledgement]
+            remaining -= budget.countMessages(expertise)
+            if remaining < 0:
+                logger.warning(f"Not every character's expertise fits in the context of {self}")
+                break
+            conversation += expertise
+
+        conversation += chapter
 
         try:
-            evalStr = self.llm.techEval(conversation)
+            evalStr = self.llm.techEval(conversation, cache=not refresh, validate=_evalJson)
             if evalStr is None:
                 self._technical_eval = None
                 return None
             
             evalStr = evalStr[8:-3]
             logger.info(evalStr)
-            self.storage.saveChapterTechnicalEval(self.number, evalStr)
+            self.storage.saveChapterTechnicalEval(self.id, evalStr)
+            self.recordDerived('technical_eval', 'technical_eval', 'tech_eval')
             self._technical_eval = ChapterEval(json.loads(evalStr))
-        except:
+        except Exception as e:
+            logger.error(f"Technical Eval Failed {e}")
             return None
         
         return self._technical_eval
@@ -335,7 +936,7 @@ class Chapter:
             return self._technical_eval
 
         # Load technical eval from storage
-        evalStr = self.storage.loadChapterTechnicalEval(self.number)
+        evalStr = self.storage.loadChapterTechnicalEval(self.id)
         if evalStr is not None:
             self._technical_eval = ChapterEval(json.loads(evalStr))
             if self._technical_eval is not None:
@@ -346,38 +947,53 @@ class Chapter:
     @technical_eval.setter
     def technical_eval(self, value):
         self._technical_eval = value
-        self.storage.saveChapterTechnicalEval(self.number, json.dumps(value.__dict__))
+        self.storage.saveChapterTechnicalEval(self.id, json.dumps(value.__dict__))
+        self.recordDerived('technical_eval', 'technical_eval', 'tech_eval')
 
-    def evalEntertainment(self) -> ChapterEval:
-        """Uses the LLM to evaluate the entertainment value of the current chapter"""
+    def evalEntertainment(self, refresh: bool = False) -> ChapterEval:
+        """Uses the LLM to evaluate the entertainment value of the current chapter
+
+        Args:
+            refresh (bool): True to ask the LLM again rather than reuse a cached evaluation of the same content
+        """
         if self.content is None or self.content.strip() == '':
             return None
 
+        instructions = { "role": "user", "content": f"""
+        Evaluate the current chapter for entertainment value and estimate a score from 0 - 100. Return only negative feedback, and exclude positive feedback. 
+        The format of the result is JSON with the following structure: {{ "score": int, "comments": [str] }}
+        """}
+        acknowledgement = { "role": "ai", "content": "I will take this into account" }
+
+        # The chapter and instructions come first, then the summaries of the most recent previous chapters that still fit
+        budget = self.llm.budget('ent_eval', EVAL_RESPONSE_TOKENS)
+        prefix = "The current chapter: "
+        content = self._fitContent(budget, budget.countMessages([{ "role": "user", "content": prefix }, acknowledgement, instructions]))
+        current = [{ "role": "user", "content": prefix + content }, acknowledgement, instructions]
+
         conversation = []
-        
-        # Append all previous chapters to the conversation
-        for i in range(0, self.number):
+        remaining = budget.limit - budget.countMessages(current)
+        for i in reversed(range(0, self.number)):
             chapter = self.book.chapters[i]
-            conversation.append({ "role": "user", "content": f"The following is a summary of the chapter {i}:\n{chapter.summary}"})
-            conversation.append({ "role": "ai", "content": "I will take this into account" })
-
-        conversation.append({ "role": "user", "content": f"The current chapter: {self.content}"})
-        conversation.append({ "role": "ai", "content": "I will take this into account" })
+            summary = [{ "role": "user", "content": f"The following is a summary of the chapter {i}:\n{chapter.summary}"}, acknowledgement]
+            remaining -= budget.countMessages(summary)
+            if remaining < 0:
+                logger.warning(f"Only the summaries of the {len(conversation) // 2} chapters before {self} fit in the context")
+                break
+            conversation = summary + conversation
 
-        conversation.append({ "role": "user", "content": f"""
-        Evaluate the current chapter for entertainment value and estimate a score from 0 - 100. Return only negative feedback, and exclude positive feedback. 
-        The format of the result is JSON with the following structure: {{ "score": int, "comments": [str] }}
-        """})
+        conversation += current
 
         try:
-            evalStr = self.llm.entEval(conversation)
+            evalStr = self.llm.entEval(conversation, cache=not refresh, validate=_evalJson)
             if evalStr is None:
                 self._entertainment_eval = None
                 return None
             
             evalStr = evalStr[8:-3]
             logger.info(json.dumps(evalStr))
-            self.storage.saveChapterEntertainmentEval(self.number, evalStr)
+            self.storage.saveChapterEntertainmentEval(self.id, evalStr)
+            self.recordDerived('entertainment_eval', 'entertainment_eval', 'ent_eval')
 
             logger.info("Loading eval")
             logger.info(evalStr)
@@ -395,7 +1011,7 @@ class Chapter:
             return self._entertainment_eval
 
         # Load technical eval from storage
-        evalStr = self.storage.loadChapterEntertainmentEval(self.number)
+        evalStr = self.storage.loadChapterEntertainmentEval(self.id)
         if evalStr is not None:
             self._entertainment_eval = ChapterEval(json.loads(evalStr))
             if self._entertainment_eval is not None:
@@ -407,4 +1023,5 @@ class Chapter:
     def entertainment_eval(self, value: ChapterEval):
         self._entertainment_eval = value
         evalStr = json.dumps(value.__dict__)
-        self.storage.saveChapterEntertainmentEval(self.number, evalStr)
+        self.storage.saveChapterEntertainmentEval(self.id, evalStr)
+        self.recordDerived('entertainment_eval', 'entertainment_eval', 'ent_eval')
@@ -28,7 +28,7 @@ class Character:
             return ""
 
         print(f"Renaming {self._name} to {name}")
-        self.storage.renameCharacter(self.chapter.number, self._name, name)
+        self.storage.renameCharacter(self.chapter.id, self._name, name)
         self._name = name
         self._description = None
         self._thumbnail = None
@@ -38,11 +38,14 @@ class Character:
         if self._description is not None:
             return self._description
 
-        storedDescription = self.storage.loadCharacterDescription(self.chapter.number, self.name)
+        storedDescription = self.storage.loadCharacterDescription(self.chapter.id, self.name)
         if storedDescription is not None:
             self._description = storedDescription
             return self._description
 
+        return self._generateDescription()
+
+    def _generateDescription(self) -> str:
         prevDescriptions = []
 
         # find the same character in a previous chapter going through in reverse order
@@ -78,13 +81,15 @@ You are a literature professor. For the character {self.name}, the following des
         if self._description is None:
             return "No description found"
 
-        self.storage.saveCharacterDescription(self.chapter.number, self.name, self.description)
+        self.storage.saveCharacterDescription(self.chapter.id, self.name, self.description)
+        self.chapter.recordDerived(self._artifact('description'), 'character_description')
         return self._description
 
     @description.setter
     def description(self, value):
         self._description = value
-        self.storage.saveCharacterDescription(self.chapter.number, self.name, self.description)
+        self.storage.saveCharacterDescription(self.chapter.id, self.name, self.description)
+        self.chapter.recordDerived(self._artifact('description'), 'character_description')
 
     @property
     def visual_description(self):
@@ -117,16 +122,27 @@ You are a literature professor. For the character {self.name}, the following des
 
         return self.generateImage()
 
+    @property
+    def thumbnail_uri(self) -> str:
+        """Returns the thumbnail as a data URI for display"""
+        thumbnail = self.thumbnail
+        if thumbnail is None:
+            return None
+        return f"data:{self.storage.thumbnailMimeType()};base64,{thumbnail}"
+
     @property
     def summary(self):
         """Returns the summary of the character"""
         if self._summary is not None:
             return self._summary
 
-        self._summary = self.storage.loadCharacterSummary(self.chapter.number, self.name)
+        self._summary = self.storage.loadCharacterSummary(self.chapter.id, self.name)
         if self._summary is not None:
             return self._summary
 
+        return self._generateSummary()
+
+    def _generateSummary(self) -> str:
         if self.chapter.number == 0:
             self._summary = ""
             return self._summary
@@ -143,12 +159,13 @@ You are a literature professor. For the character {self.name}, the following des
         
         if prev_character is None:
             self._summary = ""
-            self.storage.saveCharacterSummary(self.chapter.number, self.name, self._summary)
+            self.storage.saveCharacterSummary(self.chapter.id, self.name, self._summary)
+            self.chapter.recordDerived(self._artifact('summary'), 'character_summary')
             return self._summary
         
         messages = []
 
-        if self.storage.hasCharacterSummary(prev_chapter.number, prev_character.name):
+        if self.storage.hasCharacterSummary(prev_chapter.id, prev_character.name):
             messages.append({ "role": "user", "content": f"The following is a summary of the character {self.name}:{prev_character.summary}" })
         else:
             # Walk through chapters from start to the prev_chapter and generate
@@ -169,13 +186,50 @@ You are a literature professor. For the character {self.name}, the following des
         messages.append({ "role": "user", "content": f"The following is new content. Create a new summary of the character's story from only their own perspective (3rd person limited) by including this content and all past content: {self.chapter.content}"})
         self._summary = self.llm.conversation(messages, 0.0)
 
-        self.storage.saveCharacterSummary(self.chapter.number, self.name, self._summary)
+        self.storage.saveCharacterSummary(self.chapter.id, self.name, self._summary)
+        self.chapter.recordDerived(self._artifact('summary'), 'character_summary')
         return self._summary
         
     @summary.setter
     def summary(self, value):
         self._summary = value
-        self.storage.saveCharacterSummary(self.chapter.number, self.name, self._summary)
+        self.storage.saveCharacterSummary(self.chapter.id, self.name, self._summary)
+        self.chapter.recordDerived(self._artifact('summary'), 'character_summary')
+
+    def _artifact(self, kind: str) -> str:
+        """The name the chapter records this character's derived artifacts under"""
+        return f"characters/{self.name}/{kind}"
+
+    def storedArtifacts(self) -> [tuple]:
+        """The artifact and kind of the description and summary stored for the character in its chapter"""
+        stored = []
+        if self.storage.loadCharacterDescription(self.chapter.id, self.name) is not None:
+            stored.append((self._artifact('description'), 'character_description'))
+        if self.storage.hasCharacterSummary(self.chapter.id, self.name):
+            stored.append((self._artifact('summary'), 'character_summary'))
+        return stored
+
+    def staleArtifacts(self) -> [str]:
+        """Lists the stored artifacts derived for the character in its chapter that no longer match the chapter's content"""
+        return [artifact for artifact, kind in self.storedArtifacts() if self.chapter.isDerivedStale(artifact, kind)]
+
+    @property
+    def is_stale(self) -> bool:
+        """True if the character's description or summary was made from chapter content that has since been edited"""
+        return len(self.staleArtifacts()) > 0
+
+    def refreshStale(self) -> [str]:
+        """Derives again only the character's description and summary that no longer match the chapter's content
+
+        Returns:
+            [str]: The artifacts that were refreshed
+        """
+        stale = self.staleArtifacts()
+        if self._artifact('description') in stale:
+            self._generateDescription()
+        if self._artifact('summary') in stale:
+            self._generateSummary()
+        return stale
 
     def delete(self):
         """Deletes the character from the storage"""
@@ -184,7 +238,7 @@ You are a literature professor. For the character {self.name}, the following des
                 self.chapter.characters.pop(i)
                 break
 
-        self.storage.deleteCharacter(self.chapter.number, self.name)
+        self.storage.deleteCharacter(self.chapter.id, self.name)
 
         if self.references == "":
             self.storage.removeCharacter(self.name)
@@ -1,37 +1,78 @@
-from utils import Storage
+import os
+from utils import Storage, openStorage
+from utils.library_index import libraryIndex
 from .book import Book
 
 class BookLibrary:
     def __init__(self):
         self.storage = Storage(None)
-        self.books = None
+        self.books = {}
         self.bookNames = None
 
     def addBook(self, book):
-        self.books.append(book)
+        self.books[book.title] = book
+        if self.bookNames is not None and book.title not in self.bookNames:
+            self.bookNames.append(book.title)
 
     def listBooks(self):
-        if self.books is not None:
-            return self.books
+        """Lists the titles of the books in the library without opening them
+
+        Books missing from the library index are indexed as they are found,
+        and books that no longer exist are dropped from it.
+        """
+        if self.bookNames is not None:
+            return self.bookNames
 
-        self.books = []
         self.bookNames = ['']
         titles = self.storage.listBooks()
         for title in titles:
-            self.addBook(Book(title))
+            if not libraryIndex.hasBook(title):
+                self.indexBook(title)
             self.bookNames.append(title)
-        
+
+        for title in libraryIndex.listBooks():
+            if title not in titles:
+                libraryIndex.removeBook(title)
+
         return self.bookNames
 
+    def indexBook(self, title: str):
+        """Rebuilds the library index entry of a book from its storage
+
+        Args:
+            title (str): The title of the book
+        """
+        storage = openStorage(title)
+        chapter_words = {}
+        for chapter in storage.listChapters():
+            content = storage.loadChapterContent(chapter)
+            chapter_words[chapter] = len(content.split()) if content is not None else 0
+
+        libraryIndex.setBook(title, chapter_words, os.path.getmtime(storage.root))
+
+    def getBookInfo(self, title: str) -> dict:
+        """Gets the indexed metadata of a book
+
+        Args:
+            title (str): The title of the book
+
+        Returns:
+            dict: The 'title', 'chapters', 'words' and 'modified' time of the book
+        """
+        return libraryIndex.getBook(title)
+
     def getBook(self, title):
-        # Find the book in the list of books
-        for book in self.books:
-            if book.title == title:
-                return book
+        # Books are only opened once they are selected
+        if title is None or title == '':
+            return None
+
+        if title not in self.books:
+            self.books[title] = Book(title)
+        return self.books[title]
 
     def loadFromContent(self, storyFileName: str,  storyFile: any):
         book = Book(storyFileName)
         book.loadFromContent(storyFile)
+        self.indexBook(book.title)
         self.addBook(book)
         return book
-
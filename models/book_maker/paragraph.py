@@ -0,0 +1,180 @@
+import uuid
+import hashlib
+from difflib import SequenceMatcher
+
+SEPARATOR = "\n\n"
+
+def contentHash(text: str) -> str:
+    """Returns the SHA-256 of a piece of text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class Paragraph:
+    def __init__(self, id: str, text: str, start: int, hash: str = None):
+        self.id = id
+        self.text = text
+        self.start = start
+        self.hash = hash if hash is not None else contentHash(text)
+
+    @property
+    def end(self) -> int:
+        """The offset in the chapter content just past the paragraph"""
+        return self.start + len(self.text)
+
+    def __str__(self):
+        return self.text
+
+class ParagraphIndex:
+    """The paragraphs of a chapter with stable ids and their offsets in the content
+
+    Paragraphs keep their id while the content around them changes, so
+    anything addressed by paragraph id keeps pointing at the same text.
+    """
+    def __init__(self, content: str, stored: [dict] = None):
+        previous = []
+        if stored is not None:
+            previous = [(entry['id'], entry['hash']) for entry in stored]
+
+        self._paragraphs = []
+        self._positions = {}
+        self._build(content.split(SEPARATOR), previous, stored is None)
+
+    def __len__(self):
+        return len(self._paragraphs)
+
+    def __iter__(self):
+        return iter(self._paragraphs)
+
+    def __getitem__(self, position: int) -> Paragraph:
+        return self._paragraphs[position]
+
+    def get(self, id: str) -> Paragraph:
+        """Gets a paragraph by its id
+
+        Args:
+            id (str): The id of the paragraph
+
+        Returns:
+            Paragraph: The paragraph, or None if no paragraph has the id
+        """
+        position = self._positions.get(id, None)
+        if position is None:
+            return None
+        return self._paragraphs[position]
+
+    def position(self, id: str) -> int:
+        """Gets the position of a paragraph in the chapter
+
+        Args:
+            id (str): The id of the paragraph
+
+        Returns:
+            int: The zero based position, or None if no paragraph has the id
+        """
+        return self._positions.get(id, None)
+
+    def span(self, ids: [str]) -> tuple:
+        """Gets the content offsets covered by a set of paragraphs
+
+        Args:
+            ids ([str]): The ids of the paragraphs
+
+        Returns:
+            tuple: The start of the first and end of the last paragraph, or None if the paragraphs are not a consecutive run
+        """
+        run = self._run(ids)
+        if run is None:
+            return None
+        first, last = run
+        return (self._paragraphs[first].start, self._paragraphs[last].end)
+
+    def _run(self, ids: [str]) -> tuple:
+        # Paragraphs in between a selection would be covered without being part of it
+        if ids is None or len(ids) == 0 or any([id not in self._positions for id in ids]):
+            return None
+
+        positions = sorted(set([self._positions[id] for id in ids]))
+        if positions[-1] - positions[0] + 1 != len(positions):
+            return None
+        return (positions[0], positions[-1])
+
+    def entries(self) -> [dict]:
+        """Returns the ids and hashes of the paragraphs for storage"""
+        return [{ 'id': paragraph.id, 'hash': paragraph.hash } for paragraph in self._paragraphs]
+
+    def update(self, content: str):
+        """Re-indexes the paragraphs after the content has changed
+
+        Unchanged paragraphs keep their ids, as do edited paragraphs that
+        replace the same number of paragraphs in place.
+
+        Args:
+            content (str): The new content of the chapter
+        """
+        previous = [(paragraph.id, paragraph.hash) for paragraph in self._paragraphs]
+        self._build(content.split(SEPARATOR), previous, False)
+
+    def splice(self, ids: [str], text: str) -> tuple:
+        """Replaces a run of paragraphs with new text without re-indexing the rest of the chapter
+
+        Args:
+            ids ([str]): The ids of the paragraphs to replace, from the first to the last
+            text (str): The text that replaces them
+
+        Returns:
+            tuple: The start and end offsets of the replaced content, or None if the paragraphs are not a consecutive run
+        """
+        run = self._run(ids)
+        if run is None:
+            return None
+
+        first, last = run
+        start = self._paragraphs[first].start
+        end = self._paragraphs[last].end
+        replaced = self._paragraphs[first:last + 1]
+
+        paragraphs = []
+        offset = start
+        for i, paragraph_text in enumerate(text.split(SEPARATOR)):
+            id = replaced[i].id if i < len(replaced) else newParagraphId()
+            paragraphs.append(Paragraph(id, paragraph_text, offset))
+            offset += len(paragraph_text) + len(SEPARATOR)
+
+        # Everything after the splice only moves
+        delta = len(text) - (end - start)
+        for paragraph in self._paragraphs[last + 1:]:
+            paragraph.start += delta
+
+        for paragraph in replaced:
+            del self._positions[paragraph.id]
+        self._paragraphs[first:last + 1] = paragraphs
+        for position in range(first, len(self._paragraphs)):
+            self._positions[self._paragraphs[position].id] = position
+
+        return (start, end)
+
+    def _build(self, texts: [str], previous: [tuple], positional_ids: bool):
+        hashes = [contentHash(text) for text in texts]
+
+        ids = [None] * len(texts)
+        if positional_ids:
+            # Chapters indexed for the first time use their paragraph numbers
+            ids = [str(i) for i in range(len(texts))]
+        else:
+            matcher = SequenceMatcher(None, [hash for (_, hash) in previous], hashes, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag == 'equal' or (tag == 'replace' and i2 - i1 == j2 - j1):
+                    for k in range(j2 - j1):
+                        ids[j1 + k] = previous[i1 + k][0]
+
+        self._paragraphs = []
+        offset = 0
+        for i, text in enumerate(texts):
+            id = ids[i] if ids[i] is not None else newParagraphId()
+            self._paragraphs.append(Paragraph(id, text, offset, hashes[i]))
+            offset += len(text) + len(SEPARATOR)
+
+        self._positions = { paragraph.id: position for position, paragraph in enumerate(self._paragraphs) }
+
+def newParagraphId() -> str:
+    """Creates an id for a new paragraph"""
+    return uuid.uuid4().hex[:12]
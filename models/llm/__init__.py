@@ -1,2 +1,2 @@
-from .llm import LLM, getLLM
+from .llm import LLM, getLLM, runAll
 from .llm_interface import LLMPlugin
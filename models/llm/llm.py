@@ -1,10 +1,48 @@
-from models.plugin_framework import get_plugin_definitions, load_plugin_class
+import time
+import asyncio
+import threading
+from models.plugin_framework import get_plugin_definitions, get_plugin_instance
 from logging import getLogger
 from utils import Storage
+from utils.audio_cache import speechKey
+from utils import mp3
+from .response_cache import ResponseCache, responseKey
+from .rate_limiter import RateLimiter, getRateLimiter
+from .tokens import TokenBudget, getTokenizer, estimateTokens
 
 storage = Storage(None)
 logger = getLogger('LLM')
 
+# Speech requests each provider accepts at once unless configured with 'max_concurrency'
+DEFAULT_SPEECH_CONCURRENCY = 4
+
+# Paragraphs shorter than this are batched into one speech request unless configured with 'batch_paragraph_characters'
+DEFAULT_BATCH_PARAGRAPH_CHARACTERS = 200
+
+# Edited summaries are updated from the changed passages when at most this share of the chapter changed, unless configured with 'summary_change_ratio'
+DEFAULT_SUMMARY_CHANGE_RATIO = 0.25
+
+# Separates the paragraphs of a batched speech request
+BATCH_SEPARATOR = "\n\n"
+
+def _messageTokens(messages: [dict]) -> int:
+    """ Estimates the tokens a request sends """
+    return sum([estimateTokens(str(message.get('content', ''))) for message in messages])
+
+def _modelOf(api: any) -> str:
+    """ Gets the model a plugin is configured with, None if it does not say """
+    return getattr(api, 'model', None) or getattr(api, 'model_id', None)
+
+def _isValid(response: str, validate: any) -> bool:
+    """ True if the caller can use the response, such as it parsing as JSON """
+    if validate is None:
+        return True
+    try:
+        validate(response)
+        return True
+    except Exception:
+        return False
+
 class EmptyLLM:
     def __init__(self):
         self.name = "Empty LLM"
@@ -26,6 +64,11 @@ class LLM:
         self.tech_eval = EmptyLLM()
         self.ent_eval = EmptyLLM()
         self.voice = EmptyLLM()
+        self.speech_concurrency = DEFAULT_SPEECH_CONCURRENCY
+        self.limiters = {}
+        self.batch_paragraph_characters = DEFAULT_BATCH_PARAGRAPH_CHARACTERS
+        self.summary_change_ratio = DEFAULT_SUMMARY_CHANGE_RATIO
+        self.response_cache = None
 
         self.plugins = get_plugin_definitions('llm')
 
@@ -61,6 +104,9 @@ class LLM:
         
         if configs is None:
             configs = storage.getSettings()
+
+        self.loadResponseCache(configs.get('llm_cache', {}))
+        self.limiters = {}
             
         for config in configs['gen_ai']:
             type = config.get('type', None)
@@ -82,30 +128,232 @@ class LLM:
 
             for plugin in self.plugins:
                 if plugin['name'] == type:
-                    pluginClass = load_plugin_class(plugin)
-                    api = pluginClass(config)
+                    api = get_plugin_instance(plugin, config)
                     break
 
             logger.info(f"Loaded configuration {type} for roles {role}")
+            self.limiters[role] = getRateLimiter(role, type, config, DEFAULT_SPEECH_CONCURRENCY if 'voice' == role else None)
             if 'image' == role:
                 self.image_api = api
             if 'content' == role:
                 self.api = api
+                self.summary_change_ratio = float(config.get('summary_change_ratio', DEFAULT_SUMMARY_CHANGE_RATIO))
             if 'tech_eval' == role:
                 self.tech_eval = api
             if 'ent_eval' == role:
                 self.ent_eval = api
             if 'voice' == role:
                 self.voice = api
+                self.speech_concurrency = max(1, int(config.get('max_concurrency', DEFAULT_SPEECH_CONCURRENCY)))
+                self.batch_paragraph_characters = int(config.get('batch_paragraph_characters', DEFAULT_BATCH_PARAGRAPH_CHARACTERS))
+
+    def loadResponseCache(self, config: dict):
+        """ Opens the response cache, or disables it, based on the 'llm_cache' settings
+
+        Args:
+            config (dict): The 'enabled' flag, 'max_entries' and 'max_age_days' of the cache
+        """
+        if not config.get('enabled', True):
+            self.response_cache = None
+            return
+
+        max_entries = int(config.get('max_entries', 10000))
+        max_age_days = float(config.get('max_age_days', 30))
+        if self.response_cache is None:
+            self.response_cache = ResponseCache(f"{storage.libraryRoot}/.llm/responses.db", max_entries, max_age_days)
+        else:
+            self.response_cache.max_entries = max_entries
+            self.response_cache.max_age_days = max_age_days
+
+    def limiter(self, role: str) -> RateLimiter:
+        """ Gets the rate limiter that throttles the calls made for a role
+
+        Args:
+            role (str): The role, such as 'content' or 'voice'. Sub roles such as 'content.prompt' share their role's limiter
+        """
+        role = role.split('.')[0]
+        limiter = self.limiters.get(role, None)
+        if limiter is None:
+            # Roles without a configuration are not throttled, but are still retried
+            limiter = getRateLimiter(role, None, {})
+        return limiter
+
+    def budget(self, role: str = 'content', reserve: int = 0) -> TokenBudget:
+        """ Gets the token budget for packing a prompt for a role
+
+        Args:
+            role (str): The role the prompt is for, 'content', 'tech_eval' or 'ent_eval'
+            reserve (int): The tokens kept free for the response
+
+        Returns:
+            TokenBudget: The budget, limited to the role's context window less the reserve
+
+        Plugins that send max_tokens as the cap on the response, such as Bedrock,
+        report it as their response_tokens and have it reserved instead.
+        """
+        api = self._textApi(role)
+        window = int(getattr(api, 'context_window', 0) or api.max_tokens)
+        reserve = max(reserve, int(getattr(api, 'response_tokens', 0) or 0))
+        return TokenBudget(getTokenizer(api.name, _modelOf(api)), window, reserve)
+
+    def modelSignature(self, role: str = 'content') -> str:
+        """ Identifies the provider and model that serves a text role, such as 'OpenAI:gpt-4o' """
+        api = self._textApi(role)
+        return f"{api.name}:{_modelOf(api)}"
+
+    def _textApi(self, role: str) -> any:
+        return { 'content': self.api, 'tech_eval': self.tech_eval, 'ent_eval': self.ent_eval }[role.split('.')[0]]
+
+    def cacheStats(self) -> dict:
+        """ Returns the hits, misses, hit rate and entries of the response cache, None if it is disabled """
+        if self.response_cache is None:
+            return None
+        return self.response_cache.stats()
+
+    def _cachedResponse(self, role: str, api: any, messages: [dict], temperature: float, cache: bool, request: any, validate: any = None) -> str:
+        """ Serves a request from the response cache, invoking the LLM on a miss
+
+        Args:
+            role (str): The role the request is made for
+            api (any): The plugin that serves the role
+            messages ([dict]): The messages of the request
+            temperature (float): The temperature of the request
+            cache (bool): False to skip the cached response and store a fresh one
+            request (any): Invokes the LLM
+            validate (any): Optionally, raises if a response can not be used, such as failing to parse.
+                Responses it rejects are neither served from the cache nor stored in it.
+
+        Returns (str): The response from the LLM
+
+        Misses are made through the role's rate limiter.
+        """
+        key, response = self._cacheLookup(role, api, messages, temperature, cache, validate)
+        if response is not None:
+            return response
 
-    def prompt(self, prompt: str) -> str:
+        limiter = self.limiter(role)
+        response = limiter.call(request, _messageTokens(messages))
+        if response is not None:
+            limiter.debit(estimateTokens(response))
+        self._cacheStore(key, response, validate)
+        return response
+
+    async def _acachedResponse(self, role: str, api: any, messages: [dict], temperature: float, cache: bool, request: any, validate: any = None) -> str:
+        """ Serves a request from the response cache, awaiting the LLM on a miss
+
+        Args:
+            request (any): Returns the awaitable that invokes the LLM
+
+        Returns (str): The response from the LLM
+        """
+        key, response = self._cacheLookup(role, api, messages, temperature, cache, validate)
+        if response is not None:
+            return response
+
+        limiter = self.limiter(role)
+        response = await limiter.acall(request, _messageTokens(messages))
+        if response is not None:
+            limiter.debit(estimateTokens(response))
+        self._cacheStore(key, response, validate)
+        return response
+
+    def _streamedResponse(self, role: str, api: any, messages: [dict], temperature: float, cache: bool, request: any):
+        """ Serves a request from the response cache, streaming the LLM on a miss
+
+        Args:
+            request (any): Returns the iterator of text deltas from the LLM
+
+        Yields: The text of the response as it is written, or the cached response in one piece
+
+        Requests that fail before any text arrives are retried through the role's
+        rate limiter, and the complete response is cached once the stream ends.
+        """
+        key, response = self._cacheLookup(role, api, messages, temperature, cache)
+        if response is not None:
+            yield response
+            return
+
+        limiter = self.limiter(role)
+        attempt = 0
+        while True:
+            parts = []
+            try:
+                with limiter.slot(_messageTokens(messages)):
+                    for delta in request():
+                        parts.append(delta)
+                        yield delta
+                break
+            except Exception as e:
+                # Text already handed on cannot be taken back
+                delay = None if len(parts) > 0 else limiter.retryDelay(e, attempt)
+                if delay is None:
+                    raise
+
+                logger.warning(f"Streaming {role} on {api.name} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+        response = "".join(parts)
+        limiter.debit(estimateTokens(response))
+        self._cacheStore(key, response)
+
+    def _textChunks(self, api: any, method: str, *args):
+        # Plugins without streaming support produce the response in one piece
+        streaming = getattr(api, f"stream{method[:1].upper()}{method[1:]}", None)
+        if streaming is not None:
+            for delta in streaming(*args):
+                if delta:
+                    yield delta
+            return
+
+        response = getattr(api, method)(*args)
+        if response:
+            yield response
+
+    def _cacheLookup(self, role: str, api: any, messages: [dict], temperature: float, cache: bool, validate: any = None) -> tuple:
+        """ Returns the cache key of a request, None if it is not cached, and the cached response if there is one """
+        if self.response_cache is None or api.max_tokens == 0:
+            return (None, None)
+
+        key = responseKey(role, api.name, _modelOf(api), messages, temperature)
+        if cache:
+            response = self.response_cache.get(key)
+            if response is not None and _isValid(response, validate):
+                logger.debug(f"Using cached {role} response from {api.name}")
+                return (key, response)
+        return (key, None)
+
+    def _cacheStore(self, key: str, response: str, validate: any = None):
+        if key is not None and response is not None:
+            if not _isValid(response, validate):
+                logger.warning("Not caching a response that could not be used")
+                return
+            self.response_cache.put(key, response)
+
+    def prompt(self, prompt: str, cache: bool = True, validate: any = None) -> str:
         """ Invokes LLM with the prompt
         
         Args:
             prompt (str): The prompt for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
         """
         print(f"Executing prompt on {self.api.name}")
-        return self.api.prompt(prompt)
+        messages = [{ "role": "user", "content": prompt }]
+        return self._cachedResponse('content.prompt', self.api, messages, None, cache, lambda: self.api.prompt(prompt), validate)
+
+    def streamPrompt(self, prompt: str, cache: bool = True):
+        """ Invokes LLM with the prompt, yielding the response as it is written
+
+        Args:
+            prompt (str): The prompt for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+
+        Yields (str): The text of the response in pieces
+        """
+        logger.debug(f"Executing streamPrompt on {self.api.name}")
+        messages = [{ "role": "user", "content": prompt }]
+        yield from self._streamedResponse('content.prompt', self.api, messages, None, cache, lambda: self._textChunks(self.api, 'prompt', prompt))
 
     def image(self, prompt: str) -> bytes:
         """ Invokes the LLM to produce an image
@@ -115,13 +363,15 @@ class LLM:
         Returns: The bytes of the image
         """
         print(f"Executing image on {self.image_api.name}")
-        return self.image_api.image(prompt)
+        return self.limiter('image').call(lambda: self.image_api.image(prompt), estimateTokens(prompt))
 
-    def conversation(self, conversation: [dict], temperature: float = 0.7) -> str:
+    def conversation(self, conversation: [dict], temperature: float = 0.7, cache: bool = True, validate: any = None) -> str:
         """ Invokes the LLM with a conversation
         Args:
             conversation ([dict]): The conversation to be passed to the LLM
             temperature (float): The temperature to be used for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
         
         Returns (str): The response from the LLM
 
@@ -132,13 +382,27 @@ class LLM:
             ]
         """
         print(f"Executing conversation on {self.api.name}")
-        return self.api.conversation(conversation, temperature)
+        return self._cachedResponse('content', self.api, conversation, temperature, cache, lambda: self.api.conversation(conversation, temperature), validate)
     
-    def techEval(self, conversation: [dict], temperature: float = 0.9) -> str:
+    def streamConversation(self, conversation: [dict], temperature: float = 0.7, cache: bool = True):
+        """ Invokes the LLM with a conversation, yielding the response as it is written
+        Args:
+            conversation ([dict]): The conversation to be passed to the LLM
+            temperature (float): The temperature to be used for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+
+        Yields (str): The text of the response in pieces, which can be passed to st.write_stream
+        """
+        logger.debug(f"Executing streamConversation on {self.api.name}")
+        yield from self._streamedResponse('content', self.api, conversation, temperature, cache, lambda: self._textChunks(self.api, 'conversation', conversation, temperature))
+
+    def techEval(self, conversation: [dict], temperature: float = 0.9, cache: bool = True, validate: any = None) -> str:
         """ Invokes the LLM with a conversation
         Args:
             conversation ([dict]): The conversation to be passed to the LLM
             temperature (float): The temperature to be used for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
         
         Returns (str): The response from the LLM
 
@@ -149,13 +413,15 @@ class LLM:
             ]
         """
         print(f"Executing techEval on {self.tech_eval.name}")
-        return self.tech_eval.conversation(conversation, temperature)
+        return self._cachedResponse('tech_eval', self.tech_eval, conversation, temperature, cache, lambda: self.tech_eval.conversation(conversation, temperature), validate)
 
-    def entEval(self, conversation: [dict], temperature: float = 0.9) -> str:
+    def entEval(self, conversation: [dict], temperature: float = 0.9, cache: bool = True, validate: any = None) -> str:
         """ Invokes the LLM with a conversation
         Args:
             conversation ([dict]): The conversation to be passed to the LLM
             temperature (float): The temperature to be used for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
 
         Returns (str): The response from the LLM
 
@@ -166,8 +432,21 @@ class LLM:
             ]
         """
         print(f"Executing entEval on {self.ent_eval.name}")
-        return self.ent_eval.conversation(conversation, temperature)
+        return self._cachedResponse('ent_eval', self.ent_eval, conversation, temperature, cache, lambda: self.ent_eval.conversation(conversation, temperature), validate)
     
+    def speechKey(self, text: str) -> str:
+        """ Gets the key that identifies the speech for text in the configured voice
+        Args:
+            text (str): The text to be converted to speech
+
+        Returns: The key of the speech, or None if no voice is configured
+        """
+        if self.voice.max_tokens == 0:
+            return None
+
+        signature = getattr(self.voice, 'voice_signature', { 'voice': None, 'model': None })
+        return speechKey(text, self.voice.name, signature.get('voice', None), signature.get('model', None))
+
     def getSpeech(self, text: str) -> bytes:
         """ Invokes the LLM to produce speech
         Args:
@@ -175,8 +454,216 @@ class LLM:
 
         Returns: The bytes of the speech
         """
-        print(f"Executing getSpeech on {self.voice.name}")
-        return self.voice.getSpeech(text)
+        audio = b''.join(self.streamSpeech(text))
+        if len(audio) == 0:
+            return None
+        return audio
+
+    @property
+    def speech_format(self) -> str:
+        """ The audio format the voice produces, 'mp3' unless the voice says otherwise """
+        return getattr(self.voice, 'audio_format', 'mp3')
+
+    @property
+    def speech_mime_type(self) -> str:
+        """ The MIME type of the audio the voice produces """
+        return f"audio/{self.speech_format}"
+
+    @property
+    def speech_batch_characters(self) -> int:
+        """ The most characters the voice accepts in a batched speech request, 0 if it cannot batch """
+        if not hasattr(self.voice, 'getTimedSpeech'):
+            return 0
+        return getattr(self.voice, 'max_batch_characters', 0)
+
+    def getBatchSpeech(self, texts: [str]) -> [bytes]:
+        """ Invokes the LLM to produce the speech of several texts in one request
+        Args:
+            texts ([str]): The texts to be converted to speech
+
+        Returns: The bytes of the speech of each text, or None if the batch could not be split
+
+        The texts are spoken as one request, and the audio is split back into
+        each text using the character timings the voice returns.
+        """
+        logger.debug(f"Executing getBatchSpeech on {self.voice.name} for {len(texts)} texts")
+        text = BATCH_SEPARATOR.join(texts)
+        if len(text) > self.speech_batch_characters:
+            return None
+
+        timed = self.limiter('voice').call(lambda: self.voice.getTimedSpeech(text), estimateTokens(text))
+        if timed is None:
+            return None
+        audio, timings = timed
+
+        # The cut before each text is at the time its first character is spoken
+        cuts = []
+        offset = 0
+        for previous in texts[:-1]:
+            offset += len(previous) + len(BATCH_SEPARATOR)
+            times = [time for (position, time) in timings if position >= offset]
+            if len(times) == 0:
+                return None
+            cuts.append(min(times))
+
+        parts = mp3.split(audio, cuts)
+        if parts is None or any(len(part) == 0 for part in parts):
+            logger.warning(f"Could not split batched speech from {self.voice.name}")
+            return None
+        return parts
+
+    def streamSpeech(self, text: str):
+        """ Invokes the LLM to produce speech, yielding the audio as it arrives
+        Args:
+            text (str): The text to be converted to speech
+
+        Yields: The bytes of the speech in chunks
+
+        Requests to the provider go through the voice's rate limiter, and
+        requests that fail before any audio arrives are retried with backoff.
+        """
+        logger.debug(f"Executing streamSpeech on {self.voice.name}")
+        limiter = self.limiter('voice')
+
+        attempt = 0
+        while True:
+            started = False
+            try:
+                with limiter.slot(estimateTokens(text)):
+                    for chunk in self._voiceChunks(text):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                # Audio already handed on cannot be taken back
+                delay = None if started else limiter.retryDelay(e, attempt)
+                if delay is None:
+                    raise
+
+                logger.warning(f"Speech on {self.voice.name} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def _voiceChunks(self, text: str):
+        # Voice plugins without streaming support produce the audio in one piece
+        if hasattr(self.voice, 'streamSpeech'):
+            for chunk in self.voice.streamSpeech(text):
+                if chunk:
+                    yield chunk
+            return
+
+        audio = self.voice.getSpeech(text)
+        if audio:
+            yield audio
+
+    async def _acall(self, api: any, method: str, *args) -> any:
+        """ Awaits a plugin's native async method, or runs its blocking method on a worker thread
+
+        Args:
+            api (any): The plugin to call
+            method (str): The name of the blocking method, the async method is the same name prefixed with 'a'
+        """
+        native = getattr(api, f"a{method}", None)
+        if native is not None:
+            return await native(*args)
+        return await asyncio.to_thread(getattr(api, method), *args)
+
+    async def aprompt(self, prompt: str, cache: bool = True, validate: any = None) -> str:
+        """ Invokes LLM with the prompt without blocking the event loop
+
+        Args:
+            prompt (str): The prompt for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
+        """
+        logger.debug(f"Executing aprompt on {self.api.name}")
+        messages = [{ "role": "user", "content": prompt }]
+        return await self._acachedResponse('content.prompt', self.api, messages, None, cache, lambda: self._acall(self.api, 'prompt', prompt), validate)
+
+    async def aimage(self, prompt: str) -> bytes:
+        """ Invokes the LLM to produce an image without blocking the event loop
+        Args:
+            prompt (str): The prompt for the LLM
+
+        Returns: The bytes of the image
+        """
+        logger.debug(f"Executing aimage on {self.image_api.name}")
+        return await self.limiter('image').acall(lambda: self._acall(self.image_api, 'image', prompt), estimateTokens(prompt))
+
+    async def aconversation(self, conversation: [dict], temperature: float = 0.7, cache: bool = True, validate: any = None) -> str:
+        """ Invokes the LLM with a conversation without blocking the event loop
+        Args:
+            conversation ([dict]): The conversation to be passed to the LLM
+            temperature (float): The temperature to be used for the LLM
+            cache (bool): False to ignore any cached response and ask the LLM again
+            validate (any): Optionally, raises if the response can not be used so that it is not cached
+
+        Returns (str): The response from the LLM
+        """
+        logger.debug(f"Executing aconversation on {self.api.name}")
+        return await self._acachedResponse('content', self.api, conversation, temperature, cache, lambda: self._acall(self.api, 'conversation', conversation, temperature), validate)
+
+    async def atechEval(self, conversation: [dict], temperature: float = 0.9, cache: bool = True, validate: any = None) -> str:
+        """ Invokes the technical evaluation LLM with a conversation without blocking the event loop """
+        logger.debug(f"Executing atechEval on {self.tech_eval.name}")
+        return await self._acachedResponse('tech_eval', self.tech_eval, conversation, temperature, cache, lambda: self._acall(self.tech_eval, 'conversation', conversation, temperature), validate)
+
+    async def aentEval(self, conversation: [dict], temperature: float = 0.9, cache: bool = True, validate: any = None) -> str:
+        """ Invokes the entertainment evaluation LLM with a conversation without blocking the event loop """
+        logger.debug(f"Executing aentEval on {self.ent_eval.name}")
+        return await self._acachedResponse('ent_eval', self.ent_eval, conversation, temperature, cache, lambda: self._acall(self.ent_eval, 'conversation', conversation, temperature), validate)
+
+    async def agetSpeech(self, text: str) -> bytes:
+        """ Invokes the LLM to produce speech without blocking the event loop
+        Args:
+            text (str): The text to be converted to speech
+
+        Returns: The bytes of the speech
+        """
+        logger.debug(f"Executing agetSpeech on {self.voice.name}")
+        audio = await self.limiter('voice').acall(lambda: self._acall(self.voice, 'getSpeech', text), estimateTokens(text))
+        if audio is None or len(audio) == 0:
+            return None
+        return audio
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _backgroundLoop() -> asyncio.AbstractEventLoop:
+    """ Gets the event loop every async LLM call runs on, starting it on first use
+
+    The plugins' async clients keep their connections bound to the loop they
+    were first used on, so every call shares one loop that is never closed.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-async", daemon=True).start()
+        return _loop
+
+def runAll(coroutines: [any]) -> [any]:
+    """ Runs async LLM calls concurrently from synchronous code such as the Streamlit pages
+
+    Args:
+        coroutines ([any]): The calls to run, such as llm.aprompt(...) for every chapter
+
+    Returns: The result of each call, in the same order
+    """
+    async def gather():
+        return await asyncio.gather(*coroutines)
+
+    loop = _backgroundLoop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        for coroutine in coroutines:
+            coroutine.close()
+        raise RuntimeError("runAll can not wait on the loop it is running on, await the calls instead")
+
+    return asyncio.run_coroutine_threadsafe(gather(), loop).result()
 
 _llm_instance = LLM()
 
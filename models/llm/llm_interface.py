@@ -1,3 +1,4 @@
+import asyncio
 
 class LLMPlugin:
     def __init__(self, config):
@@ -48,6 +49,31 @@ class LLMPlugin:
         """
         pass
 
+    def streamPrompt(self, prompt: str):
+        """
+        Prompt the LLM with the given prompt, yielding the text of the response as it is written.
+        Optional, plugins without it have their prompt result used as a single chunk.
+
+        Args:
+            prompt (str): The prompt to use with the LLM
+        """
+        response = self.prompt(prompt)
+        if response:
+            yield response
+
+    def streamConversation(self, conversation: [dict], temperature: float = None):
+        """
+        Based on a conversation, yield the text of the LLM response as it is written.
+        Optional, plugins without it have their conversation result used as a single chunk.
+
+        Args:
+            conversation ([dict]): The conversation to use with the LLM
+            temperature (float): The temperature to use
+        """
+        response = self.conversation(conversation, temperature)
+        if response:
+            yield response
+
     def getSpeech(self, text: str) -> bytes:
         """
         Generates an MP3 from the text provided.
@@ -56,3 +82,60 @@ class LLMPlugin:
             text (str): The text to convert to audio
         """
         pass
+
+    def streamSpeech(self, text: str):
+        """
+        Generates an MP3 from the text provided, yielding it in chunks as it is produced.
+        Optional, plugins without it have their getSpeech result used as a single chunk.
+
+        Args:
+            text (str): The text to convert to audio
+        """
+        audio = self.getSpeech(text)
+        if audio:
+            yield audio
+
+    def close(self):
+        """
+        Releases what the plugin holds, such as worker processes or connections.
+        Optional, called when the plugin is replaced after its configuration changes.
+        """
+        pass
+
+    async def aprompt(self, prompt: str) -> str:
+        """
+        Async counterpart of prompt. Plugins with an async client should override
+        it, otherwise the blocking call runs on a worker thread.
+
+        Args:
+            prompt (str): The prompt to use with the LLM
+        """
+        return await asyncio.to_thread(self.prompt, prompt)
+
+    async def aconversation(self, conversation: [dict], temperature: float = None) -> str:
+        """
+        Async counterpart of conversation, running the blocking call on a worker thread unless overridden.
+
+        Args:
+            conversation ([dict]): The conversation to use with the LLM
+            temperature (float): The temperature to use
+        """
+        return await asyncio.to_thread(self.conversation, conversation, temperature)
+
+    async def aimage(self, prompt: str) -> bytes:
+        """
+        Async counterpart of image, running the blocking call on a worker thread unless overridden.
+
+        Args:
+            prompt (str): The description of the image
+        """
+        return await asyncio.to_thread(self.image, prompt)
+
+    async def agetSpeech(self, text: str) -> bytes:
+        """
+        Async counterpart of getSpeech, running the blocking call on a worker thread unless overridden.
+
+        Args:
+            text (str): The text to convert to audio
+        """
+        return await asyncio.to_thread(self.getSpeech, text)
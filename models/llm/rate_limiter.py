@@ -0,0 +1,284 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from contextlib import contextmanager, asynccontextmanager
+from logging import getLogger
+
+logger = getLogger('Rate Limiter')
+
+# Error codes providers use when they are throttling or briefly unavailable
+RETRYABLE_STATUS = { 408, 409, 429, 500, 502, 503, 504, 529 }
+RETRYABLE_CODES = { 'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException', 'ModelNotReadyException', 'InternalServerException' }
+
+class TokenBucket:
+    """ Allows a number of units per minute, refilling continuously
+
+    Units can be debited after the fact, leaving the bucket in debt so that
+    later requests wait until it has refilled.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._level = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """ Takes units from the bucket
+
+        Args:
+            amount (float): The number of units, capped at the capacity so large requests still run
+
+        Returns:
+            float: The seconds to wait before the units are available
+        """
+        with self._lock:
+            self._refill()
+            self._level -= min(amount, self.capacity)
+            if self._level >= 0:
+                return 0.0
+            return -self._level / self.rate
+
+    def debit(self, amount: float):
+        """ Takes units that have already been used, without waiting """
+        with self._lock:
+            self._refill()
+            self._level -= amount
+
+def _headers(error: Exception) -> dict:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None and isinstance(response, dict):
+        headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', None)
+    return headers if headers is not None else {}
+
+def retryAfter(error: Exception) -> float:
+    """ Gets the delay a provider asked for in its Retry-After header
+
+    Args:
+        error (Exception): The error raised by the provider's client
+
+    Returns:
+        float: The seconds to wait, or None if the provider did not say
+    """
+    value = None
+    for name, header in _headers(error).items():
+        if name.lower() == 'retry-after':
+            value = header
+            break
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def isRetryable(error: Exception) -> bool:
+    """ Checks whether an error is throttling or a transient failure worth retrying
+
+    Args:
+        error (Exception): The error raised by the provider's client
+
+    Returns:
+        bool: True if the request should be retried
+    """
+    status = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status is None and response is not None:
+        status = getattr(response, 'status_code', None)
+    if status in RETRYABLE_STATUS:
+        return True
+
+    # Botocore client errors carry the code in the parsed response
+    if isinstance(response, dict) and response.get('Error', {}).get('Code', None) in RETRYABLE_CODES:
+        return True
+
+    name = type(error).__name__
+    return 'Timeout' in name or 'Connection' in name or name in RETRYABLE_CODES
+
+class RateLimiter:
+    """ Throttles the calls made to one provider for one role
+
+    Calls wait for room in the requests and tokens per minute buckets and
+    for a free slot under the maximum in flight. Throttling and transient
+    errors are retried with jittered exponential backoff, waiting at least
+    as long as the provider's Retry-After asks.
+    """
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_in_flight: int = None, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None and tokens > 0:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def debit(self, tokens: int):
+        """ Records tokens used beyond the estimate a call reserved, such as the tokens of the response """
+        if self.tokens is not None and tokens > 0:
+            self.tokens.debit(tokens)
+
+    @contextmanager
+    def slot(self, tokens: int = 0):
+        """ Waits for the rate limits and a free slot, holding the slot until the block ends
+
+        Args:
+            tokens (int): The estimated tokens of the request
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+        if self._in_flight is None:
+            yield
+            return
+
+        self._in_flight.acquire()
+        try:
+            yield
+        finally:
+            self._in_flight.release()
+
+    @asynccontextmanager
+    async def aslot(self, tokens: int = 0):
+        """ Async counterpart of slot, waiting without blocking the event loop """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        if self._in_flight is None:
+            yield
+            return
+
+        while not self._in_flight.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        try:
+            yield
+        finally:
+            self._in_flight.release()
+
+    def retryDelay(self, error: Exception, attempt: int) -> float:
+        """ Gets how long to wait before retrying a failed call
+
+        Args:
+            error (Exception): The error the call raised
+            attempt (int): The number of retries already made
+
+        Returns:
+            float: The seconds to wait, or None if the call should not be retried
+        """
+        if attempt >= self.max_retries or not isRetryable(error):
+            return None
+
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        requested = retryAfter(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.max_delay))
+        return delay
+
+    def call(self, request: any, tokens: int = 0) -> any:
+        """ Makes a call within the limits, retrying throttling and transient errors
+
+        Args:
+            request (any): Makes the call
+            tokens (int): The estimated tokens of the request
+
+        Returns:
+            any: The result of the call
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.slot(tokens):
+                    return request()
+            except Exception as e:
+                delay = self.retryDelay(e, attempt)
+                if delay is None:
+                    raise
+
+                logger.warning(f"Call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    async def acall(self, request: any, tokens: int = 0) -> any:
+        """ Async counterpart of call
+
+        Args:
+            request (any): Returns the awaitable that makes the call
+            tokens (int): The estimated tokens of the request
+
+        Returns:
+            any: The result of the call
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self.aslot(tokens):
+                    return await request()
+            except Exception as e:
+                delay = self.retryDelay(e, attempt)
+                if delay is None:
+                    raise
+
+                logger.warning(f"Call failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def getRateLimiter(role: str, provider: str, config: dict, default_in_flight: int = None) -> RateLimiter:
+    """ Gets the rate limiter of a role and provider, shared by every caller in the process
+
+    Args:
+        role (str): The role the provider is configured for
+        provider (str): The name of the provider
+        config (dict): The role's settings, with 'requests_per_minute', 'tokens_per_minute', 'max_concurrency' and 'max_retries'
+        default_in_flight (int): The maximum in flight when the settings do not give one
+
+    Returns:
+        RateLimiter: The rate limiter
+    """
+    max_in_flight = config.get('max_concurrency', default_in_flight)
+    limits = (
+        config.get('requests_per_minute', None),
+        config.get('tokens_per_minute', None),
+        int(max_in_flight) if max_in_flight else None,
+        int(config.get('max_retries', 3))
+    )
+
+    with _limiters_lock:
+        existing = _limiters.get((role, provider), None)
+        if existing is not None and existing[0] == limits:
+            return existing[1]
+
+        limiter = RateLimiter(
+            float(limits[0]) if limits[0] else None,
+            float(limits[1]) if limits[1] else None,
+            limits[2],
+            limits[3]
+        )
+        _limiters[(role, provider)] = (limits, limiter)
+        return limiter
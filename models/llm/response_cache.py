@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from logging import getLogger
+
+logger = getLogger('Response Cache')
+
+def responseKey(role: str, provider: str, model: str, messages: [dict], temperature: float) -> str:
+    """ Gets the cache key of an LLM response
+
+    Args:
+        role (str): The role the LLM is configured for
+        provider (str): The name of the provider
+        model (str): The model of the provider
+        messages ([dict]): The messages sent to the LLM
+        temperature (float): The temperature of the request, None for the provider default
+
+    Returns:
+        str: The SHA-256 of the canonical request
+    """
+    identity = json.dumps({
+        'role': role,
+        'provider': provider,
+        'model': model,
+        'messages': messages,
+        'temperature': temperature
+    }, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """ LLM responses kept on disk so identical requests are only paid for once
+
+    Entries are evicted once they are older than the maximum age, and the
+    least recently used entries are evicted once there are more than the
+    maximum number of entries.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, max_age_days: float = 30):
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                used REAL NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._connection.commit()
+        self.evict()
+
+    def get(self, key: str) -> str:
+        """ Gets a cached response
+
+        Args:
+            key (str): The key of the request
+
+        Returns:
+            str: The response, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_days * 86400:
+                self.misses += 1
+                return None
+
+            self._connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str):
+        """ Caches a response
+
+        Args:
+            key (str): The key of the request
+            response (str): The response of the LLM
+        """
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created, used) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            self._connection.commit()
+            self._puts += 1
+            evict = self._puts % 100 == 0
+
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """ Removes expired entries and the least recently used entries over the maximum
+
+        Returns:
+            int: The number of entries removed
+        """
+        with self._lock:
+            expired = self._connection.execute(
+                "DELETE FROM responses WHERE created < ?",
+                (time.time() - self.max_age_days * 86400,)
+            ).rowcount
+            overflow = self._connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+            self._connection.commit()
+
+        if expired + overflow > 0:
+            logger.info(f"Evicted {expired} expired and {overflow} least recently used responses")
+        return expired + overflow
+
+    def clear(self):
+        """ Removes every cached response """
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def stats(self) -> dict:
+        """ Returns the hits, misses, hit rate and number of entries of the cache """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'entries': entries
+            }
@@ -0,0 +1,253 @@
+import hashlib
+import importlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from logging import getLogger
+
+logger = getLogger('Tokens')
+
+# Tokens a chat message costs beyond its text, for its role and separators
+MESSAGE_OVERHEAD = 4
+
+# Providers whose models use the OpenAI tokenizers
+TIKTOKEN_PROVIDERS = { 'OpenAI', 'API' }
+
+# Context windows of known models, matched by a fragment of the model id, most specific first
+MODEL_CONTEXT_WINDOWS = [
+    ('gpt-4o', 128000),
+    ('gpt-4.1', 1047576),
+    ('gpt-4-turbo', 128000),
+    ('gpt-4', 8192),
+    ('gpt-3.5-turbo', 16385),
+    ('o1', 200000),
+    ('o3', 200000),
+    ('o4', 200000),
+    ('nova-micro', 128000),
+    ('nova-lite', 300000),
+    ('nova-pro', 300000),
+    ('anthropic.claude', 200000),
+    ('llama3', 128000),
+    ('mistral', 32000)
+]
+
+# Context window assumed for models not in the table that do not configure one
+DEFAULT_CONTEXT_WINDOW = 32000
+
+def contextWindow(model: str, default: int = DEFAULT_CONTEXT_WINDOW) -> int:
+    """ Gets the context window of a known model
+
+    Args:
+        model (str): The id of the model
+        default (int): The window of models that are not known
+
+    Returns:
+        int: The tokens the model accepts for the prompt and response together
+    """
+    for fragment, window in MODEL_CONTEXT_WINDOWS:
+        if model is not None and fragment in model:
+            return window
+    return default
+
+def estimateTokens(text: str) -> int:
+    """ Roughly estimates the tokens in text, about four characters per token """
+    return len(text) // 4 + 1
+
+class Tokenizer:
+    """ Counts the tokens of text for a model, remembering the counts of text it has seen
+
+    Counts are cached by a hash of the text, so the paragraphs of a chapter
+    are only tokenized once however many prompts they are packed into.
+    """
+    name = 'estimate'
+
+    def __init__(self, max_cached: int = 20000):
+        self.max_cached = max_cached
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, text: str) -> int:
+        return estimateTokens(text)
+
+    def count(self, text: str) -> int:
+        """ Returns the number of tokens in text """
+        if text is None or text == '':
+            return 0
+
+        key = hashlib.sha1(text.encode('utf-8')).digest()
+        with self._lock:
+            count = self._counts.get(key, None)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+
+        count = self._count(text)
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.max_cached:
+                self._counts.popitem(last=False)
+        return count
+
+class TiktokenTokenizer(Tokenizer):
+    """ Counts tokens exactly with tiktoken, for OpenAI and OpenAI compatible models """
+    name = 'tiktoken'
+
+    def __init__(self, model: str, max_cached: int = 20000):
+        super().__init__(max_cached)
+        tiktoken = importlib.import_module('tiktoken')
+        try:
+            self._encoding = tiktoken.encoding_for_model(model or '')
+        except KeyError:
+            # Models tiktoken does not know, such as local models behind the API plugin, get the common encoding
+            self._encoding = tiktoken.get_encoding('cl100k_base')
+
+    def _count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+def getTokenizer(provider: str, model: str) -> Tokenizer:
+    """ Gets the tokenizer for a provider's model, shared by every caller in the process
+
+    OpenAI models are counted with tiktoken when it is installed. Every other
+    provider, and OpenAI without tiktoken, uses an estimate.
+
+    Args:
+        provider (str): The name of the provider
+        model (str): The model of the provider
+
+    Returns:
+        Tokenizer: The tokenizer
+    """
+    use_tiktoken = provider in TIKTOKEN_PROVIDERS and importlib.util.find_spec('tiktoken') is not None
+    key = (provider, model) if use_tiktoken else 'estimate'
+
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(key, None)
+        if tokenizer is None:
+            tokenizer = TiktokenTokenizer(model) if use_tiktoken else Tokenizer()
+            _tokenizers[key] = tokenizer
+        return tokenizer
+
+class TokenBudget:
+    """ Packs text into prompts without exceeding a model's context window
+
+    The limit is the model's window less the tokens reserved for the response.
+    """
+    def __init__(self, tokenizer: Tokenizer, window: int, reserve: int = 0):
+        self.tokenizer = tokenizer
+        self.window = window
+        self.limit = max(window - reserve, 0)
+
+    def count(self, text: str) -> int:
+        """ Returns the number of tokens in text """
+        return self.tokenizer.count(text)
+
+    def reserve(self, tokens: int):
+        """ Keeps more tokens free for the response, such as a rewrite as long as the text it replaces """
+        self.limit = max(self.limit - tokens, 0)
+
+    def countMessages(self, messages: [dict]) -> int:
+        """ Returns the number of tokens a conversation takes up """
+        return sum([self.count(str(message.get('content', ''))) + MESSAGE_OVERHEAD for message in messages])
+
+    def fits(self, text: str) -> bool:
+        """ Returns True if the text fits within the limit """
+        return self.count(text) <= self.limit
+
+    def available(self, *texts: str) -> int:
+        """ Returns the tokens left under the limit once the texts are included """
+        return max(self.limit - sum([self.count(text) for text in texts]), 0)
+
+    def head(self, paragraphs: [str], size: int) -> [str]:
+        """ Returns the paragraphs from the start that fit in size tokens
+
+        Args:
+            paragraphs ([str]): The paragraphs in order
+            size (int): The tokens available
+
+        Returns:
+            [str]: The leading paragraphs that fit
+        """
+        fitted = []
+        used = 0
+        for paragraph in paragraphs:
+            used += self.count(paragraph) + 1
+            if used > size:
+                break
+            fitted.append(paragraph)
+        return fitted
+
+    def tail(self, paragraphs: [str], size: int) -> [str]:
+        """ Returns the paragraphs from the end that fit in size tokens, in their original order
+
+        Args:
+            paragraphs ([str]): The paragraphs in order
+            size (int): The tokens available
+
+        Returns:
+            [str]: The trailing paragraphs that fit
+        """
+        return list(reversed(self.head(list(reversed(paragraphs)), size)))
+
+    def chunk(self, paragraphs: [str], size: int, breaks: [bool] = None) -> [[str]]:
+        """ Splits paragraphs into consecutive chunks of at most size tokens
+
+        Every paragraph ends up in exactly one chunk. Paragraphs larger than a
+        chunk on their own are split between words.
+
+        Args:
+            paragraphs ([str]): The paragraphs in order
+            size (int): The most tokens in a chunk
+            breaks ([bool]): Optionally, whether a chunk at least half full should end after each paragraph.
+                Breaks chosen from the paragraphs' content keep the chunks around an edit unchanged.
+
+        Returns:
+            [[str]]: The paragraphs of each chunk
+        """
+        size = max(size, 1)
+        chunks = []
+        current = []
+        used = 0
+        for i, paragraph in enumerate(paragraphs):
+            count = self.count(paragraph) + 1
+            if count > size:
+                pieces = self._split(paragraph, size)
+            else:
+                pieces = [(paragraph, count)]
+
+            for piece, count in pieces:
+                if used + count > size and len(current) > 0:
+                    chunks.append(current)
+                    current = []
+                    used = 0
+                current.append(piece)
+                used += count
+
+            if breaks is not None and breaks[i] and used >= size // 2:
+                chunks.append(current)
+                current = []
+                used = 0
+
+        if len(current) > 0:
+            chunks.append(current)
+        return chunks
+
+    def _split(self, paragraph: str, size: int) -> [tuple]:
+        # Words are counted on their own, which slightly overestimates but never overflows
+        pieces = []
+        words = []
+        used = 1
+        for word in paragraph.split(" "):
+            count = self.count(word) + 1
+            if len(words) > 0 and used + count > size:
+                pieces.append((" ".join(words), used))
+                words = []
+                used = 1
+            words.append(word)
+            used += count
+
+        if len(words) > 0:
+            pieces.append((" ".join(words), used))
+        return pieces
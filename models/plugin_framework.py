@@ -2,12 +2,20 @@
 import os
 import json
 import yaml
+import hashlib
 import importlib
+import threading
 from typing import List
 from utils.logging import getLogger
 
 logger = getLogger('Plugin Framework', 'DEBUG')
 
+# Connections each plugin client keeps open unless configured with 'max_connections' or 'max_concurrency'
+DEFAULT_CONNECTION_POOL_SIZE = 10
+
+_instances = {}
+_instances_lock = threading.Lock()
+
 def get_plugin_definitions(type: str) -> List[dict]:
     """ Returns a list of plugin definitions for the given type 
     
@@ -48,4 +56,59 @@ def load_plugin_class(plugin_registration: dict) -> any:
     logger.info("Module loaded")
     plugin_class = getattr(module, plugin_registration['class'])
 
-    return plugin_class
\ No newline at end of file
+    return plugin_class
+
+def config_hash(config: dict) -> str:
+    """ Returns a hash of a plugin configuration that changes whenever any of its values do """
+    identity = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+def get_plugin_instance(plugin_registration: dict, config: dict) -> any:
+    """ Returns the plugin instance for a configuration, reusing the last instance built for it
+
+    Plugins hold clients with connection pools and TLS sessions, so they are
+    only rebuilt when the configuration of their role actually changes. The
+    instance that is replaced has its close method called, if it has one, to
+    release what it holds such as worker processes.
+
+    Args:
+        plugin_registration (dict): The plugin registration to load
+        config (dict): The configuration of the plugin, including the role it serves
+
+    Returns: The plugin instance
+    """
+    slot = (config.get('role', None), plugin_registration['name'])
+    key = config_hash(config)
+
+    with _instances_lock:
+        existing = _instances.get(slot, None)
+        if existing is not None and existing[0] == key:
+            return existing[1]
+
+        plugin_class = load_plugin_class(plugin_registration)
+        instance = plugin_class(config)
+        _instances[slot] = (key, instance)
+        logger.info(f"Built plugin {plugin_registration['name']} for role {slot[0]}")
+
+    if existing is not None:
+        close_plugin(existing[1])
+    return instance
+
+def close_plugin(instance: any):
+    """ Releases what a plugin instance holds, for plugins that have a close method """
+    close = getattr(instance, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        logger.error(f"Failed to close plugin {getattr(instance, 'name', instance)}: {e}")
+
+def connection_pool_size(config: dict) -> int:
+    """ Returns the connections a plugin's client should keep open
+
+    Sized by 'max_connections', or by 'max_concurrency' so the pool matches
+    the calls allowed in flight at once.
+    """
+    size = config.get('max_connections', None) or config.get('max_concurrency', None) or DEFAULT_CONNECTION_POOL_SIZE
+    return max(1, int(size))
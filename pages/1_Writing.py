@@ -55,6 +55,18 @@ chapter = st.session_state.chapter
 # Chapter details
 st.write('# ' + chapter.name)
 
+unsaved = book.storage.unsavedChanges()
+if len(unsaved) > 0:
+    # Failed saves stay queued and are tried again, so the edits are kept in the meantime
+    st.error("Some changes could not be saved yet and will be tried again: " + "; ".join([f"{path}: {error}" for path, error in unsaved.items()]))
+
+if chapter.is_stale:
+    colStale, colRefresh = st.columns([0.8, 0.2])
+    colStale.warning("This chapter was edited since its summary, characters or evaluations were made")
+    if colRefresh.button("Refresh Stale"):
+        chapter.refreshStale()
+        st.rerun()
+
 onView = st.selectbox("Views", ["View", "Edit", "Summary", "Characters", "Technical", "Entertainment"], key="writing_view")
 
 if st.session_state.writing_view == "View":
@@ -64,18 +76,22 @@ if st.session_state.writing_view == "Edit":
     contentEditor(book, chapter)
 
 if st.session_state.writing_view == "Summary":
-    st.write(chapter.summary)
+    if chapter.has_summary:
+        st.write(chapter.summary)
+    else:
+        # Show the summary as it is written rather than once it is done
+        st.write_stream(chapter.streamSummary())
 
 if st.session_state.writing_view == "Characters":
     viewChapterCharacters(chapter)
 
 if st.session_state.writing_view == "Technical":
     if st.button("Re-evaluate Technical"):
-        chapter.evalTechnical()
+        chapter.evalTechnical(refresh=True)
     st.write(chapter.technical_eval)
 
 if st.session_state.writing_view == "Entertainment":
     if st.button("Re-evaluate Entertainment"):
-        chapter.evalEntertainment()
+        chapter.evalEntertainment(refresh=True)
     
     st.write(chapter.entertainment_eval)
\ No newline at end of file
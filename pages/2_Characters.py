@@ -35,7 +35,7 @@ if st.session_state.character_name is not None and st.session_state.character_na
     
     imgCol, descCol = st.columns([1, 8])
     with imgCol:
-        st.image(f"data:image/png;base64, {character.thumbnail}")
+        st.image(character.thumbnail_uri)
         st.write(character.name)
     with descCol:
         tabRefs, tabStory, tabAppear, tabExpert = st.tabs(["References", "Story", "Appearance", "Expertise"])
@@ -1,6 +1,7 @@
 import streamlit as st
 from pages.views.settings import AIConfig
 from utils.storage import Storage
+from models.llm import getLLM
 
 st.write("# Settings")
 
@@ -26,3 +27,10 @@ with tab_ent:
 
 with tab_voice:
     AIConfig('voice', 0.7, settings)
+
+cache_stats = storage.cacheStats()
+st.caption(f"Storage cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} files cached")
+
+response_stats = getLLM().cacheStats()
+if response_stats is not None:
+    st.caption(f"LLM response cache: {response_stats['hits']} hits, {response_stats['misses']} misses ({response_stats['hit_rate']:.0%} hit rate), {response_stats['entries']} responses cached")
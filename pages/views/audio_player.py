@@ -0,0 +1,64 @@
+import json
+import base64
+import uuid
+import streamlit.components.v1 as components
+
+# Each player joins a channel shared by the players of one playback, and
+# starts once the player before it has ended. Players that load after their
+# predecessor ended ask the channel what has already finished.
+PLAYER_HTML = """
+<audio id="player" controls style="width: 100%" src="{source}"></audio>
+<script>
+    const index = {index};
+    const player = document.getElementById("player");
+    const channel = new BroadcastChannel({channel});
+    let started = false;
+    let ended = false;
+
+    function start() {{
+        if (started) return;
+        started = true;
+        player.play();
+    }}
+
+    channel.onmessage = (event) => {{
+        const message = event.data;
+        if (message.type === "ended" && message.index === index - 1) start();
+        if (message.type === "query" && ended) channel.postMessage({{ type: "ended", index: index }});
+        if (message.type === "play" && message.index !== index) player.pause();
+    }};
+
+    player.onplay = () => {{
+        started = true;
+        channel.postMessage({{ type: "play", index: index }});
+    }};
+    player.onended = () => {{
+        ended = true;
+        channel.postMessage({{ type: "ended", index: index }});
+    }};
+
+    if (index === 0) {{
+        start();
+    }} else {{
+        channel.postMessage({{ type: "query" }});
+    }}
+</script>
+"""
+
+def newPlayback() -> str:
+    """Creates the channel that chains the players of one playback together"""
+    return f"audio-{uuid.uuid4().hex}"
+
+def queuedAudio(audio: bytes, mime_type: str, index: int, playback: str):
+    """Shows a player for one piece of audio that plays as soon as the piece before it in the playback ends
+
+    The first piece plays right away, so listening starts while later pieces are still being prepared.
+
+    Args:
+        audio (bytes): The audio to play
+        mime_type (str): The MIME type of the audio
+        index (int): The position of the piece in the playback
+        playback (str): The playback the piece belongs to, from newPlayback
+    """
+    source = f"data:{mime_type};base64,{base64.b64encode(audio).decode('utf-8')}"
+    components.html(PLAYER_HTML.format(source=source, index=index, channel=json.dumps(playback)), height=60)
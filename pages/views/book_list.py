@@ -18,14 +18,24 @@ def book_list():
         st.session_state.selected_book = st.session_state.book_name
         st.session_state.book = library.getBook(st.session_state.book_name)
 
-    library = BookLibrary()
+    # The library only reads its index, so keep it across reruns
+    if 'library' not in st.session_state:
+        st.session_state.library = BookLibrary()
+    library = st.session_state.library
+
+    def book_label(title: str) -> str:
+        info = library.getBookInfo(title)
+        if info is None:
+            return title
+        return f"{title} ({info['chapters']} chapters, {info['words']:,} words)"
+
     books = library.listBooks()
     book_index = 0
     book = None
     if len(books) > 0 and 'selected_book' in st.session_state:
         # Get index of the book in the list
         book_index = books.index(st.session_state.selected_book)
-    st.selectbox("Books", books, index=book_index, key="book_name", on_change=book_change)
+    st.selectbox("Books", books, index=book_index, key="book_name", format_func=book_label, on_change=book_change)
     
     if st.session_state.book is None:
         storyFile = st.file_uploader("Upload story")
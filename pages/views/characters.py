@@ -8,7 +8,7 @@ def listCharacters(chapter: Chapter):
         columns = st.columns(len(characters))
         for i in range(len(characters)):
             with columns[i]:
-                st.image(f"data:image/png;base64, {characters[i].thumbnail}")
+                st.image(characters[i].thumbnail_uri)
                 st.write(characters[i].name)
 
 def viewChapterCharacters(chapter: Chapter):
@@ -32,7 +32,7 @@ def viewChapterCharacters(chapter: Chapter):
         actions = []
 
         for character in chapter.characters:
-            thumbnails.append(f"data:image/png;base64,{character.thumbnail}")
+            thumbnails.append(character.thumbnail_uri)
             names.append(character.name)
             descriptions.append(character.description)
             actions.append(False)
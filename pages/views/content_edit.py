@@ -1,25 +1,23 @@
 import streamlit as st
 from models.book_maker import Book, Chapter
+from models.book_maker.paragraph import SEPARATOR
 from models.llm import getLLM
 from streamlit_quill import st_quill
 
-def segmentEditor(original_text: str, chapter: Chapter):
-    if original_text is None:
+# Tokens kept free for a rewrite beyond the length of the text it replaces
+EDIT_RESPONSE_TOKENS = 500
+
+def segmentEditor(paragraph_ids: [str], chapter: Chapter):
+    if paragraph_ids is None or len(paragraph_ids) == 0:
         return
-    
-    original_text = original_text.strip()
-    print(f"\"{original_text}\"")
-    start_pos = 0
-    if original_text != '':
-        try:
-            start_pos = chapter.content.index(original_text)
-        except:
-            start_pos = -1
-
-    if start_pos == -1:
+
+    span = chapter.paragraphs.span(paragraph_ids)
+    if span is None:
+        st.warning("Select paragraphs that follow each other to edit them as a segment")
         return
 
-    end_pos = start_pos + len(original_text)
+    start_pos, end_pos = span
+    original_text = chapter.content[start_pos:end_pos]
 
     chatCol, displayCol = st.columns([0.3, 0.7])
     if "original_text" not in st.session_state:
@@ -39,22 +37,39 @@ def segmentEditor(original_text: str, chapter: Chapter):
             conversation.append({ "role": "user", "content": prompt })
 
             llm = getLLM()
+            acknowledgement = { "role": "ai", "content": "I will use that in future content"}
             origin = [ { "role": "user", "content": f"I will describe the fictional story and changes wanted, and you will only return the updates to the text without commentary. The writing style for this book is as follows: {chapter.book.writing_style}" } ]
+
+            basis = []
+            if st.session_state.edit_text is not None:
+                basis.append({ "role": "user", "content": f"Use the following text as a basis for the request, and ensure that all parts of the story the text covers are returned in the response. Only return the story without any commentary: {st.session_state.edit_text}"})
+
+            # The rewrite is about as long as the text it replaces
+            budget = llm.budget('content', EDIT_RESPONSE_TOKENS)
+            budget.reserve(budget.count(st.session_state.edit_text or ''))
+            remaining = budget.limit - budget.countMessages(origin + [acknowledgement] + basis + conversation)
+
             for character in chapter.characters:
-                origin.append({ "role": "ai", "content": "I will use that in future content"})
-                origin.append({ "role": "user", "content": f"The character {character.name} visually is {character.visual_description}. The character's story arch so far: {character.summary}" })
+                description = [acknowledgement, { "role": "user", "content": f"The character {character.name} visually is {character.visual_description}. The character's story arch so far: {character.summary}" }]
+                if budget.countMessages(description) > remaining:
+                    break
+                origin += description
+                remaining -= budget.countMessages(description)
             
-            origin.append({ "role": "ai", "content": "I will use that in future content"})
+            origin.append(acknowledgement)
 
-            original_text_index = chapter.content.index(original_text)
-            if original_text_index > 0:
-                origin.append({ "role": "user", "content": f"The current chapter up to this point is: {chapter.content[:original_text_index]}"})
-                origin.append({ "role": "ai", "content": "I will use that in future content"})
+            # Keep the part of the chapter closest to the segment that still fits
+            prefix = "The current chapter up to this point is: "
+            preceding = [paragraph.text for paragraph in chapter.paragraphs if paragraph.end <= start_pos]
+            preceding = budget.tail(preceding, remaining - budget.countMessages([{ "role": "user", "content": prefix }, acknowledgement]))
+            if len(preceding) > 0:
+                origin.append({ "role": "user", "content": prefix + SEPARATOR.join(preceding)})
+                origin.append(acknowledgement)
 
-            if st.session_state.edit_text is not None:
-                origin.append({ "role": "user", "content": f"Use the following text as a basis for the request, and ensure that all parts of the story the text covers are returned in the response. Only return the story without any commentary: {st.session_state.edit_text}"})
+            origin += basis
 
-            response = llm.conversation(origin + conversation, 0.7)
+            # Asking again should give a new take on the text, not the cached one
+            response = messages.chat_message("ai").write_stream(llm.streamConversation(origin + conversation, 0.7, cache=False))
             conversation.append({ "role": "ai", "content": response })
             messages.chat_message("ai").write("The text has been updated")
             st.session_state.prev_text = st.session_state.edit_text
@@ -74,12 +89,13 @@ def segmentEditor(original_text: str, chapter: Chapter):
 
         col1, col2 = st.columns([1, 1])
         if col1.button("Replace in document"):
-            content_text = chapter.content[start_pos:end_pos]
-            if content_text == original_text:
-                print("Replacing text")
-                chapter.content = chapter.content[:start_pos] + st.session_state.edit_text_area + chapter.content[end_pos:]
+            replaced = chapter.replaceParagraphs(paragraph_ids, st.session_state.edit_text_area)
+            if replaced is None:
+                print("Paragraphs not found in document")
             else:
-                print("Text not found in document")
+                # The segment now covers the paragraphs holding the new text, so replacing again overwrites them
+                st.session_state['edit_paragraphs'] = replaced
+                st.rerun()
 
         if col2.button("Revert to previous"):
             st.session_state.edit_text = st.session_state.prev_text
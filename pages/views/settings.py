@@ -1,7 +1,7 @@
 import streamlit as st
 from utils import Storage, getLogger
 from models.llm import getLLM
-from models.plugin_framework import load_plugin_class
+from models.plugin_framework import get_plugin_instance
 
 logger = getLogger('Settings')
 
@@ -77,6 +77,5 @@ def AIConfig(key: str, default_temp: float, settings: dict):
         st.write(f"Plugin definition not found for {provider}")
         return
     
-    pluginClass = load_plugin_class(plugin_def)
-    plugin = pluginClass(setting)
+    plugin = get_plugin_instance(plugin_def, setting)
     plugin.display_config(key, setting, lambda: saveSettings(settings))
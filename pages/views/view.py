@@ -1,25 +1,25 @@
 import streamlit as st
 from pages.views.characters import listCharacters
 from pages.views.content_edit import contentEditor, segmentEditor
+from pages.views.audio_player import newPlayback, queuedAudio
 from models.book_maker import Chapter
 from models.llm import getLLM
 
 def viewChapter(chapter: Chapter):
 
-    paragraphs = chapter.content.split("\n\n")
-    st.session_state.paragraphs = paragraphs
+    paragraphs = chapter.paragraphs
+
+    def selectedParagraphs() -> [str]:
+        return [paragraph.id for paragraph in paragraphs if st.session_state.get(f"PlayParagraph{paragraph.id}", False)]
 
     with st.sidebar:
         st.divider()
 
         if st.session_state.get('edit_segment', False) == False and st.button("Edit Segment"):
-            paragraphs = st.session_state.paragraphs
-            edit_content = ""
-            for i in range(len(paragraphs)):
-                if st.session_state.get(f"PlayParagraph{i}", False):
-                    edit_content += paragraphs[i] + "\n\n"
+            selected = selectedParagraphs()
+            edit_content = "\n\n".join([paragraphs.get(id).text for id in selected])
             st.session_state.edit_text = edit_content
-            st.session_state['edit_content'] = edit_content
+            st.session_state['edit_paragraphs'] = selected
             st.session_state['edit_segment'] = True
             st.rerun()
 
@@ -33,23 +33,30 @@ def viewChapter(chapter: Chapter):
         if st.session_state.audio is None:
             st.divider()
             if st.sidebar.button(f"Play Audio"):
-                audio_list = []
-                for i in range(len(paragraphs)):
-                    if st.session_state.get(f"PlayParagraph{i}", False):
-                        audio_list.append(i)
-                
-                st.session_state.audio = chapter.getAudio(audio_list)
-                st.rerun()
+                # The first paragraph plays as soon as it is ready, and each player starts when the one before it ends
+                selected = selectedParagraphs()
+                playback = newPlayback()
+                progress = st.progress(0.0, text="Preparing audio")
+                prepared = 0
+                for chunk in chapter.streamAudio(selected):
+                    queuedAudio(chunk, getLLM().speech_mime_type, prepared, playback)
+                    prepared += 1
+                    progress.progress(min(prepared / len(selected), 1.0), text=f"Prepared {prepared} of {len(selected)} paragraphs")
+                progress.empty()
+
+                # Every paragraph is cached now, so the full audio is assembled from the cache for the player kept
+                # after the next interaction. Rerunning now would stop the paragraphs still playing.
+                audio = chapter.getAudio(selected) if prepared > 0 else None
+                st.session_state.audio = audio if audio is not None and len(audio) > 0 else None
             if st.sidebar.button("Clear Selected Audio"):
-                for i in range(len(paragraphs)):
-                    if st.session_state.get(f"PlayParagraph{i}", False):
-                        chapter.clearAudio(i)
+                for paragraph_id in selectedParagraphs():
+                    chapter.clearAudio(paragraph_id)
 
             st.divider()
         
         if st.session_state.audio is not None:
             st.divider()
-            st.audio(st.session_state.audio, format="audio/mp3")
+            st.audio(st.session_state.audio, format=getLLM().speech_mime_type)
             if st.button("Reset audio player"):
                 st.session_state.audio = None
                 st.rerun()
@@ -70,7 +77,7 @@ def viewChapter(chapter: Chapter):
             st.select_slider("Entertainment", value=chapter.entertainment_eval.score, options=range(0, 100), help=help_text)
 
             if st.button("Refresh Entertainment Feedback", type="tertiary"):
-                chapter.evalEntertainment()
+                chapter.evalEntertainment(refresh=True)
                 st.rerun()
 
     with col2:
@@ -80,27 +87,26 @@ def viewChapter(chapter: Chapter):
                 help_text += f"- {feedback}\n"
             st.select_slider("Technical", value=chapter.technical_eval.score, options=range(0, 100), help=help_text)
         if st.button("Refresh Technical Feedback", type="tertiary"):
-            chapter.evalTechnical()
+            chapter.evalTechnical(refresh=True)
             st.rerun()
 
     listCharacters(chapter)
 
     def selectAllChanged():
         to_value = st.session_state.get(f"PlayAllParagraph", False)
-        for p in range(len(paragraphs)):
-            st.session_state[f"PlayParagraph{p}"] = to_value
+        for paragraph in paragraphs:
+            st.session_state[f"PlayParagraph{paragraph.id}"] = to_value
 
 
     if st.session_state.get('edit_segment', False):
-        segmentEditor(st.session_state.get('edit_content', ''), chapter)
+        segmentEditor(st.session_state.get('edit_paragraphs', []), chapter)
     else:
         st.checkbox("Select All", value=True, key="PlayAllParagraph", on_change=selectAllChanged)
         
-        for i in range(len(paragraphs)):
-            paragraph = paragraphs[i]
+        for i, paragraph in enumerate(paragraphs):
             colRadio, colNumber, colParagraph = st.columns([0.7, 0.5, 10])
 
             colRadio.html(f"<a id=\"paragraph{i}\"></a>")
-            colRadio.checkbox(f"Play {i}", value=st.session_state.get(f"PlayParagraph{i}", True), key=f"PlayParagraph{i}", label_visibility="hidden")
+            colRadio.checkbox(f"Play {i}", value=st.session_state.get(f"PlayParagraph{paragraph.id}", True), key=f"PlayParagraph{paragraph.id}", label_visibility="hidden")
             colNumber.write(f"{i}")
-            colParagraph.write(paragraph)
+            colParagraph.write(paragraph.text)
@@ -1,5 +1,8 @@
+import httpx
 import openai as openai
 from utils.logging import getLogger
+from models.plugin_framework import connection_pool_size
+from models.llm.tokens import contextWindow
 import streamlit as st
 
 class ApiLLM:
@@ -12,12 +15,21 @@ class ApiLLM:
             self.max_tokens = 0
             return
 
+        pool_size = connection_pool_size(config)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
         self.client = openai.OpenAI(
             base_url=self.endpoint,
-            api_key=config.get('api_key', "not-needed")
+            api_key=config.get('api_key', "not-needed"),
+            http_client=openai.DefaultHttpxClient(limits=limits)
+        )
+        self.async_client = openai.AsyncOpenAI(
+            base_url=self.endpoint,
+            api_key=config.get('api_key', "not-needed"),
+            http_client=openai.DefaultAsyncHttpxClient(limits=limits)
         )
         self.client.with_options()
         self.max_tokens = int(config.get('max_tokens', '10370'))
+        self.context_window = int(config.get('context_window', None) or contextWindow(self.model, self.max_tokens))
 
     def display_config(self, feature: str, setting: dict, saveSettings: any):
         # Get API Information
@@ -43,45 +55,92 @@ class ApiLLM:
             saveSettings()
         st.text_input(f"{feature} Max Tokens", value=setting.get('max_tokens', '10370'), key=f"{feature}_max_tokens", on_change=on_change_max_tokens)
 
+        def on_change_context_window():
+            setting['context_window'] = st.session_state[f"{feature}_context_window"]
+            saveSettings()
+        st.text_input(f"{feature} Context Window", value=setting.get('context_window', ''), key=f"{feature}_context_window", on_change=on_change_context_window, help="""
+            The tokens the model accepts for the prompt and response together. Leave empty to use the known window of the model, or Max Tokens if it is not known.
+            """)
+
     def getAIFunctions():
         return ['Entertainment', "Technical", "Entertainment", "Speech"]
 
+    def _promptMessages(self, prompt):
+        return [
+            { "role": "system", "content": "You are a focused copywriter. When you respond you only respond with the requested information and no context or conversation." },
+            { "role": "user", "content": prompt }
+        ]
+
+    def _messages(self, conversation):
+        messages = []
+        for message in conversation:
+            role = message['role']
+            if role == 'ai':
+                role = 'system'
+            messages.append({"role": role, "content": message["content"]})
+        return messages
+
+    def _responseText(self, response):
+        if response.choices is None:
+            return None
+
+        return response.choices[0].message.content
+
+    def _deltas(self, stream):
+        # Compatible servers send the response as server-sent events, some with chunks that have no choices
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
     def prompt(self, prompt):
         # Prompt the LLM with the given prompt
-        logger = getLogger()
         response = self.client.chat.completions.create(
             model = self.model,
-            messages = [
-                { "role": "system", "content": "You are a focused copywriter. When you respond you only respond with the requested information and no context or conversation." },
-                { "role": "user", "content": prompt }
-            ]
+            messages = self._promptMessages(prompt)
         )
 
-        if response.choices is None:
-            return None
+        return self._responseText(response)
 
-        retval = response.choices[0].message.content
-        
-        return retval
+    def streamPrompt(self, prompt):
+        stream = self.client.chat.completions.create(
+            model = self.model,
+            messages = self._promptMessages(prompt),
+            stream = True
+        )
+        yield from self._deltas(stream)
 
-    def conversation(self, conversation):
-        # Prompt the LLM with the given conversation
-        logger = getLogger()
-        messages = []
-        for message in conversation:
-            role = message['role']
-            if role == 'ai':
-                role = 'system'
-            messages.append({"role": message['role'], "content": message['content']})
+    async def aprompt(self, prompt):
+        response = await self.async_client.chat.completions.create(
+            model = self.model,
+            messages = self._promptMessages(prompt)
+        )
 
+        return self._responseText(response)
+
+    def conversation(self, conversation, temperature: float = None):
+        # Prompt the LLM with the given conversation
         response = self.client.chat.completions.create(
             model = self.model,
-            messages = messages
+            messages = self._messages(conversation),
+            temperature = temperature if temperature is not None else openai.NOT_GIVEN
         )
 
-        if response.choices is None:
-            return None
+        return self._responseText(response)
 
-        retval = response.choices[0].message.content
+    def streamConversation(self, conversation, temperature: float = None):
+        stream = self.client.chat.completions.create(
+            model = self.model,
+            messages = self._messages(conversation),
+            temperature = temperature if temperature is not None else openai.NOT_GIVEN,
+            stream = True
+        )
+        yield from self._deltas(stream)
+
+    async def aconversation(self, conversation, temperature: float = None):
+        response = await self.async_client.chat.completions.create(
+            model = self.model,
+            messages = self._messages(conversation),
+            temperature = temperature if temperature is not None else openai.NOT_GIVEN
+        )
 
-        return retval
\ No newline at end of file
+        return self._responseText(response)
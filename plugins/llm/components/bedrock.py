@@ -3,6 +3,8 @@ from botocore.config import Config
 import json
 import base64
 import streamlit as st
+from models.plugin_framework import connection_pool_size
+from models.llm.tokens import contextWindow, DEFAULT_CONTEXT_WINDOW
 
 class BedrockLLM:
     def __init__(self, settings: dict):
@@ -10,8 +12,12 @@ class BedrockLLM:
         self.model_id = settings['model']
         self.max_tokens = settings['max_tokens']
 
+        # max_tokens caps the response, the prompt is packed into the model's context window
+        self.response_tokens = int(self.max_tokens)
+        self.context_window = int(settings.get('context_window', None) or contextWindow(self.model_id, DEFAULT_CONTEXT_WINDOW))
+
         # Instantiate Bedrock LLM Client
-        config = Config(read_timeout=1000)
+        config = Config(read_timeout=1000, max_pool_connections=connection_pool_size(settings))
         self.client = boto3.client("bedrock-runtime", config=config)
 
     def display_config(self, feature: str, setting: dict, saveSettings: any):
@@ -99,7 +105,16 @@ class BedrockLLM:
         def on_change_max_tokens():
             setting['max_tokens'] = st.session_state[f"{feature}_max_tokens"]
             saveSettings()
-        st.text_input(f"{feature} Max Tokens", value=setting.get('max_tokens', 1024), key=f"{feature}_max_tokens", on_change=on_change_max_tokens)
+        st.text_input(f"{feature} Max Tokens", value=setting.get('max_tokens', 1024), key=f"{feature}_max_tokens", on_change=on_change_max_tokens, help="""
+            The most tokens in a response.
+            """)
+
+        def on_change_context_window():
+            setting['context_window'] = st.session_state[f"{feature}_context_window"]
+            saveSettings()
+        st.text_input(f"{feature} Context Window", value=setting.get('context_window', ''), key=f"{feature}_context_window", on_change=on_change_context_window, help="""
+            The tokens the model accepts for the prompt and response together. Leave empty to use the known window of the model.
+            """)
 
         # Configure temperature
         if 'temperature' not in setting:
@@ -141,7 +156,7 @@ class BedrockLLM:
         print(response_text)
         return response_text
 
-    def conversation(self, conversation, temperature: float = 0.5):
+    def _messages(self, conversation):
         # Convert conversation into messages
         messages = []
         for message in conversation:
@@ -150,6 +165,31 @@ class BedrockLLM:
                 role = "assistant"
 
             messages.append({"role": role, "content": [{"text": message["content"]} ]})
+        return messages
+
+    def _streamText(self, messages, inference: dict):
+        # The Converse API streams the same messages as text deltas
+        response = self.client.converse_stream(
+            modelId=self.model_id,
+            messages=messages,
+            inferenceConfig=inference
+        )
+
+        for event in response["stream"]:
+            delta = event.get("contentBlockDelta", None)
+            if delta is not None and "text" in delta["delta"]:
+                yield delta["delta"]["text"]
+
+    def streamPrompt(self, prompt):
+        messages = [{ "role": "user", "content": [ { "text": prompt } ] }]
+        yield from self._streamText(messages, { "temperature": 0.5, "topP": 0.9 })
+
+    def streamConversation(self, conversation, temperature: float = 0.5):
+        inference = { "maxTokens": int(self.max_tokens), "temperature": temperature, "topP": 0.9 }
+        yield from self._streamText(self._messages(conversation), inference)
+
+    def conversation(self, conversation, temperature: float = 0.5):
+        messages = self._messages(conversation)
 
         # Construct the prompt to bedrock
         response = self.client.invoke_model(
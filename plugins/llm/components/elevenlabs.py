@@ -1,8 +1,11 @@
+import httpx
 import requests
 import json
+import base64
 import streamlit as st
 from elevenlabs.client import ElevenLabs
 from utils import getLogger
+from models.plugin_framework import connection_pool_size
 
 logger = getLogger('ElevenLabs')
 
@@ -12,12 +15,18 @@ class ElevenLabsClient:
         self.api_key = config.get('api_key', None)
         self.voice = config.get('voice', 'Alice')
         self.voice_id = config.get('voice_id', None)
+        self.model_id = config.get('model_id', 'eleven_multilingual_v2')
+        self.max_batch_characters = int(config.get('max_batch_characters', 5000))
         self.client: ElevenLabs = None
 
         if self.api_key is None:
             self.max_tokens = 0
         else:
-            self.client = ElevenLabs(api_key=self.api_key)
+            pool_size = connection_pool_size(config)
+            self.client = ElevenLabs(
+                api_key=self.api_key,
+                httpx_client=httpx.Client(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+            )
             self.max_tokens = 10000
 
     def display_config(self, feature: str, setting: dict, saveSettings: any):
@@ -45,12 +54,43 @@ class ElevenLabsClient:
         st.selectbox(f"{feature} Voice", name_list, key=f"{feature}_voice", index=name_list.index(setting.get('voice', 'Alice')), on_change=on_change)
         # st.text_input(f"{feature} Voice", value=setting.get('voice', ''), key=f"{feature}_voice", on_change=on_change)
 
+    @property
+    def voice_signature(self) -> dict:
+        """ The voice and model the speech is produced with """
+        return { 'voice': self.voice_id, 'model': self.model_id }
+
     def getAIFunctions():
         return ['Speech']
 
     def getSpeech(self, paragraph: str) -> bytes:
         if paragraph.strip() == "":
             return None
+
+        return b''.join(self.streamSpeech(paragraph))
+
+    def getTimedSpeech(self, paragraph: str) -> tuple:
+        """ Generates speech along with the time each character is spoken
+
+        Returns:
+            tuple: The MP3 audio and a list of (character offset, start time in seconds)
+        """
+        response = self.client.text_to_speech.convert_with_timestamps(
+            text=paragraph,
+            voice_id=self.voice_id,
+            output_format="mp3_44100_128",
+            model_id=self.model_id
+        )
+
+        alignment = response.alignment
+        if alignment is None or len(alignment.characters) != len(paragraph):
+            return None
+
+        audio = base64.b64decode(response.audio_base_64)
+        return (audio, list(enumerate(alignment.character_start_times_seconds)))
+
+    def streamSpeech(self, paragraph: str):
+        if paragraph.strip() == "":
+            return
         
         logger.info(f"Speech: {paragraph}")
 
@@ -58,12 +98,9 @@ class ElevenLabsClient:
             text=paragraph,
             voice_id=self.voice_id,
             output_format="mp3_44100_128",
-            model_id="eleven_multilingual_v2"
+            model_id=self.model_id
         )
 
-        retval: bytes = b''
         for chunk in audio_stream:
             if isinstance(chunk, bytes):
-                retval += chunk
-
-        return retval
\ No newline at end of file
+                yield chunk
\ No newline at end of file
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import importlib.util
+import multiprocessing
+import streamlit as st
+from concurrent.futures import ProcessPoolExecutor
+from utils import getLogger
+
+logger = getLogger('LocalTTS')
+
+# The speech engine of the worker process, created once when the worker starts
+_engine = None
+
+def _startEngine(voice_id: str, rate: int):
+    global _engine
+    import pyttsx3
+    _engine = pyttsx3.init()
+    if voice_id is not None and voice_id != '':
+        _engine.setProperty('voice', voice_id)
+    _engine.setProperty('rate', rate)
+
+def _synthesize(paragraph: str) -> bytes:
+    """ Speaks a paragraph into a WAV file in the worker process and returns its bytes """
+    handle, path = tempfile.mkstemp(suffix=".wav")
+    os.close(handle)
+    try:
+        _engine.save_to_file(paragraph, path)
+        _engine.runAndWait()
+        with open(path, "rb") as f:
+            audio = f.read()
+            f.close()
+        return audio
+    finally:
+        os.remove(path)
+
+class LocalTTS:
+    """ Offline speech through pyttsx3, espeak on Linux
+
+    The speech engine runs in worker processes, since pyttsx3 blocks while
+    it speaks and its engine cannot be shared between threads. The audio is
+    WAV rather than MP3.
+    """
+    def __init__(self, config: dict):
+        self.name = "Local TTS"
+        self.voice_id = config.get('voice_id', '')
+        self.rate = int(config.get('rate', 200))
+        self.workers = max(1, int(config.get('workers', 1)))
+        self.audio_format = 'wav'
+        self._pool = None
+
+        if importlib.util.find_spec('pyttsx3') is None:
+            logger.error("pyttsx3 is not installed")
+            self.max_tokens = 0
+        else:
+            self.max_tokens = 10000
+
+    def _getPool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_startEngine,
+                initargs=(self.voice_id, self.rate)
+            )
+        return self._pool
+
+    def close(self):
+        """ Stops the worker processes, called when the instance is replaced after the configuration changes """
+        pool = self._pool
+        self._pool = None
+        if pool is not None:
+            # Paragraphs already queued still finish, then the workers exit
+            pool.shutdown(wait=False)
+
+    def display_config(self, feature: str, setting: dict, saveSettings: any):
+        st.write("## Local TTS Configurations")
+
+        # Settings for voice
+        def on_change():
+            setting['voice_id'] = st.session_state[f"{feature}_voice_id"]
+            saveSettings()
+        st.text_input(f"{feature} Voice ID", value=setting.get('voice_id', ''), key=f"{feature}_voice_id", on_change=on_change, help="""
+            The pyttsx3 voice to speak with, leave empty for the system default.
+            """)
+
+        # Settings for rate
+        def on_change_rate():
+            setting['rate'] = st.session_state[f"{feature}_rate"]
+            saveSettings()
+        st.number_input(f"{feature} Rate", min_value=50, max_value=400, value=int(setting.get('rate', 200)), key=f"{feature}_rate", on_change=on_change_rate, help="""
+            The speaking rate in words per minute.
+            """)
+
+        # Settings for workers
+        def on_change_workers():
+            setting['workers'] = st.session_state[f"{feature}_workers"]
+            saveSettings()
+        st.number_input(f"{feature} Workers", min_value=1, max_value=8, value=int(setting.get('workers', 1)), key=f"{feature}_workers", on_change=on_change_workers, help="""
+            The number of processes speaking paragraphs at once.
+            """)
+
+    @property
+    def voice_signature(self) -> dict:
+        """ The voice and model the speech is produced with """
+        return { 'voice': self.voice_id, 'model': f"pyttsx3/{self.rate}" }
+
+    def getAIFunctions():
+        return ['Speech']
+
+    def getSpeech(self, paragraph: str) -> bytes:
+        if paragraph.strip() == "":
+            return None
+
+        logger.info(f"Speech: {paragraph}")
+        return self._getPool().submit(_synthesize, paragraph).result()
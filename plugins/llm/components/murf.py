@@ -1,6 +1,8 @@
 import requests
 import json
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from models.plugin_framework import connection_pool_size
 
 murf_url = "https://api.murf.ai/v1/speech/generate"
 class Murf:
@@ -9,6 +11,14 @@ class Murf:
         self.api_key = config.get('api_key', None)
         self.local = config.get('local', 'en-US')
         self.model_version = config.get('model_version', 'GEN2')
+        self.voice_id = "en-UK-juliet"
+        self.max_batch_characters = int(config.get('max_batch_characters', 3000))
+
+        # Keep connections to Murf and its audio files open between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=connection_pool_size(config))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
         if self.api_key is None:
             self.max_tokens = 0
@@ -42,17 +52,24 @@ class Murf:
             saveSettings()
         st.text_input(f"{feature} Model Version", value=setting.get('model_version', 'GEN2'), key=f"{feature}_model_version", on_change=on_change_local)
 
+    @property
+    def voice_signature(self) -> dict:
+        """ The voice and model the speech is produced with """
+        return { 'voice': self.voice_id, 'model': f"{self.model_version}/{self.local}" }
+
     def getAIFunctions():
         return ['Speech']
 
     def getSpeech(self, paragraph: str) -> bytes:
         if paragraph.strip() == "":
             return None
-        
-        print(f"Speech: {paragraph}")
 
+        return b''.join(self.streamSpeech(paragraph))
+
+    def _generate(self, paragraph: str) -> dict:
+        """ Requests speech, returning the generate response with the audio file and word durations """
         payload = json.dumps({
-            "voiceId": "en-UK-juliet",
+            "voiceId": self.voice_id,
             "style": "Conversational",
             "text": paragraph,
             "rate": 0,
@@ -73,14 +90,47 @@ class Murf:
             'api-key': self.api_key
         }
 
-        response = requests.request("POST", murf_url, headers=headers, data=payload)
+        response = self.session.request("POST", murf_url, headers=headers, data=payload)
 
         result = response.json()
 
         print(f"Speech Result: {result}")
-        audioResponse = requests.request("GET", result["audioFile"])
+        return result
+
+    def getTimedSpeech(self, paragraph: str) -> tuple:
+        """ Generates speech along with the time each word is spoken
+
+        Returns:
+            tuple: The MP3 audio and a list of (character offset, start time in seconds)
+        """
+        if paragraph.strip() == "":
+            return None
+
+        result = self._generate(paragraph)
+        words = result.get("wordDurations", None)
+        if not words:
+            return None
+
+        # Locate each spoken word in the text to get its character offset
+        timings = []
+        offset = 0
+        for word in words:
+            position = paragraph.find(word.get("word", ""), offset)
+            if position == -1:
+                continue
+            timings.append((position, word["startMs"] / 1000))
+            offset = position + len(word["word"])
 
-        retval = audioResponse.content
+        audio = self.session.request("GET", result["audioFile"]).content
+        return (audio, timings)
+
+    def streamSpeech(self, paragraph: str):
+        if paragraph.strip() == "":
+            return
+        
+        print(f"Speech: {paragraph}")
 
-        # print(f"Speech Result: {retval}")
-        return retval
\ No newline at end of file
+        result = self._generate(paragraph)
+        with self.session.request("GET", result["audioFile"], stream=True) as audioResponse:
+            for chunk in audioResponse.iter_content(chunk_size=65536):
+                yield chunk
\ No newline at end of file
@@ -1,7 +1,10 @@
-from openai import OpenAI
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 import streamlit as st
 from typing import List
 from utils.logging import getLogger
+from models.plugin_framework import connection_pool_size
+from models.llm.tokens import contextWindow
 
 logger = getLogger(__name__)
 
@@ -9,7 +12,10 @@ class OpenAiLLM:
     def __init__(self, config: dict):
         self.name = "OpenAI"
         api_key = config.get('api_key', '')
-        self.client = OpenAI(api_key=api_key)
+        pool_size = connection_pool_size(config)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=limits))
+        self.async_client = AsyncOpenAI(api_key=api_key, http_client=DefaultAsyncHttpxClient(limits=limits))
         self.default_temp = config.get('default_temp', 0.7)
         self.model = config.get('model', 'gpt-4o')
         self.voice = config.get('voice', 'alloy')
@@ -19,6 +25,7 @@ class OpenAiLLM:
             self.max_tokens = 0
         else:
             self.max_tokens = 30000
+        self.context_window = int(config.get('context_window', None) or contextWindow(self.model, self.max_tokens))
 
     def display_config(self, feature: str, setting: dict, saveSettings: any):
         st.write("## OpenAI Configurations")
@@ -62,13 +69,15 @@ class OpenAiLLM:
                 The audio model to use for the AI.
                 """, on_change=on_model_changed)
 
+    @property
+    def voice_signature(self) -> dict:
+        """ The voice and model the speech is produced with """
+        return { 'voice': self.voice, 'model': self.voice_model }
+
     def getAIFunctions():
         return ['Entertainment', "Technical", "Entertainment"]
     
-    def conversation(self, conversation: List[dict], temperature: float = None):
-        if temperature is None:
-            temperature = self.default_temp
-
+    def _messages(self, conversation: List[dict]) -> List[dict]:
         # Convert conversation into messages for OpenAI
         messages = []
         for message in conversation:
@@ -81,11 +90,22 @@ class OpenAiLLM:
                     { "type": "text", "text": message['content'] } 
                 ] 
             })
+        return messages
+
+    def _promptMessages(self, prompt: str) -> List[dict]:
+        return [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def conversation(self, conversation: List[dict], temperature: float = None):
+        if temperature is None:
+            temperature = self.default_temp
         
         # Call OpenAI
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=self._messages(conversation),
             temperature=temperature,
             n=1,
             stop=None,
@@ -94,14 +114,63 @@ class OpenAiLLM:
         # Return the response
         return response.choices[0].message.content.strip()
 
+    def streamConversation(self, conversation: List[dict], temperature: float = None):
+        if temperature is None:
+            temperature = self.default_temp
+
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(conversation),
+            temperature=temperature,
+            n=1,
+            stop=None,
+            stream=True,
+        )
+        yield from self._deltas(stream)
+
+    def _deltas(self, stream):
+        for chunk in stream:
+            if len(chunk.choices) > 0 and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def aconversation(self, conversation: List[dict], temperature: float = None):
+        if temperature is None:
+            temperature = self.default_temp
+
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self._messages(conversation),
+            temperature=temperature,
+            n=1,
+            stop=None,
+        )
+        return response.choices[0].message.content.strip()
+
     def prompt(self, prompt: str) -> str:
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant."},
-            {"role": "user", "content": prompt}
-        ]
         response = self.client.chat.completions.create(
             model=self.model,
-            messages=messages,
+            messages=self._promptMessages(prompt),
+            n=1,
+            stop=None,
+            temperature=self.default_temp,
+        )
+        return response.choices[0].message.content.strip()
+
+    def streamPrompt(self, prompt: str):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=self._promptMessages(prompt),
+            n=1,
+            stop=None,
+            temperature=self.default_temp,
+            stream=True,
+        )
+        yield from self._deltas(stream)
+
+    async def aprompt(self, prompt: str) -> str:
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=self._promptMessages(prompt),
             n=1,
             stop=None,
             temperature=self.default_temp,
@@ -115,3 +184,20 @@ class OpenAiLLM:
             input=paragraph
         )
         return response.content
+
+    async def agetSpeech(self, paragraph: str) -> bytes:
+        response = await self.async_client.audio.speech.create(
+            model=self.voice_model,
+            voice=self.voice,
+            input=paragraph
+        )
+        return response.content
+
+    def streamSpeech(self, paragraph: str):
+        with self.client.audio.speech.with_streaming_response.create(
+            model=self.voice_model,
+            voice=self.voice,
+            input=paragraph
+        ) as response:
+            for chunk in response.iter_bytes(chunk_size=65536):
+                yield chunk
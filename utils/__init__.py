@@ -1,2 +1,2 @@
-from .storage import Storage
+from .storage import Storage, openStorage
 from .logging import getLogger
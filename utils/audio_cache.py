@@ -0,0 +1,196 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import logging as lg
+from .blob_store import BlobStore, getBlobStore
+
+logger = lg.getLogger(__name__)
+
+# Speech not played or exported for this long is evicted, such as the audio of a voice no longer used
+DEFAULT_MAX_AGE_DAYS = 180
+
+def normalizeSpeechText(text: str) -> str:
+    """ Normalizes text so that differences that do not change the speech share a cache entry
+
+    Args:
+        text (str): The text to be spoken
+
+    Returns:
+        str: The text in NFC form with runs of whitespace collapsed
+    """
+    return " ".join(unicodedata.normalize('NFC', text).split())
+
+def speechKey(text: str, provider: str, voice: str, model: str) -> str:
+    """ Gets the cache key of synthesized speech
+
+    Args:
+        text (str): The text to be spoken
+        provider (str): The name of the voice provider
+        voice (str): The id of the voice
+        model (str): The speech model of the provider
+
+    Returns:
+        str: The SHA-256 identifying the speech
+    """
+    identity = json.dumps({
+        'text': normalizeSpeechText(text),
+        'provider': provider,
+        'voice': voice,
+        'model': model
+    }, sort_keys=True)
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+class AudioCache:
+    """ Synthesized speech shared by every book in a library
+
+    Entries are keyed by the normalized text and the voice that spoke it,
+    so paragraphs keep their audio wherever they move and identical text is
+    only synthesized once. The audio itself lives in the blob store, each
+    entry holding one reference to its blob. Entries unused for longer than
+    the maximum age are evicted when the cache is opened.
+    """
+    def __init__(self, path: str, blobs: BlobStore, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.blobs = blobs
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS speech (
+                key TEXT PRIMARY KEY,
+                blob TEXT NOT NULL,
+                used REAL
+            )
+        """)
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(speech)").fetchall()]
+        if 'used' not in columns:
+            # Caches made before entries tracked their use start their age now
+            self._connection.execute("ALTER TABLE speech ADD COLUMN used REAL")
+            self._connection.execute("UPDATE speech SET used = ?", (time.time(),))
+        self._connection.commit()
+        self.evict()
+
+    def _lookup(self, key: str) -> str:
+        with self._lock:
+            row = self._connection.execute("SELECT blob FROM speech WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute("UPDATE speech SET used = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+        return row[0]
+
+    def get(self, key: str) -> bytes:
+        """ Loads cached speech
+
+        Args:
+            key (str): The key of the speech
+
+        Returns:
+            bytes: The audio, or None if the speech is not cached
+        """
+        digest = self._lookup(key)
+        if digest is None:
+            return None
+        return self.blobs.get(digest)
+
+    def path(self, key: str) -> str:
+        """ Gets the path of cached speech
+
+        Args:
+            key (str): The key of the speech
+
+        Returns:
+            str: The path of the audio file, or None if the speech is not cached
+        """
+        digest = self._lookup(key)
+        if digest is None or not self.blobs.exists(digest):
+            return None
+        return self.blobs.path(digest)
+
+    def put(self, key: str, audio: bytes):
+        """ Caches speech, replacing any audio already cached for the key
+
+        Args:
+            key (str): The key of the speech
+            audio (bytes): The audio
+        """
+        self._assign(key, self.blobs.store(audio))
+
+    def putStream(self, key: str, chunks: any) -> bool:
+        """ Caches speech produced in chunks, replacing any audio already cached for the key
+
+        Args:
+            key (str): The key of the speech
+            chunks (any): An iterable of the bytes of the audio
+
+        Returns:
+            bool: True if any audio was cached
+        """
+        digest = self.blobs.storeStream(chunks)
+        if digest is None:
+            return False
+
+        self._assign(key, digest)
+        return True
+
+    def _assign(self, key: str, digest: str):
+        with self._lock:
+            row = self._connection.execute("SELECT blob FROM speech WHERE key = ?", (key,)).fetchone()
+            self._connection.execute("INSERT OR REPLACE INTO speech (key, blob, used) VALUES (?, ?, ?)", (key, digest, time.time()))
+            self._connection.commit()
+
+        if row is not None:
+            self.blobs.release(row[0])
+
+    def remove(self, key: str):
+        """ Removes cached speech so it is synthesized again
+
+        Args:
+            key (str): The key of the speech
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT blob FROM speech WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            self._connection.execute("DELETE FROM speech WHERE key = ?", (key,))
+            self._connection.commit()
+
+        self.blobs.release(row[0])
+
+    def evict(self) -> int:
+        """ Removes the speech that has not been used within the maximum age, releasing its blobs
+
+        Returns:
+            int: The number of entries removed
+        """
+        cutoff = time.time() - self.max_age_days * 86400
+        with self._lock:
+            rows = self._connection.execute("SELECT key, blob FROM speech WHERE used < ?", (cutoff,)).fetchall()
+            self._connection.execute("DELETE FROM speech WHERE used < ?", (cutoff,))
+            self._connection.commit()
+
+        for _, digest in rows:
+            self.blobs.release(digest)
+        if len(rows) > 0:
+            logger.info(f"Evicted {len(rows)} unused speech entries")
+        return len(rows)
+
+_audio_caches = {}
+_audio_caches_lock = threading.Lock()
+
+def getAudioCache(libraryRoot: str) -> AudioCache:
+    """ Gets the speech cache shared by every book in a library
+
+    Args:
+        libraryRoot (str): The root directory of the library
+
+    Returns:
+        AudioCache: The library's speech cache
+    """
+    with _audio_caches_lock:
+        if libraryRoot not in _audio_caches:
+            blobs = getBlobStore(libraryRoot)
+            _audio_caches[libraryRoot] = AudioCache(f"{blobs.root}/speech.db", blobs)
+        return _audio_caches[libraryRoot]
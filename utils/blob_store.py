@@ -0,0 +1,209 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import logging as lg
+
+logger = lg.getLogger(__name__)
+
+class BlobStore:
+    """ Content addressed storage for binary artifacts such as audio and images
+
+    Blobs are stored once per distinct content, named by their SHA-256, and
+    reference counted in a small SQLite index. Metadata records elsewhere in
+    storage hold the hash, and a blob is deleted once nothing references it.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(f"{self.root}/index.db", check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                refs INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self._connection.commit()
+
+    def path(self, digest: str) -> str:
+        """ Gets the path of a blob
+
+        Args:
+            digest (str): The SHA-256 of the blob
+
+        Returns:
+            str: The path the blob is stored at
+        """
+        return f"{self.root}/{digest[:2]}/{digest}"
+
+    def exists(self, digest: str) -> bool:
+        """ Checks to see if a blob is stored """
+        return os.path.exists(self.path(digest))
+
+    def store(self, content: bytes) -> str:
+        """ Stores content and adds a reference to it
+
+        Identical content is only written once, later stores only add a reference.
+
+        Args:
+            content (bytes): The content to store
+
+        Returns:
+            str: The SHA-256 of the content, used to reference the blob
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest)
+
+        with self._lock:
+            if not os.path.exists(path):
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(content)
+                    f.close()
+                os.replace(temp_path, path)
+
+            self._connection.execute(
+                "INSERT INTO blobs (hash, refs, size) VALUES (?, 1, ?) ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+                (digest, len(content))
+            )
+            self._connection.commit()
+
+        return digest
+
+    def storeStream(self, chunks: any) -> str:
+        """ Stores content produced in chunks and adds a reference to it
+
+        The chunks are written to disk as they arrive, so only one chunk is
+        held in memory at a time.
+
+        Args:
+            chunks (any): An iterable of the bytes of the content
+
+        Returns:
+            str: The SHA-256 of the content, or None if there was no content
+        """
+        temp_path = f"{self.root}/{os.getpid()}.{threading.get_ident()}.tmp"
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in chunks:
+                    sha.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.close()
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        if size == 0:
+            os.remove(temp_path)
+            return None
+
+        digest = sha.hexdigest()
+        path = self.path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.replace(temp_path, path)
+
+            self._connection.execute(
+                "INSERT INTO blobs (hash, refs, size) VALUES (?, 1, ?) ON CONFLICT(hash) DO UPDATE SET refs = refs + 1",
+                (digest, size)
+            )
+            self._connection.commit()
+
+        return digest
+
+    def addRef(self, digest: str):
+        """ Adds a reference to a stored blob
+
+        Args:
+            digest (str): The SHA-256 of the blob
+        """
+        with self._lock:
+            self._connection.execute("UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (digest,))
+            self._connection.commit()
+
+    def get(self, digest: str) -> bytes:
+        """ Loads a blob
+
+        Args:
+            digest (str): The SHA-256 of the blob
+
+        Returns:
+            bytes: The content of the blob, or None if it is not stored
+        """
+        path = self.path(digest)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "rb") as f:
+            content = f.read()
+            f.close()
+            return content
+
+    def release(self, digest: str):
+        """ Removes a reference to a blob, deleting the blob once it is unreferenced
+
+        Args:
+            digest (str): The SHA-256 of the blob
+        """
+        with self._lock:
+            self._connection.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ? AND refs > 0", (digest,))
+            self._connection.commit()
+            self._collect([digest])
+
+    def collectGarbage(self) -> int:
+        """ Deletes every blob that is no longer referenced
+
+        Returns:
+            int: The number of blobs deleted
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT hash FROM blobs WHERE refs <= 0").fetchall()
+            return self._collect([digest for (digest,) in rows])
+
+    def _collect(self, digests: [str]) -> int:
+        collected = 0
+        for digest in digests:
+            row = self._connection.execute("SELECT refs FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row is None or row[0] > 0:
+                continue
+
+            path = self.path(digest)
+            if os.path.exists(path):
+                os.remove(path)
+            self._connection.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+            collected += 1
+
+        self._connection.commit()
+        if collected > 0:
+            logger.info(f"Collected {collected} unreferenced blobs")
+        return collected
+
+_blob_stores = {}
+_blob_stores_lock = threading.Lock()
+
+def getBlobStore(libraryRoot: str) -> BlobStore:
+    """ Gets the blob store shared by every book in a library
+
+    Args:
+        libraryRoot (str): The root directory of the library
+
+    Returns:
+        BlobStore: The library's blob store
+    """
+    with _blob_stores_lock:
+        if libraryRoot not in _blob_stores:
+            _blob_stores[libraryRoot] = BlobStore(f"{libraryRoot}/.blobs")
+        return _blob_stores[libraryRoot]
@@ -0,0 +1,95 @@
+import os
+import threading
+from collections import OrderedDict
+
+class FileCache:
+    """ A bounded LRU cache of text file contents
+
+    Entries are validated against the file's stat mtime and size on every
+    lookup, so edits made outside of the tool are picked up on the next read.
+    """
+    def __init__(self, max_entries: int = 4096, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, stat: os.stat_result) -> str:
+        """ Gets the cached content of a file if it is still current
+
+        Args:
+            path (str): The path of the file
+            stat (os.stat_result): The current stat of the file
+
+        Returns:
+            str: The cached content, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(path, None)
+            if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, path: str, stat: os.stat_result, content: str):
+        """ Stores the content of a file in the cache
+
+        Args:
+            path (str): The path of the file
+            stat (os.stat_result): The stat of the file the content was read from or written to
+            content (str): The content of the file
+        """
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = (stat.st_mtime_ns, stat.st_size, content)
+            self._bytes += len(content)
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def invalidate(self, path: str):
+        """ Removes a file from the cache
+
+        Args:
+            path (str): The path of the file
+        """
+        with self._lock:
+            self._remove(path)
+
+    def invalidatePrefix(self, path: str):
+        """ Removes every file under a directory from the cache
+
+        Args:
+            path (str): The path of the directory
+        """
+        prefix = path.rstrip("/") + "/"
+        with self._lock:
+            for cached in [p for p in self._entries if p.startswith(prefix)]:
+                self._remove(cached)
+
+    def stats(self) -> dict:
+        """ Returns the hit and miss counters of the cache """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= len(entry[2])
+
+# Cache shared by every Storage in the process
+fileCache = FileCache()
@@ -0,0 +1,80 @@
+def _syncsafe(value: int) -> bytes:
+    """ Encodes an integer as the 4 byte syncsafe integer ID3v2.4 uses for sizes """
+    return bytes([(value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F])
+
+def tagLength(header: bytes) -> int:
+    """ Gets the length of an ID3v2 tag from the start of a file
+
+    Args:
+        header (bytes): At least the first 10 bytes of the file
+
+    Returns:
+        int: The length of the tag including its header and footer, 0 if the file has no tag
+    """
+    if len(header) < 10 or header[:3] != b'ID3':
+        return 0
+
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+def frame(id: str, body: bytes) -> bytes:
+    """ Encodes an ID3v2.4 frame
+
+    Args:
+        id (str): The four character frame id
+        body (bytes): The content of the frame
+
+    Returns:
+        bytes: The encoded frame
+    """
+    return id.encode('latin-1') + _syncsafe(len(body)) + b'\x00\x00' + body
+
+def textFrame(id: str, text: str) -> bytes:
+    """ Encodes a UTF-8 text frame such as TIT2 (title), TALB (album) or TRCK (track) """
+    return frame(id, b'\x03' + text.encode('utf-8'))
+
+def chapterFrame(element_id: str, start_ms: int, end_ms: int, title: str) -> bytes:
+    """ Encodes a CHAP frame marking a chapter of the audio
+
+    Args:
+        element_id (str): The id of the chapter within the tag
+        start_ms (int): The start of the chapter in milliseconds
+        end_ms (int): The end of the chapter in milliseconds
+        title (str): The title of the chapter
+
+    Returns:
+        bytes: The encoded frame
+    """
+    body = element_id.encode('latin-1') + b'\x00'
+    body += int(start_ms).to_bytes(4, 'big') + int(end_ms).to_bytes(4, 'big')
+    # Byte offsets are not given, players use the times
+    body += b'\xff\xff\xff\xff' + b'\xff\xff\xff\xff'
+    body += textFrame('TIT2', title)
+    return frame('CHAP', body)
+
+def tableOfContents(element_ids: [str]) -> bytes:
+    """ Encodes the top level, ordered CTOC frame listing the chapters
+
+    Args:
+        element_ids ([str]): The ids of the chapters in order, at most 255
+
+    Returns:
+        bytes: The encoded frame
+    """
+    body = b'toc\x00' + b'\x03' + bytes([len(element_ids)])
+    for element_id in element_ids:
+        body += element_id.encode('latin-1') + b'\x00'
+    return frame('CTOC', body)
+
+def tag(frames: [bytes]) -> bytes:
+    """ Encodes an ID3v2.4 tag to place at the start of an MP3 file
+
+    Args:
+        frames ([bytes]): The encoded frames of the tag
+
+    Returns:
+        bytes: The encoded tag
+    """
+    body = b''.join(frames)
+    return b'ID3\x04\x00\x00' + _syncsafe(len(body)) + body
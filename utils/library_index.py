@@ -0,0 +1,128 @@
+import os
+import json
+import copy
+import time
+import threading
+from .write_behind import writeBehind
+
+class LibraryIndex:
+    """ Persisted metadata about every book in the library
+
+    Keeps the chapter count, word count and last modified time of each book
+    in a single file so the library can be listed without opening any book.
+    Entries are updated as indexed books are written, books that are not
+    indexed yet are left to be indexed when the library is next listed, and
+    the file itself is saved through the write-behind queue.
+    """
+    def __init__(self, libraryRoot: str = ".data"):
+        self.path = f"{libraryRoot}/library.json"
+        self._books = None
+        self._lock = threading.RLock()
+
+    def _load(self) -> dict:
+        if self._books is not None:
+            return self._books
+
+        self._books = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self._books = json.loads(f.read()).get('books', {})
+                f.close()
+        return self._books
+
+    def _save(self, books: dict):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(json.dumps({ 'version': 1, 'books': books }, indent=4))
+            f.close()
+        os.replace(temp_path, self.path)
+
+    def _changed(self, title: str, modified: float = None):
+        books = self._load()
+        books[title]['modified'] = modified if modified is not None else time.time()
+        writeBehind.schedule(self.path, self._save, copy.deepcopy(books))
+
+    def getBook(self, title: str) -> dict:
+        """ Gets the metadata of a book
+
+        Args:
+            title (str): The title of the book
+
+        Returns:
+            dict: The 'chapters', 'words' and 'modified' time of the book, or None if it is not indexed
+        """
+        with self._lock:
+            entry = self._load().get(title, None)
+            if entry is None:
+                return None
+
+            return {
+                'title': title,
+                'chapters': len(entry['chapter_words']),
+                'words': sum(entry['chapter_words'].values()),
+                'modified': entry['modified']
+            }
+
+    def listBooks(self) -> [str]:
+        """ Lists the titles of the indexed books """
+        with self._lock:
+            return list(self._load().keys())
+
+    def hasBook(self, title: str) -> bool:
+        """ Checks to see if the book is in the index """
+        with self._lock:
+            return title in self._load()
+
+    def setBook(self, title: str, chapter_words: dict, modified: float):
+        """ Replaces the metadata of a book
+
+        Args:
+            title (str): The title of the book
+            chapter_words (dict): The number of words in each chapter, keyed by chapter id
+            modified (float): The time the book was last modified
+        """
+        with self._lock:
+            self._load()[title] = { 'chapter_words': dict(chapter_words), 'modified': modified }
+            self._changed(title, modified)
+
+    def removeBook(self, title: str):
+        """ Removes a book from the index """
+        with self._lock:
+            books = self._load()
+            if title in books:
+                del books[title]
+                writeBehind.schedule(self.path, self._save, copy.deepcopy(books))
+
+    def updateChapterContent(self, title: str, chapter: str, content: str):
+        """ Records the word count of a chapter after its content is written
+
+        Args:
+            title (str): The title of the book
+            chapter (str): The id of the chapter
+            content (str): The content of the chapter
+        """
+        with self._lock:
+            entry = self._load().get(title, None)
+            if entry is None:
+                return
+
+            entry['chapter_words'][str(chapter)] = len(content.split())
+            self._changed(title)
+
+    def updateChapterOrder(self, title: str, chapters: [str]):
+        """ Records the chapters of a book after the chapter order is written
+
+        Args:
+            title (str): The title of the book
+            chapters ([str]): The ids of the chapters in the book
+        """
+        with self._lock:
+            entry = self._load().get(title, None)
+            if entry is None:
+                return
+
+            entry['chapter_words'] = { chapter: entry['chapter_words'].get(chapter, 0) for chapter in chapters }
+            self._changed(title)
+
+# Index shared by every Storage in the process
+libraryIndex = LibraryIndex()
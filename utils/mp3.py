@@ -0,0 +1,143 @@
+import logging as lg
+from .id3 import tagLength
+
+logger = lg.getLogger(__name__)
+
+# Layer III bitrates in kbps by bitrate index, for MPEG 1 and for MPEG 2 / 2.5
+BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+
+# Sample rates by version bits and sample rate index
+SAMPLE_RATES = {
+    0b11: [44100, 48000, 32000],
+    0b10: [22050, 24000, 16000],
+    0b00: [11025, 12000, 8000]
+}
+
+def _frameHeader(audio: bytes, offset: int) -> tuple:
+    """ Parses the Layer III frame header at an offset
+
+    Returns:
+        tuple: The length of the frame in bytes and its duration in seconds, or None if there is no frame
+    """
+    if offset + 4 > len(audio):
+        return None
+
+    header = int.from_bytes(audio[offset:offset + 4], 'big')
+    if (header >> 21) & 0x7FF != 0x7FF:
+        return None
+
+    version = (header >> 19) & 0b11
+    layer = (header >> 17) & 0b11
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 0b11
+    padding = (header >> 9) & 0b1
+    if version == 0b01 or layer != 0b01 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[1 if version == 0b11 else 2][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    samples = 1152 if version == 0b11 else 576
+
+    length = (samples // 8) * bitrate // sample_rate + padding
+    return (length, samples / sample_rate)
+
+def frames(audio: bytes) -> [tuple]:
+    """ Lists the frames of MP3 audio
+
+    Args:
+        audio (bytes): The MP3 audio
+
+    Returns:
+        [tuple]: The offset, length and start time in seconds of each frame
+    """
+    offset = tagLength(audio[:10])
+    time = 0.0
+    found = []
+    while offset < len(audio):
+        header = _frameHeader(audio, offset)
+        if header is None:
+            # Skip over anything between frames until the next frame sync
+            offset += 1
+            continue
+
+        length, duration = header
+        found.append((offset, length, time))
+        offset += length
+        time += duration
+
+    return found
+
+def split(audio: bytes, times: [float]) -> [bytes]:
+    """ Splits MP3 audio at frame boundaries
+
+    Each cut is made at the frame boundary closest to the requested time,
+    so every part is valid MP3 on its own.
+
+    Args:
+        audio (bytes): The MP3 audio
+        times ([float]): The times in seconds to cut at, in ascending order
+
+    Returns:
+        [bytes]: The parts of the audio, one more than the number of cuts, or None if the audio has no frames
+    """
+    found = frames(audio)
+    if len(found) == 0:
+        logger.warning("No MP3 frames found to split")
+        return None
+
+    parts = []
+    start = found[0][0]
+    position = 0
+    for time in times:
+        while position < len(found) - 1 and found[position + 1][2] <= time:
+            position += 1
+
+        # Round to whichever boundary is nearer
+        cut = position
+        if cut < len(found) - 1 and (found[cut + 1][2] - time) < (time - found[cut][2]):
+            cut += 1
+
+        end = found[cut][0]
+        if end < start:
+            end = start
+        parts.append(audio[start:end])
+        start = end
+
+    last = found[-1]
+    parts.append(audio[start:last[0] + last[1]])
+    return parts
+
+def fileDuration(path: str) -> float:
+    """ Gets the duration of an MP3 file by walking its frame headers
+
+    Only the headers are read, so the file is never loaded into memory.
+
+    Args:
+        path (str): The path of the MP3 file
+
+    Returns:
+        float: The duration in seconds
+    """
+    duration = 0.0
+    with open(path, "rb") as f:
+        offset = tagLength(f.read(10))
+        while True:
+            f.seek(offset)
+            header = f.read(4)
+            if len(header) < 4:
+                break
+
+            parsed = _frameHeader(header, 0)
+            if parsed is None:
+                offset += 1
+                continue
+
+            length, frame_duration = parsed
+            duration += frame_duration
+            offset += length
+        f.close()
+
+    return duration
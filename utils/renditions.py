@@ -0,0 +1,138 @@
+import os
+import hashlib
+import threading
+from io import BytesIO
+from PIL import Image
+
+MIME_TYPES = {
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'JPEG': 'image/jpeg'
+}
+
+EXTENSIONS = {
+    'PNG': 'png',
+    'WEBP': 'webp',
+    'JPEG': 'jpg'
+}
+
+class RenditionCache:
+    """ Stores resized and re-encoded variants of source images
+
+    Renditions are generated once and kept on disk, named by the SHA-256 of
+    the source image plus the size and format, so a new source image never
+    collides with the renditions of the old one.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def sourceHash(self, source_path: str) -> str:
+        """ Gets the SHA-256 of a source image, remembered until the file changes
+
+        Args:
+            source_path (str): The path of the source image
+
+        Returns:
+            str: The hex digest of the source image, or None if it does not exist
+        """
+        try:
+            stat = os.stat(source_path)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            known = self._hashes.get(source_path, None)
+            if known is not None and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+                return known[2]
+
+        with open(source_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+            f.close()
+
+        with self._lock:
+            self._hashes[source_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def get(self, source_path: str, size: tuple = (500, 500), format: str = 'PNG') -> bytes:
+        """ Gets a rendition of a source image, generating it if needed
+
+        Args:
+            source_path (str): The path of the source image
+            size (tuple): The width and height of the rendition
+            format (str): The image format of the rendition, PNG, WEBP or JPEG
+
+        Returns:
+            bytes: The encoded rendition, or None if the source image does not exist
+        """
+        digest = self.sourceHash(source_path)
+        if digest is None:
+            return None
+
+        path = self._renditionPath(digest, size, format)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                content = f.read()
+                f.close()
+                return content
+
+        with open(source_path, "rb") as f:
+            source = f.read()
+            f.close()
+
+        content = render(source, size, format)
+
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(content)
+            f.close()
+        os.replace(temp_path, path)
+        return content
+
+    def invalidate(self, source_path: str):
+        """ Removes every rendition of the current source image
+
+        Args:
+            source_path (str): The path of the source image
+        """
+        digest = self.sourceHash(source_path)
+        with self._lock:
+            self._hashes.pop(source_path, None)
+
+        if digest is None or not os.path.exists(self.root):
+            return
+
+        for rendition in os.listdir(self.root):
+            if rendition.startswith(digest + "_"):
+                os.remove(f"{self.root}/{rendition}")
+
+    def _renditionPath(self, digest: str, size: tuple, format: str) -> str:
+        return f"{self.root}/{digest}_{size[0]}x{size[1]}.{EXTENSIONS[format]}"
+
+def render(source: bytes, size: tuple, format: str) -> bytes:
+    """ Resizes and encodes an image
+
+    Args:
+        source (bytes): The encoded source image
+        size (tuple): The width and height to resize to
+        format (str): The image format to encode as, PNG, WEBP or JPEG
+
+    Returns:
+        bytes: The encoded image
+    """
+    image = Image.open(BytesIO(source))
+    resized_image = image.resize(size)
+
+    # JPEG has no alpha channel
+    if format == 'JPEG' and resized_image.mode not in ('RGB', 'L'):
+        resized_image = resized_image.convert('RGB')
+
+    output_buffer = BytesIO()
+    if format == 'PNG':
+        resized_image.save(output_buffer, format=format)
+    else:
+        resized_image.save(output_buffer, format=format, quality=85)
+    return output_buffer.getvalue()
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+import logging as lg
+from .storage import Storage
+from .write_behind import writeBehind
+
+logger = lg.getLogger(__name__)
+
+DATABASE_NAME = "book.db"
+
+class SqliteStorage(Storage):
+    """ Storage that keeps every text artifact of a book in a single SQLite database
+
+    Text artifacts are stored as rows keyed by their path relative to the book
+    root, so the layout and method surface match the file based Storage. Binary
+    artifacts such as thumbnails and audio stay on disk.
+    """
+    def __init__(self, title: str):
+        super().__init__(title)
+
+        self.databasePath = f"{self.root}/{DATABASE_NAME}"
+        is_new = not os.path.exists(self.databasePath)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.databasePath, check_same_thread=False)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT PRIMARY KEY,
+                chapter TEXT,
+                content TEXT NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS documents_chapter ON documents(chapter)")
+        self._connection.commit()
+
+        if is_new:
+            migrateToSqlite(self)
+
+    def _relativePath(self, path: str) -> str:
+        """ Gets the path of an artifact relative to the book root
+
+        Args:
+            path (str): The path of the artifact
+
+        Returns:
+            str: The relative path, or None if the artifact is not part of the book
+        """
+        prefix = self.root + "/"
+        if not path.startswith(prefix):
+            return None
+        return path[len(prefix):].strip("/")
+
+    def _chapterOf(self, relative_path: str) -> str:
+        """ Gets the chapter an artifact belongs to from its relative path """
+        parts = relative_path.split("/")
+        if len(parts) > 2 and parts[0] == "chapters":
+            return parts[1]
+        return None
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+            self._connection.commit()
+            return rows
+
+    def _fileExists(self, path: str) -> bool:
+        relative_path = self._relativePath(path)
+        if relative_path is None:
+            return super()._fileExists(path)
+
+        rows = self._execute("SELECT 1 FROM documents WHERE path = ?", (relative_path,))
+        return len(rows) > 0
+
+    def _readText(self, path: str) -> str:
+        relative_path = self._relativePath(path)
+        if relative_path is None:
+            return super()._readText(path)
+
+        rows = self._execute("SELECT content FROM documents WHERE path = ?", (relative_path,))
+        if len(rows) == 0:
+            return None
+        return rows[0][0]
+
+    def _writeText(self, path: str, content: str):
+        relative_path = self._relativePath(path)
+        if relative_path is None:
+            return super()._writeText(path, content)
+
+        self._execute(
+            "INSERT OR REPLACE INTO documents (path, chapter, content) VALUES (?, ?, ?)",
+            (relative_path, self._chapterOf(relative_path), content)
+        )
+
+    def _removeText(self, path: str):
+        relative_path = self._relativePath(path)
+        if relative_path is None:
+            return super()._removeText(path)
+
+        self._execute("DELETE FROM documents WHERE path = ?", (relative_path,))
+
+    def _removeTree(self, path: str):
+        relative_path = self._relativePath(path)
+        if relative_path is not None:
+            prefix = relative_path + "/"
+            self._execute("DELETE FROM documents WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+
+        # Binary artifacts are still stored in the directory
+        super()._removeTree(path)
+
+    def _listDir(self, path: str) -> [str]:
+        entries = set(super()._listDir(path))
+
+        relative_path = self._relativePath(path)
+        if relative_path is not None:
+            prefix = relative_path + "/"
+            rows = self._execute("SELECT path FROM documents WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            for (child,) in rows:
+                entries.add(child[len(prefix):].split("/")[0])
+
+        return list(entries)
+
+    def chapterExists(self, chapter: str) -> bool:
+        rows = self._execute("SELECT 1 FROM documents WHERE chapter = ? LIMIT 1", (str(chapter),))
+        return len(rows) > 0 or super().chapterExists(chapter)
+
+    def loadChapter(self, chapter: str) -> dict:
+        """ Loads the name, summary, characters and content of a chapter with a single query
+
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            dict: The chapter fields keyed by 'name', 'summary', 'characters' and 'content'
+        """
+        prefix = f"chapters/{chapter}/"
+        rows = self._execute(
+            "SELECT path, content FROM documents WHERE chapter = ? AND path IN (?, ?, ?, ?)",
+            (str(chapter), prefix + "name.md", prefix + "summary.md", prefix + "characters.md", prefix + "content.md")
+        )
+        documents = { path[len(prefix):]: content for (path, content) in rows }
+
+        # Content queued by the autosave is newer than the stored row
+        content = writeBehind.pending(f"{self.root}/{prefix}content.md")
+        if content is None:
+            content = documents.get("content.md", None)
+
+        characters = documents.get("characters.md", None)
+        return {
+            'name': documents.get("name.md", None),
+            'summary': documents.get("summary.md", None),
+            'characters': characters.split("\n") if characters is not None else None,
+            'content': content
+        }
+
+def migrateToSqlite(storage: SqliteStorage):
+    """ Moves the text artifacts of a book stored as files into the book's database
+
+    Migrated files are removed once they are in the database so that the two
+    copies can not drift apart. Binary artifacts are left in place.
+
+    Args:
+        storage (SqliteStorage): The storage of the book to migrate
+    """
+    migrated = []
+    for directory, _, files in os.walk(storage.root):
+        for file in files:
+            if not file.endswith((".md", ".json")):
+                continue
+
+            path = os.path.join(directory, file).replace(os.sep, "/")
+            with open(path, "r") as f:
+                content = f.read()
+                f.close()
+
+            relative_path = storage._relativePath(path)
+            migrated.append((relative_path, storage._chapterOf(relative_path), content, path))
+
+    if len(migrated) == 0:
+        return
+
+    logger.info(f"Migrating {len(migrated)} files of {storage.title} to {storage.databasePath}")
+    with storage._lock:
+        storage._connection.executemany(
+            "INSERT OR REPLACE INTO documents (path, chapter, content) VALUES (?, ?, ?)",
+            [(relative_path, chapter, content) for (relative_path, chapter, content, _) in migrated]
+        )
+        storage._connection.commit()
+
+    for (_, _, _, path) in migrated:
+        os.remove(path)
@@ -1,9 +1,15 @@
 import os
-from PIL import Image
-from io import BytesIO
 import shutil
+import threading
+import uuid
 import json
 import logging as lg
+from .file_cache import fileCache
+from .write_behind import writeBehind
+from .library_index import libraryIndex
+from .renditions import RenditionCache, MIME_TYPES
+from .blob_store import BlobStore, getBlobStore
+from .audio_cache import AudioCache, getAudioCache
 
 logger = lg.getLogger(__name__)
 
@@ -18,6 +24,8 @@ class Storage:
         # Create directory to store temporary files
         self.root = None
         self.libraryRoot = ".data"
+        self.thumbnailFormat = 'PNG'
+        self.renditions = None
         createDirIfNeeded(self.libraryRoot)
 
         if title is not None:
@@ -26,211 +34,498 @@ class Storage:
             createDirIfNeeded(self.root + "/chapters")
             createDirIfNeeded(self.root + "/summaries")
             createDirIfNeeded(self.root + "/characters")
+            self.renditions = RenditionCache(self.root + "/renditions")
+
+    def _fileExists(self, path: str) -> bool:
+        """ Checks to see if a stored artifact exists
+
+        Args:
+            path (str): The path of the artifact
+
+        Returns:
+            bool: True if the artifact exists
+        """
+        return os.path.exists(path)
+
+    def _readText(self, path: str) -> str:
+        """ Reads a text artifact
+
+        Args:
+            path (str): The path of the artifact
+
+        Returns:
+            str: The content of the artifact, or None if it does not exist
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            fileCache.invalidate(path)
+            return None
+
+        content = fileCache.get(path, stat)
+        if content is not None:
+            return content
+
+        with open(path, "r") as f:
+            content = f.read()
+            f.close()
+
+        fileCache.put(path, stat, content)
+        return content
+
+    def _writeText(self, path: str, content: str):
+        """ Writes a text artifact, creating the parent directory if needed
+
+        The content is written to a temporary file that then replaces the
+        artifact, so a crash mid-write never leaves a torn file behind.
+
+        Args:
+            path (str): The path of the artifact
+            content (str): The content to write
+        """
+        createDirIfNeeded(os.path.dirname(path))
+
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(content)
+            f.close()
+        os.replace(temp_path, path)
+
+        # Write through so the next read is served from the cache
+        fileCache.put(path, os.stat(path), content)
+
+    def _removeText(self, path: str):
+        """ Removes a text artifact if it exists
+
+        Args:
+            path (str): The path of the artifact
+        """
+        fileCache.invalidate(path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _removeTree(self, path: str):
+        """ Removes a directory of artifacts and all of its contents
+
+        Args:
+            path (str): The path of the directory
+        """
+        fileCache.invalidatePrefix(path)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+    def _listDir(self, path: str) -> [str]:
+        """ Lists the entries stored under a directory
+
+        Args:
+            path (str): The path of the directory
+
+        Returns:
+            [str]: The names of the entries in the directory
+        """
+        if not os.path.exists(path):
+            return []
+        return os.listdir(path)
+
+    @property
+    def blobs(self) -> BlobStore:
+        """ The content addressed store that holds the binary artifacts of the library """
+        return getBlobStore(self.libraryRoot)
+
+    def _loadBlobRecord(self, path: str) -> str:
+        """ Loads the blob hash a metadata record points to
+
+        Args:
+            path (str): The path of the record
+
+        Returns:
+            str: The SHA-256 of the blob, or None if there is no record
+        """
+        record = self._readText(path)
+        if record is None:
+            return None
+        return json.loads(record)['blob']
+
+    def _saveBlobRecord(self, path: str, content: bytes):
+        """ Stores binary content in the blob store and points a metadata record at it
+
+        Args:
+            path (str): The path of the record
+            content (bytes): The binary content
+        """
+        previous = self._loadBlobRecord(path)
+        digest = self.blobs.store(content)
+        self._writeText(path, json.dumps({ 'blob': digest, 'size': len(content) }))
+
+        if previous is not None:
+            self.blobs.release(previous)
+
+    def _removeBlobRecord(self, path: str):
+        """ Removes a metadata record and releases the blob it points to
+
+        Args:
+            path (str): The path of the record
+        """
+        previous = self._loadBlobRecord(path)
+        self._removeText(path)
+
+        if previous is not None:
+            self.blobs.release(previous)
+
+    def _releaseBlobRecords(self, path: str):
+        """ Releases the blobs of every metadata record in a directory
+
+        Args:
+            path (str): The path of the directory
+        """
+        for record in self._listDir(path):
+            if record.endswith(".json"):
+                self._removeBlobRecord(f"{path}/{record}")
+
+    def cacheStats(self) -> dict:
+        """ Returns the hit and miss counters of the read cache shared by all storage
+
+        Returns:
+            dict: The 'hits', 'misses', 'hit_rate', 'entries' and 'bytes' of the cache
+        """
+        return fileCache.stats()
 
     def exists(self):
         """ Checks to see if the book exists"""
         return os.path.exists(f"{self.root}")
 
-    def chapterExists(self, chapter: int) -> bool:
+    def chapterExists(self, chapter: str) -> bool:
         """ Checks to see if the chapter exists
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
 
         Returns:
             bool: True if the chapter exists
         """
         return os.path.exists(f"{self.root}/chapters/{chapter}")
 
-    def saveChapterName(self, chapter: int, name: str):
+    def loadChapterOrder(self) -> [dict]:
+        """ Loads the chapters in the order they appear in the book
+
+        Books created before chapter ids existed have no manifest. Their
+        numbered chapter directories are adopted as ids, in numeric order,
+        so they stay readable without moving any files.
+
+        Returns:
+            [dict]: The chapters in reading order, each with an 'id' and,
+                once it is known, the chapter's 'name'
+        """
+        content = self._readText(f"{self.root}/chapters/manifest.json")
+        if content is not None:
+            manifest = json.loads(content)
+            return manifest['chapters']
+
+        legacy = [d for d in self._listDir(f"{self.root}/chapters") if d.isdigit()]
+        legacy.sort(key=lambda d: int(d))
+        return [{ 'id': chapter } for chapter in legacy]
+
+    def saveChapterOrder(self, chapters: [dict]):
+        """ Saves the order of the chapters in the book
+
+        Args:
+            chapters ([dict]): The chapters in reading order, each with an 'id' and a 'name'
+        """
+        manifest = {
+            'version': 1,
+            'chapters': chapters
+        }
+        self._writeText(f"{self.root}/chapters/manifest.json", json.dumps(manifest, indent=4))
+        libraryIndex.updateChapterOrder(self.title, [chapter['id'] for chapter in chapters])
+
+    def createChapterId(self) -> str:
+        """ Creates a new id for a chapter
+
+        Returns:
+            str: An id that is never reused for another chapter
+        """
+        return uuid.uuid4().hex
+
+    def loadChapter(self, chapter: str) -> dict:
+        """ Loads the name, summary, characters and content of a chapter in one call
+
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            dict: The chapter fields keyed by 'name', 'summary', 'characters' and 'content'
+        """
+        return {
+            'name': self.loadChapterName(chapter),
+            'summary': self.loadChapterSummary(chapter),
+            'characters': self.loadChapterCharacters(chapter),
+            'content': self.loadChapterContent(chapter)
+        }
+
+    def saveChapterName(self, chapter: str, name: str):
         """ Saves the name of the chapter
 
         Args:
-            chapter (str): The chapter number
+            chapter (str): The id of the chapter
             name (str): The name of the chapter
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}"):
-            os.makedirs(f"{self.root}/chapters/{chapter}")
+        self._writeText(f"{self.root}/chapters/{chapter}/name.md", name)
 
-        with open(f"{self.root}/chapters/{chapter}/name.md", "w") as f:
-            f.write(name)
-            f.close()
-
-    def loadChapterName(self, chapter: int) -> str:
+    def loadChapterName(self, chapter: str) -> str:
         """ Load a chapter's name
 
         Args:
-            chapter (int): The number of the chapter
+            chapter (str): The id of the chapter
 
         Returns:
-            str: The name of the chapter
+            str: The name of the chapter, or None if it has not been named
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}/name.md"):
-            return f"Chapter {chapter}"
+        return self._readText(f"{self.root}/chapters/{chapter}/name.md")
 
-        with open(f"{self.root}/chapters/{chapter}/name.md", "r") as f:
-            name = f.read()
-            f.close()
-            return name
-
-    def saveChapterContent(self, chapter: int, content: str):
+    def saveChapterContent(self, chapter: str, content: str):
         """ Saves the contents of a chapter for the book
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             content (str): The content of the chapter
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}"):
-            os.makedirs(f"{self.root}/chapters/{chapter}")
-        with open(f"{self.root}/chapters/{chapter}/content.md", "w") as f:
-            f.write(content)
-            f.close()
+        path = f"{self.root}/chapters/{chapter}/content.md"
+        writeBehind.writeNow(path, lambda value: self._writeChapterContent(chapter, value), content)
+
+    def queueChapterContent(self, chapter: str, content: str):
+        """ Schedules the contents of a chapter to be saved in the background
+
+        Repeated saves of the same chapter within the autosave delay are
+        coalesced into a single write of the latest content.
+
+        Args:
+            chapter (str): The id of the chapter
+            content (str): The content of the chapter
+        """
+        path = f"{self.root}/chapters/{chapter}/content.md"
+        writeBehind.schedule(path, lambda value: self._writeChapterContent(chapter, value), content)
+
+    def _writeChapterContent(self, chapter: str, content: str):
+        self._writeText(f"{self.root}/chapters/{chapter}/content.md", content)
+        libraryIndex.updateChapterContent(self.title, chapter, content)
+
+    def loadParagraphIndex(self, chapter: str) -> [dict]:
+        """ Loads the ids and content hashes of a chapter's paragraphs
+
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            [dict]: The paragraphs in order, each with an 'id' and 'hash', or None if the chapter has not been indexed
+        """
+        path = f"{self.root}/chapters/{chapter}/paragraphs.json"
+        pending = writeBehind.pending(path)
+        if pending is not None:
+            return pending
+
+        content = self._readText(path)
+        if content is None:
+            return None
+        return json.loads(content)
+
+    def queueParagraphIndex(self, chapter: str, paragraphs: [dict]):
+        """ Schedules the ids and content hashes of a chapter's paragraphs to be saved in the background
+
+        Args:
+            chapter (str): The id of the chapter
+            paragraphs ([dict]): The paragraphs in order, each with an 'id' and 'hash'
+        """
+        path = f"{self.root}/chapters/{chapter}/paragraphs.json"
+        writeBehind.schedule(path, lambda value: self._writeText(path, json.dumps(value)), paragraphs)
+
+    def flush(self) -> [str]:
+        """ Writes every queued save to storage, blocking until they are persisted
 
-    def loadChapterContent(self, chapter: int) -> str:
+        Returns:
+            [str]: The paths that failed to write, which stay queued to be tried again
+        """
+        return writeBehind.flush()
+
+    def unsavedChanges(self) -> dict:
+        """ Gets the queued saves of this book that failed to write and are waiting to be tried again
+
+        Returns:
+            dict: The error of the last attempt keyed by path
+        """
+        return { path: error for path, error in writeBehind.failures().items() if path.startswith(f"{self.root}/") }
+
+    def loadChapterContent(self, chapter: str) -> str:
         """Loads the chapter contents
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
 
         Returns:
             str: The content of the chapter
         """
-        with open(f"{self.root}/chapters/{chapter}/content.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+        path = f"{self.root}/chapters/{chapter}/content.md"
+        pending = writeBehind.pending(path)
+        if pending is not None:
+            return pending
+
+        return self._readText(path)
 
-    def saveChapterSummary(self, chapter: int, content: str):
+    def saveChapterSummary(self, chapter: str, content: str):
         """ Saves a chapter summary
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             content (str): The chapter summary
         """
         print(f"Saving chapter {chapter} summary")
-        if not os.path.exists(f"{self.root}/chapters/{chapter}"):
-            os.makedirs(f"{self.root}/chapters/{chapter}")
-            
-        with open(f"{self.root}/chapters/{chapter}/summary.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/chapters/{chapter}/summary.md", content)
 
-    def loadChapterSummary(self, chapter: int) -> str:
+    def loadChapterSummary(self, chapter: str) -> str:
         """ Loads the chapter summary
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
 
         Returns:
             str: The chapter summary
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}/summary.md"):
-            return None
+        return self._readText(f"{self.root}/chapters/{chapter}/summary.md")
 
-        with open(f"{self.root}/chapters/{chapter}/summary.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+    def loadSummarySource(self, chapter: str) -> str:
+        """ Loads the chapter content the stored summary was made from
 
-    def loadChapterCharacters(self, chapter: int) -> [str]:
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            str: The content, or None if it was not kept
+        """
+        return self._readText(f"{self.root}/chapters/{chapter}/summary_source.md")
+
+    def saveSummarySource(self, chapter: str, content: str):
+        """ Saves the chapter content a summary was made from, so edits can later be summarized on their own
+
+        Args:
+            chapter (str): The id of the chapter
+            content (str): The content of the chapter
+        """
+        self._writeText(f"{self.root}/chapters/{chapter}/summary_source.md", content)
+
+    def loadSegmentSummaries(self, chapter: str) -> dict:
+        """ Loads the summaries of the segments of a long chapter
+
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            dict: The summary of each segment keyed by the hash of the segment's text
+        """
+        content = self._readText(f"{self.root}/chapters/{chapter}/segment_summaries.json")
+        if content is None:
+            return {}
+        return json.loads(content)
+
+    def saveSegmentSummaries(self, chapter: str, summaries: dict):
+        """ Saves the summaries of the segments of a long chapter
+
+        Args:
+            chapter (str): The id of the chapter
+            summaries (dict): The summary of each segment keyed by the hash of the segment's text
+        """
+        self._writeText(f"{self.root}/chapters/{chapter}/segment_summaries.json", json.dumps(summaries))
+
+    def loadDerivedSources(self, chapter: str) -> dict:
+        """ Loads what each artifact derived from a chapter, such as its summary or evaluations, was made from
+
+        Args:
+            chapter (str): The id of the chapter
+
+        Returns:
+            dict: For each artifact, the hash of the content it was made from with the prompt version and model
+        """
+        content = self._readText(f"{self.root}/chapters/{chapter}/derived.json")
+        if content is None:
+            return {}
+        return json.loads(content)
+
+    def saveDerivedSources(self, chapter: str, sources: dict):
+        """ Saves what each artifact derived from a chapter was made from
+
+        Args:
+            chapter (str): The id of the chapter
+            sources (dict): For each artifact, the hash of the content it was made from with the prompt version and model
+        """
+        self._writeText(f"{self.root}/chapters/{chapter}/derived.json", json.dumps(sources, indent=4))
+
+    def loadChapterCharacters(self, chapter: str) -> [str]:
         """Loads the list of characters for the chapter
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
 
         Returns:
             [str]: An array of character names
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}/characters.md"):
+        content = self._readText(f"{self.root}/chapters/{chapter}/characters.md")
+        if content is None:
             return None
 
-        with open(f"{self.root}/chapters/{chapter}/characters.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content.split("\n")
+        return content.split("\n")
 
-    def saveChapterCharacters(self, chapter: int, characters: [str]):
+    def saveChapterCharacters(self, chapter: str, characters: [str]):
         """Saves the list of characters that are in the chapter
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             characters ([str]): An array of character names
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}"):
-            os.makedirs(f"{self.root}/chapters/{chapter}")
+        self._writeText(f"{self.root}/chapters/{chapter}/characters.md", "\n".join(characters))
 
-        with open(f"{self.root}/chapters/{chapter}/characters.md", "w") as f:
-            f.write("\n".join(characters))
-            f.close()
-
-    def saveCharacter(self, chapter: int, character: str, content: str):
+    def saveCharacter(self, chapter: str, character: str, content: str):
         """Saves a character's description summary for the chapter
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             character (str): The character's name
             content (str): The summary for the character for the chapter
 
         """
-        if not os.path.exists(f"{self.root}/characters/{chapter}/"):
-            os.makedirs(f"{self.root}/characters/{chapter}")
+        self._writeText(f"{self.root}/characters/{chapter}/characters/{character}.md", content)
 
-        character_root = f"{self.root}/characters/{chapter}/characters"
-        if not os.path.exists(character_root):
-            os.makedirs(character_root)
-        with open(f"{character_root}/{character}.md", "w") as f:
-            f.write(content)
-            f.close()
-
-    def loadCharacterDescription(self, chapter: int, character: str):
+    def loadCharacterDescription(self, chapter: str, character: str):
         """Loads a character description
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             character (str): The character's name
         """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}/characters/{character}.md"):
-            return None
-
-        with open(f"{self.root}/chapters/{chapter}/characters/{character}.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+        return self._readText(f"{self.root}/chapters/{chapter}/characters/{character}.md")
 
-    def saveCharacterDescription(self, chapter: int, character: str, content: str):
+    def saveCharacterDescription(self, chapter: str, character: str, content: str):
         """Saves a character description
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             character (str): The name of the character
             content (str): The character description
         """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        if not os.path.exists(chapter_root):
-            os.makedirs(chapter_root)
-
-        character_root = f"{chapter_root}/characters"
-        if not os.path.exists(character_root):
-            os.makedirs(character_root)
-        with open(f"{character_root}/{character}.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/chapters/{chapter}/characters/{character}.md", content)
 
-    def characterExists(self, chapter: int, name: str) -> bool:
+    def characterExists(self, chapter: str, name: str) -> bool:
         """Checks to see if the character exists in the book
 
         Args:
-            chapter (int): The chapter number in the book
+            chapter (str): The id of the chapter
             name (str): The name of the character
         """
-        return os.path.exists(f"{self.root}/chapters/{chapter}/characters/{name}.md")
+        return self._fileExists(f"{self.root}/chapters/{chapter}/characters/{name}.md")
 
     def listChapters(self):
-        return os.listdir(f"{self.root}/chapters")
+        return [chapter['id'] for chapter in self.loadChapterOrder()]
 
     def listBooks(self):
         # Get a list of all directories
-        directories = [d for d in os.listdir(self.libraryRoot) if os.path.isdir(os.path.join(self.libraryRoot, d))]
+        directories = [d for d in os.listdir(self.libraryRoot) if os.path.isdir(os.path.join(self.libraryRoot, d)) and not d.startswith(".")]
 
         return directories
 
@@ -243,13 +538,7 @@ class Storage:
         Returns:
             str: The visual description of the character
         """
-        if not os.path.exists(f"{self.root}/characters/{character}/description.md"):
-            return None
-
-        with open(f"{self.root}/characters/{character}/description.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+        return self._readText(f"{self.root}/characters/{character}/description.md")
 
     def saveCharacterVisualDescription(self, character: str, content: str):
         """ Saves the visual description of the character
@@ -258,36 +547,46 @@ class Storage:
             character (str): The name of the character
             content (str): The visual description of the character
         """
-        character_root = f"{self.root}/characters/{character}"
-        if not os.path.exists(character_root):
-            os.makedirs(character_root)
+        self._writeText(f"{self.root}/characters/{character}/description.md", content)
 
-        with open(f"{character_root}/description.md", "w") as f:
-            f.write(content)
-            f.close()
+    def _characterThumbnailSource(self, character: str) -> str:
+        """ Gets the path of the original image stored for the character """
+        digest = self._loadBlobRecord(f"{self.root}/characters/{character}/thumbnail.json")
+        if digest is not None:
+            return self.blobs.path(digest)
+
+        # Thumbnails saved before the blob store existed
+        return f"{self.root}/characters/{character}/thumbnail.png"
 
-    def loadCharacterThumbnail(self, character: str) -> any:
+    def loadCharacterThumbnail(self, character: str, size: tuple = (500, 500), format: str = None) -> any:
         """ Loads a character's thumbnail from the image stored for the character
 
+        The resized thumbnail is generated once and served from the rendition
+        cache until a new image is saved for the character.
+
         Args:
             character (str): The name of the character
+            size (tuple): The width and height of the thumbnail
+            format (str): The image format, PNG, WEBP or JPEG. Defaults to the configured thumbnail format
 
         Returns:
             any: The image byte buffer
         """
-        if not os.path.exists(f"{self.root}/characters/{character}/thumbnail.png"):
-            return None
+        if format is None:
+            format = self.thumbnailFormat
 
-        
-        with open(f"{self.root}/characters/{character}/thumbnail.png", "rb") as f:
-            content = f.read()
-            f.close()
-            
-            image = Image.open(BytesIO(content))
-            resized_image = image.resize((500, 500))
-            output_buffer = BytesIO()
-            resized_image.save(output_buffer, format="PNG")
-            return output_buffer.getvalue()
+        return self.renditions.get(self._characterThumbnailSource(character), size, format)
+
+    def thumbnailMimeType(self, format: str = None) -> str:
+        """ Gets the mime type of thumbnails loaded in a format
+
+        Args:
+            format (str): The image format. Defaults to the configured thumbnail format
+
+        Returns:
+            str: The mime type of the thumbnails
+        """
+        return MIME_TYPES[format if format is not None else self.thumbnailFormat]
 
     def saveCharacterThumbnail(self, character: str, content: any):
         """ Saves a thumbnail for the character
@@ -297,43 +596,35 @@ class Storage:
             content (any): The png data for the image
         """
         character_root = f"{self.root}/characters/{character}"
-        if not os.path.exists(character_root):
-            os.makedirs(character_root)
 
-        with open(f"{character_root}/thumbnail.png", "wb") as f:
-            f.write(content)
-            f.close()
+        # Renditions of the previous image will never be requested again
+        self.renditions.invalidate(self._characterThumbnailSource(character))
+
+        self._saveBlobRecord(f"{character_root}/thumbnail.json", content)
+        if os.path.exists(f"{character_root}/thumbnail.png"):
+            os.remove(f"{character_root}/thumbnail.png")
 
     def getCharacterNames(self):
         """Gets all the character names for the book"""
-        return os.listdir(f"{self.root}/characters")
+        return self._listDir(f"{self.root}/characters")
 
     def loadWritingStyle(self):
         """ Loads the writing style for the book"""
+        return self._readText(f"{self.root}/writing_style.md")
 
-        if not os.path.exists(f"{self.root}/writing_style.md"):
-            return None
-
-        with open(f"{self.root}/writing_style.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
-    
     def saveWritingStyle(self, content: str):
         """ Saves the notes on the writing style
 
         Args:
             content (str): The notes on the writing style
         """
-        with open(f"{self.root}/writing_style.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/writing_style.md", content)
 
-    def renameCharacter(self, chapter: int, old_name: str, new_name: str):
+    def renameCharacter(self, chapter: str, old_name: str, new_name: str):
         """Rename character in chapter characters
 
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             old_name (str): The name the character used to have
             new_name (str): The new name of the character
         """
@@ -352,9 +643,8 @@ class Storage:
             self.saveChapterCharacters(chapter, chapterCharacters)
 
             # remove chapter character summary
-            if os.path.exists(f"{self.root}/chapters/{chapter}/characters/{old_name}.md"):
-                os.remove(f"{self.root}/chapters/{chapter}/characters/{old_name}.md")
-    
+            self._removeText(f"{self.root}/chapters/{chapter}/characters/{old_name}.md")
+
     def removeCharacter(self, name: str):
         """Removes a character from the book
         Args:
@@ -362,19 +652,17 @@ class Storage:
         """
         # remove character from all chapters
         for chapter in self.listChapters():
-            if os.path.exists(f"{self.root}/chapters/{chapter}/characters/{name}.md"):
-                os.remove(f"{self.root}/chapters/{chapter}/characters/{name}.md")
+            self._removeText(f"{self.root}/chapters/{chapter}/characters/{name}.md")
 
-        # remove character from characters folder
-        if os.path.exists(f"{self.root}/characters/{name}"):
-            # Remove directory and all contents
-            shutil.rmtree(f"{self.root}/characters/{name}")
+        # remove character from characters folder and all contents
+        self._releaseBlobRecords(f"{self.root}/characters/{name}")
+        self._removeTree(f"{self.root}/characters/{name}")
 
 
-    def deleteCharacter(self, chapter: int, name: str):
+    def deleteCharacter(self, chapter: str, name: str):
         """Deletes a character from the chapter
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             name (str): The name of the character
         """
         chapterCharacters = self.loadChapterCharacters(chapter)
@@ -390,87 +678,114 @@ class Storage:
             self.saveChapterCharacters(chapter, chapterCharacters)
 
             # remove chapter character summary
-            if os.path.exists(f"{self.root}/chapters/{chapter}/characters/{name}.md"):
-                os.remove(f"{self.root}/chapters/{chapter}/characters/{name}.md")
-    
-    def getParagraphAudio(self, chapter: int, paragraph: int) -> any:
-        """Gets the audio for the paragraph
-        Args:
-            chapter (int): The chapter number
-            paragraph (int): The paragraph number
-        """
-        if not os.path.exists(f"{self.root}/chapters/{chapter}/audio/paragraph_{paragraph}.mp3"):
-            return None
+            self._removeText(f"{self.root}/chapters/{chapter}/characters/{name}.md")
 
-        with open(f"{self.root}/chapters/{chapter}/audio/paragraph_{paragraph}.mp3", "rb") as f:
-            content = f.read()
-            f.close()
-            return content
+    @property
+    def audioCache(self) -> AudioCache:
+        """ The synthesized speech shared by every book in the library """
+        return getAudioCache(self.libraryRoot)
 
-    def saveParagraphAudio(self, chapter: int, paragraph: int, audio: any):
-        """Saves the audio for the paragraph
+    def loadSpeechAudio(self, key: str) -> bytes:
+        """Gets cached speech
         Args:
-            chapter (int): The chapter number
-            paragraph (int): The paragraph number
-            audio (any): The audio data
+            key (str): The key of the speech, from the text and the voice that speaks it
+
+        Returns: The audio, or None if the speech has not been synthesized
         """
-        # Validate folder exists
-        chapter_root = f"{self.root}/chapters/{chapter}/audio"
-        if not os.path.exists(chapter_root):
-            os.makedirs(chapter_root)
+        return self.audioCache.get(key)
 
-        # See if we're saving or deleting a file
-        file_name = f"{chapter_root}/paragraph_{paragraph}.mp3"
+    def saveSpeechAudio(self, key: str, audio: bytes):
+        """Saves synthesized speech
+        Args:
+            key (str): The key of the speech, from the text and the voice that speaks it
+            audio (bytes): The audio, or None to remove the speech from the cache
+        """
         if audio is not None:
-            with open(file_name, "wb") as f:
-                f.write(audio)
-                f.close()
+            self.audioCache.put(key, audio)
         else:
-            # Delete audio file if it exists
-            if os.path.exists(file_name):
-                os.remove(file_name)
+            self.audioCache.remove(key)
+
+    def saveSpeechStream(self, key: str, chunks: any) -> bool:
+        """Saves synthesized speech as it is produced, without holding all of it in memory
+        Args:
+            key (str): The key of the speech, from the text and the voice that speaks it
+            chunks (any): An iterable of the bytes of the audio
+
+        Returns: True if any audio was saved
+        """
+        return self.audioCache.putStream(key, chunks)
+
+    def writeSpeechAudio(self, key: str, sink: any) -> bool:
+        """Copies cached speech into a file-like sink one block at a time
+        Args:
+            key (str): The key of the speech, from the text and the voice that speaks it
+            sink (any): The writable binary file to copy into
+
+        Returns: True if the speech was cached and copied
+        """
+        path = self.audioCache.path(key)
+        if path is None:
+            return False
+
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, sink)
+            f.close()
+        return True
+
+    @property
+    def audiobookRoot(self) -> str:
+        """ The directory exported audiobook files are written to """
+        return f"{self.root}/audiobook"
+
+    def loadAudiobookProgress(self) -> dict:
+        """Loads the progress manifest of the audiobook export
 
-    def hasCharacterSummary(self, chapter: int, character: str) -> bool:
+        Returns: The progress of the export, or None if the book has not been exported
+        """
+        content = self._readText(f"{self.audiobookRoot}/progress.json")
+        if content is None:
+            return None
+        return json.loads(content)
+
+    def saveAudiobookProgress(self, progress: dict):
+        """Saves the progress manifest of the audiobook export
+        Args:
+            progress (dict): The progress of the export
+        """
+        self._writeText(f"{self.audiobookRoot}/progress.json", json.dumps(progress, indent=4))
+
+    def hasCharacterSummary(self, chapter: str, character: str) -> bool:
         """Checks to see if the character summary exists for the chapter
 
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             character (str): The name of the character
 
         Returns: True if the summary exists
         """
-        return os.path.exists(f"{self.root}/chapters/{chapter}/characters/{character}_summary.md")
+        return self._fileExists(f"{self.root}/chapters/{chapter}/characters/{character}_summary.md")
 
-    def loadCharacterSummary(self, chapter: int, character: str):
+    def loadCharacterSummary(self, chapter: str, character: str):
         """Loads the summary of the character for everything up to the chapter
 
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             character (str): The name of the character
         """
         characters_dir = f"{self.root}/chapters/{chapter}/characters"
-        if not os.path.exists(f"{characters_dir}/{character}_summary.md"):
+        if not self._fileExists(f"{characters_dir}/{character}_summary.md"):
             return None
 
-        with open(f"{characters_dir}/{character}.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+        return self._readText(f"{characters_dir}/{character}.md")
 
-    def saveCharacterSummary(self, chapter: int, character: str, content: str):
+    def saveCharacterSummary(self, chapter: str, character: str, content: str):
         """Saves the summary of the character for everything up to the chapter
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             character (str): The name of the character
             content (str): The summary of the character
         """
-        characters_dir = f"{self.root}/chapters/{chapter}/characters"
-        if not os.path.exists(characters_dir):
-            os.makedirs(characters_dir)
-
-        with open(f"{characters_dir}/{character}_summary.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/chapters/{chapter}/characters/{character}_summary.md", content)
 
     def loadCharacterExpertise(self, character: str) -> str:
         """Loads the expertise of the character
@@ -481,13 +796,7 @@ class Storage:
         Returns:
             str: The expertise of the character
         """
-        if not os.path.exists(f"{self.root}/characters/{character}/expertise.md"):
-            return None
-
-        with open(f"{self.root}/characters/{character}/expertise.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
+        return self._readText(f"{self.root}/characters/{character}/expertise.md")
 
     def saveCharacterExpertise(self, character: str, content: str):
         """Saves the expertise of the character
@@ -496,73 +805,39 @@ class Storage:
             character (str): The name of the character
             content (str): The expertise of the character
         """
-        character_root = f"{self.root}/characters/{character}"
-        if not os.path.exists(character_root):
-            os.makedirs(character_root)
-
-        with open(f"{character_root}/expertise.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/characters/{character}/expertise.md", content)
 
-    def loadChapterTechnicalEval(self, chapter: int):
+    def loadChapterTechnicalEval(self, chapter: str):
         """Loads the technical evaluation of the chapter
         """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        if not os.path.exists(f"{chapter_root}/technical_eval.md"):
-            return None
+        return self._readText(f"{self.root}/chapters/{chapter}/technical_eval.md")
 
-        # Load the technical evaluation
-        with open(f"{chapter_root}/technical_eval.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
-
-    def saveChapterTechnicalEval(self, chapter: int, content: str):
+    def saveChapterTechnicalEval(self, chapter: str, content: str):
         """Saves the technical evaluation of the chapter
 
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             content (str): The technical evaluation of the chapter
         """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        if not os.path.exists(chapter_root):
-            os.makedirs(chapter_root)
-
-        with open(f"{chapter_root}/technical_eval.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/chapters/{chapter}/technical_eval.md", content)
 
-    def loadChapterEntertainmentEval(self, chapter: int) -> str:
+    def loadChapterEntertainmentEval(self, chapter: str) -> str:
         """Loads the entertainment evaluation of the chapter
         Args:
-            chapter (int): The chapter number
-        
+            chapter (str): The id of the chapter
+
         Returns:
             The entertainment eval
         """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        if not os.path.exists(f"{chapter_root}/entertainment_eval.md"):
-            return None
+        return self._readText(f"{self.root}/chapters/{chapter}/entertainment_eval.md")
 
-        # Load the entertainment evaluation
-        with open(f"{chapter_root}/entertainment_eval.md", "r") as f:
-            content = f.read()
-            f.close()
-            return content
-        
-    def saveChapterEntertainmentEval(self, chapter: int, content: str):
+    def saveChapterEntertainmentEval(self, chapter: str, content: str):
         """Saves the entertainment evaluation of the chapter
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
             content (str): The entertainment evaluation of the chapter
         """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        if not os.path.exists(chapter_root):
-            os.makedirs(chapter_root)
-
-        with open(f"{chapter_root}/entertainment_eval.md", "w") as f:
-            f.write(content)
-            f.close()
+        self._writeText(f"{self.root}/chapters/{chapter}/entertainment_eval.md", content)
 
     def getSettings(self):
         """Gets the settings for tool
@@ -570,43 +845,55 @@ class Storage:
         Returns:
             The settings for the book
         """
-        if not os.path.exists(f"{self.libraryRoot}/settings.json"):
+        content = self._readText(f"{self.libraryRoot}/settings.json")
+        if content is None:
             return { "gen_ai": [] }
 
-        with open(f"{self.libraryRoot}/settings.json", "r") as f:
-            content = f.read()
-            f.close()
-            return json.loads(content)
-        
+        return json.loads(content)
+
     def saveSettings(self, settings: dict):
         """Saves the settings for the book
 
         Args:
             settings (dict): The settings for the book
         """
-        with open(f"{self.libraryRoot}/settings.json", "w") as f:
-            f.write(json.dumps(settings, indent=4))
-            f.close()
-
-    def moveChapterNumber(self, chapter: int, new_number: int):
-        """Moves the chapter to a new number
-        Args:
-            chapter (int): The chapter number
-            new_number (int): The new chapter number
-        """
-        chapter_root = f"{self.root}/chapters/{chapter}"
-        new_root = f"{self.root}/chapters/{new_number}"
-
-        logger.info(f"Moving chapter {chapter} to {new_number}")
-        # Move directory from chapter_root to new_root
-        shutil.move(chapter_root, new_root)
+        self._writeText(f"{self.libraryRoot}/settings.json", json.dumps(settings, indent=4))
 
-    def deleteChapter(self, chapter: int):
+    def deleteChapter(self, chapter: str, speech_keys: [str] = None):
         """Deletes the chapter
         Args:
-            chapter (int): The chapter number
+            chapter (str): The id of the chapter
+            speech_keys ([str]): The keys of the speech of the chapter's paragraphs, released from the speech cache
         """
         chapter_root = f"{self.root}/chapters/{chapter}"
         logger.info(f"Deleting chapter {chapter}")
-        # Delete directory and all contents
-        shutil.rmtree(chapter_root)
+        self.flush()
+        for key in speech_keys or []:
+            self.audioCache.remove(key)
+        # Saves of the chapter that could not be written must not recreate it once deleted
+        writeBehind.discard(f"{chapter_root}/")
+        # Delete directory and all contents, releasing audio cached per paragraph by earlier versions
+        self._releaseBlobRecords(f"{chapter_root}/audio")
+        self._removeTree(chapter_root)
+
+def openStorage(title: str) -> Storage:
+    """ Opens the storage for a book using the engine configured in the settings
+
+    Args:
+        title (str): The title of the book
+
+    Returns:
+        Storage: The storage for the book
+    """
+    settings = Storage(None).getSettings()
+    writeBehind.delay = float(settings.get('autosave_delay', writeBehind.delay))
+
+    engine = settings.get('storage_engine', 'files')
+    if engine == 'sqlite' and title is not None:
+        from .sqlite_storage import SqliteStorage
+        storage = SqliteStorage(title)
+    else:
+        storage = Storage(title)
+
+    storage.thumbnailFormat = settings.get('thumbnail_format', storage.thumbnailFormat).upper()
+    return storage
@@ -0,0 +1,63 @@
+import wave
+from io import BytesIO
+import logging as lg
+
+logger = lg.getLogger(__name__)
+
+class WavWriter:
+    """ Joins WAV audio into a single WAV file
+
+    WAV files cannot simply be concatenated since each has its own header,
+    so the samples of every part are appended under one header that is
+    written once the total length is known. The sink must be seekable.
+    """
+    def __init__(self, sink: any):
+        self._sink = sink
+        self._writer = None
+        self._params = None
+
+    def append(self, audio: bytes) -> bool:
+        """ Appends the samples of a WAV file
+
+        Args:
+            audio (bytes): The WAV file
+
+        Returns:
+            bool: True if the audio was appended, False if its format does not match the earlier parts
+        """
+        with wave.open(BytesIO(audio), 'rb') as part:
+            params = (part.getnchannels(), part.getsampwidth(), part.getframerate())
+            if self._params is None:
+                self._params = params
+                self._writer = wave.open(self._sink, 'wb')
+                self._writer.setnchannels(params[0])
+                self._writer.setsampwidth(params[1])
+                self._writer.setframerate(params[2])
+            elif params != self._params:
+                logger.warning(f"Skipping WAV audio with format {params}, expected {self._params}")
+                return False
+
+            self._writer.writeframes(part.readframes(part.getnframes()))
+        return True
+
+    def close(self):
+        """ Writes the final header, leaving the sink open """
+        # Nothing appended leaves nothing to write
+        if self._writer is not None:
+            self._writer.close()
+
+def join(parts: [bytes]) -> bytes:
+    """ Joins WAV files into one
+
+    Args:
+        parts ([bytes]): The WAV files, all with the same format
+
+    Returns:
+        bytes: The joined WAV file
+    """
+    output = BytesIO()
+    writer = WavWriter(output)
+    for part in parts:
+        writer.append(part)
+    writer.close()
+    return output.getvalue()
@@ -0,0 +1,161 @@
+import atexit
+import threading
+import time
+import logging as lg
+
+logger = lg.getLogger(__name__)
+
+class WriteBehindQueue:
+    """ Coalesces repeated saves of the same artifact and writes them on a background thread
+
+    Each scheduled save replaces any pending save with the same key, and is
+    written once no newer save for that key arrives within the delay. A save
+    that fails to write stays queued and is tried again after the delay.
+    """
+    def __init__(self, delay: float = 2.0):
+        self.delay = delay
+        self._pending = {}
+        self._inflight = {}
+        self._failures = {}
+        self._condition = threading.Condition()
+        self._writing = threading.Lock()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def schedule(self, key: str, write: any, content: any):
+        """ Schedules a save, replacing any pending save with the same key
+
+        Args:
+            key (str): The identity of the artifact, usually its path
+            write (any): The function that persists the content
+            content (any): The content to persist
+        """
+        with self._condition:
+            self._pending[key] = (time.monotonic() + self.delay, write, content)
+            self._ensureThread()
+            self._condition.notify()
+
+    def writeNow(self, key: str, write: any, content: any):
+        """ Persists content immediately, superseding any pending save with the same key
+
+        Args:
+            key (str): The identity of the artifact, usually its path
+            write (any): The function that persists the content
+            content (any): The content to persist
+        """
+        with self._writing:
+            with self._condition:
+                self._pending.pop(key, None)
+            write(content)
+            with self._condition:
+                self._failures.pop(key, None)
+
+    def pending(self, key: str) -> any:
+        """ Gets content that has been scheduled but not yet written
+
+        Args:
+            key (str): The identity of the artifact
+
+        Returns:
+            any: The newest unwritten content, or None if everything is written
+        """
+        with self._condition:
+            if key in self._pending:
+                return self._pending[key][2]
+            return self._inflight.get(key, None)
+
+    def discard(self, prefix: str):
+        """ Drops the pending saves and failures of every artifact whose key starts with prefix, such as a deleted chapter
+
+        Args:
+            prefix (str): The start of the keys to drop
+        """
+        with self._condition:
+            for key in [key for key in self._pending if key.startswith(prefix)]:
+                del self._pending[key]
+            for key in [key for key in self._failures if key.startswith(prefix)]:
+                del self._failures[key]
+
+    def failures(self) -> dict:
+        """ Gets the saves that failed to write and are waiting to be tried again
+
+        Returns:
+            dict: The error of the last attempt keyed by the identity of the artifact
+        """
+        with self._condition:
+            return dict(self._failures)
+
+    def flush(self) -> [str]:
+        """ Writes every pending save now, blocking until they are persisted
+
+        Returns:
+            [str]: The keys of the saves that failed to write, which stay queued
+        """
+        failed = []
+        with self._writing:
+            # Writes can schedule follow-up saves, so drain until nothing is left but the failures
+            while True:
+                with self._condition:
+                    entries = [(key, entry) for key, entry in self._pending.items() if key not in failed]
+                    for key, _ in entries:
+                        del self._pending[key]
+                if len(entries) == 0:
+                    break
+                failed += self._write(entries)
+        return failed
+
+    def _ensureThread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while len(self._pending) == 0:
+                    self._condition.wait()
+
+                next_due = min(due for (due, _, _) in self._pending.values())
+                wait = next_due - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+            with self._writing:
+                with self._condition:
+                    now = time.monotonic()
+                    entries = [(key, entry) for key, entry in self._pending.items() if entry[0] <= now]
+                    for key, _ in entries:
+                        del self._pending[key]
+                self._write(entries)
+
+    def _write(self, entries: list) -> [str]:
+        with self._condition:
+            for key, (_, _, content) in entries:
+                self._inflight[key] = content
+
+        failed = []
+        for key, (_, write, content) in entries:
+            try:
+                write(content)
+                with self._condition:
+                    self._failures.pop(key, None)
+            except Exception as e:
+                logger.error(f"Failed to write {key}, it will be tried again: {e}")
+                failed.append(key)
+                with self._condition:
+                    self._failures[key] = str(e)
+                    # A newer save of the same artifact supersedes the one that failed
+                    if key not in self._pending:
+                        self._pending[key] = (time.monotonic() + self.delay, write, content)
+                        self._ensureThread()
+                        self._condition.notify()
+            finally:
+                with self._condition:
+                    if self._inflight.get(key, None) is content:
+                        del self._inflight[key]
+        return failed
+
+# Queue shared by every Storage in the process
+writeBehind = WriteBehindQueue()